@@ -0,0 +1,264 @@
+"""
+asyncio counterparts of the import finder and reporter, scans run off the
+event loop and share one bounded pool of workers (Python 3 only)
+"""
+import asyncio
+import functools
+import threading
+import multiprocessing
+import concurrent.futures
+
+
+from compage import introspection, report
+
+
+__all__ = ['WorkerPool', 'AsyncImportFinder', 'AsyncImportReporter']
+
+
+class WorkerPool(object):
+    """
+    Workers shared by concurrent scans, a thread pool for walking the
+    directories and reading files and a process pool for the scanning
+    """
+    def __init__(self, processes=None, threads=None):
+        """
+        Args:
+            processes (int, optional): Number of scanning processes,
+                                       defaults to the number of cpus
+            threads (int, optional): Number of threads, i.e. of scans
+                                     running at once, defaults to 4
+        """
+        super(WorkerPool, self).__init__()
+        self._processes = processes or multiprocessing.cpu_count()
+        self._process_pool = multiprocessing.Pool(self._processes)
+        self._executor = concurrent.futures.ThreadPoolExecutor(threads or 4)
+        # Started with the first event, the scanning processes only see
+        # events shared through a manager
+        self._manager = None
+        self._lock = threading.Lock()
+
+    @property
+    def processes(self):
+        return self._processes
+
+    @property
+    def process_pool(self):
+        return self._process_pool
+
+    @property
+    def executor(self):
+        return self._executor
+
+    def run(self, func, *args, **kwargs):
+        """
+        Runs `func` on the thread pool, must be called from the running
+        event loop, see `run_in` otherwise
+
+
+        Returns:
+            asyncio.Future
+        """
+        return self.run_in(asyncio.get_running_loop(), func, *args, **kwargs)
+
+    def run_in(self, loop, func, *args, **kwargs):
+        """
+        Runs `func` on the thread pool
+
+
+        Args:
+            loop (asyncio.AbstractEventLoop): Loop of the returned future
+
+
+        Returns:
+            asyncio.Future
+        """
+        return loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs))
+
+    def event(self):
+        """
+        Returns an event shared with the scanning processes, setting it
+        skips the chunks of a scan still queued on the process pool
+        """
+        with self._lock:
+            if self._manager is None:
+                self._manager = multiprocessing.Manager()
+            return self._manager.Event()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._process_pool.terminate()
+        self._process_pool.join()
+        if self._manager is not None:
+            self._manager.shutdown()
+
+
+def _get_loop(loop):
+    """Returns `loop`, or the running loop when it is None"""
+    if loop is not None:
+        return loop
+    return asyncio.get_running_loop()
+
+
+class AsyncImportFinder(object):
+    """
+    Finds imports for a package without blocking the event loop, the
+    futures belong to the loop given or else to the loop running when they
+    are requested
+    """
+    def __init__(self, package_root, pool, loop=None, **kwargs):
+        """
+        Args:
+            package_root (str): Root of the package, see `ImportFinder`
+            pool (WorkerPool): Workers to run the scan on
+            loop (asyncio.AbstractEventLoop, optional): Loop of the
+                                                        futures, defaults
+                                                        to the running one
+            kwargs: Other `ImportFinder` arguments
+        """
+        super(AsyncImportFinder, self).__init__()
+        self._pool = pool
+        self._loop = loop
+        self._finder = introspection.ImportFinder(
+            package_root,
+            workers=pool.processes,
+            pool=pool.process_pool,
+            **kwargs
+        )
+        self._future = None
+
+    @property
+    def finder(self):
+        return self._finder
+
+    def import_data(self, progress=None):
+        """
+        Scans the package, the scan runs once and is shared by all callers
+
+
+        Args:
+            progress (callable, optional): Called on the event loop as
+                                           `progress(file_path, done,
+                                           total)` as files are scanned
+
+
+        Returns:
+            asyncio.Future: Resolves to `ImportFinder.import_data`,
+                            cancelling it stops the scan
+        """
+        if self._future is None or self._future.cancelled():
+            self._future = self._scan(progress)
+        return self._future
+
+    def cancel(self):
+        """Cancels a running scan"""
+        if self._future is not None and not self._future.done():
+            self._future.cancel()
+
+    def _scan(self, progress):
+        loop = _get_loop(self._loop)
+        # Also skips the chunks queued on the shared pool once cancelled
+        cancel = self._pool.event()
+
+        def on_progress(*args):
+            if progress is not None:
+                loop.call_soon_threadsafe(progress, *args)
+
+        future = self._pool.run_in(
+            loop, self._finder.scan, progress=on_progress, cancel=cancel)
+        future.add_done_callback(
+            lambda f: f.cancelled() and cancel.set())
+        return future
+
+
+class AsyncImportReporter(object):
+    """
+    Reports on the imports of a package without blocking the event loop,
+    every report is an `asyncio.Future`
+    """
+    def __init__(self, package_root, pool, required_packages=None,
+                 ignore=None, width=70, loop=None, **kwargs):
+        """
+        Args:
+            package_root (str): Root of the package, see `ImportReporter`
+            pool (WorkerPool): Workers to run the scan and reports on
+            required_packages ([], optional): See `ImportReporter`
+            ignore ([], optional): See `ImportReporter`
+            width (int, optional): See `ImportReporter`
+            loop (asyncio.AbstractEventLoop, optional): Loop of the
+                                                        futures, defaults
+                                                        to the running one
+            kwargs: Other `ImportFinder` arguments
+        """
+        super(AsyncImportReporter, self).__init__()
+        self._package_root = package_root
+        self._pool = pool
+        self._loop = loop
+        self._required_packages = required_packages
+        self._ignore = ignore
+        self._width = width
+        self._finder = AsyncImportFinder(
+            package_root, pool, loop=loop, **kwargs)
+        self._reporter = None
+        self._waiters = set()
+
+    def modules(self, progress=None):
+        return self._report(lambda r: r.modules, progress)
+
+    def import_report(self, progress=None):
+        return self._report(lambda r: r.import_report(), progress)
+
+    def rank_report(self, progress=None):
+        return self._report(lambda r: r.rank_report(), progress)
+
+    def module_report(self, module_name, progress=None):
+        return self._report(lambda r: r.module_report(module_name), progress)
+
+    def _report(self, render, progress):
+        """Chains the shared scan with rendering on the thread pool"""
+        loop = _get_loop(self._loop)
+        result = loop.create_future()
+        scan = self._finder.import_data(progress=progress)
+
+        def on_rendered(future):
+            if result.cancelled():
+                return
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(future.result())
+
+        def on_scanned(future):
+            if result.cancelled():
+                return
+            if future.cancelled():
+                result.cancel()
+                return
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+            reporter = self._get_reporter(future.result())
+            self._pool.run_in(loop, render, reporter).add_done_callback(
+                on_rendered)
+
+        scan.add_done_callback(on_scanned)
+        self._waiters.add(result)
+        result.add_done_callback(self._on_waiter_done)
+        return result
+
+    def _on_waiter_done(self, result):
+        self._waiters.discard(result)
+        # The scan is shared, it is only stopped once nobody waits on it
+        if result.cancelled() and not self._waiters:
+            self._finder.cancel()
+
+    def _get_reporter(self, import_data):
+        if self._reporter is None:
+            self._reporter = report.ImportReporter(
+                self._package_root,
+                required_packages=self._required_packages,
+                ignore=self._ignore,
+                width=self._width,
+                import_data=import_data,
+            )
+        return self._reporter
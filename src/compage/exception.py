@@ -27,6 +27,11 @@ class ServiceAlreadyExistsError(Exception):
     pass
 
 
+class LazyServiceError(ValueError):
+    """Error raised when a service can not be added lazily"""
+    pass
+
+
 # Exceptions for installutils
 class InstallError(Exception):
     """Error raised when install fails"""
@@ -67,3 +72,19 @@ class TreeCreationError(ValueError):
 class TreeRenderError(ValueError):
     """Error raised when unable to render tree"""
     pass
+
+
+# Exceptions for introspection
+class ScanCancelledError(RuntimeError):
+    """Error raised when an import scan is cancelled"""
+    pass
+
+
+class ScanWorkerError(RuntimeError):
+    """Error raised when a scanning worker process exits abnormally"""
+    pass
+
+
+class ImportProfileError(RuntimeError):
+    """Error raised when unable to profile an import"""
+    pass
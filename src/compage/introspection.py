@@ -1,12 +1,90 @@
 """Code Introspection Utilities"""
 import os
+import re
+import sys
+import json
+import site
+import pkgutil
+import sysconfig
+import subprocess
+import ast
+import bisect
+import array
 import struct
 import itertools
 import dis
+import marshal
+import hashlib
+import sqlite3
+import threading
+import zipfile
 import collections
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.managers
 
 
-__all__ = ['ImportScanner', 'ImportFinder']
+from compage import exception
+
+
+__all__ = [
+    'BaseImportScanner',
+    'AstImportScanner',
+    'TokenImportScanner',
+    'ImportScanner',
+    'ImportFinder',
+    'ImportData',
+    'ModuleImports',
+    'ScanCache',
+    'PathMatcher',
+    'ImportChanges',
+    'ImportWatcher',
+    'ImportSnapshot',
+    'ImportDiff',
+    'ModuleGraph',
+    'ReachabilityIndex',
+    'DistributionIndex',
+    'normalize_distribution_name',
+    'ImportCost',
+    'ImportProfiler',
+    'UsageScanner',
+    'UnusedImport',
+    'find_unused_imports',
+    'estimate_import_cost',
+    'file_digest',
+    'is_archive',
+    'is_compiled_file',
+    'read_archive_members',
+    'load_compiled',
+    'SCANNERS',
+    'get_scanner',
+]
+
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from importlib.util import cache_from_source, MAGIC_NUMBER
+except ImportError:
+    # Python 2, compiled files sit next to their source
+    import imp
+    MAGIC_NUMBER = imp.get_magic()
+
+    def cache_from_source(path):
+        return path + ('c' if __debug__ else 'o')
+
+try:
+    from importlib.util import source_hash
+except ImportError:
+    source_hash = None
+
+try:
+    from importlib.util import find_spec
+except ImportError:
+    find_spec = None
 
 
 class Opname(object):
@@ -18,35 +96,507 @@ class Opname(object):
     HAVE_ARGUMENT = chr(dis.HAVE_ARGUMENT)
 
 
-# Adapted from stdlib 'modulefinder'
-class ImportScanner(object):
-    """Scanner for extracting `import` statement in the source code"""
-    def __init__(self, pathname):
-        super(ImportScanner, self).__init__()
-        self._code = self._get_code_oject(pathname)
-        self._source = self._get_source_code(pathname)
+def is_archive(path):
+    """Returns whether `path` is a zip based archive, e.g. a wheel or egg"""
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+def read_archive_members(archive, members, threads=None):
+    """
+    Reads and decodes the source of archive members
+
+
+    Args:
+        archive (str): Path of the zip based archive
+        members ([]): `(key, member_name)` tuples
+        threads (int, optional): Number of threads decompressing members
+
+
+    Returns:
+        [] of `(key, source)`
+    """
+    local = threading.local()
+    opened = []
+
+    def read(item):
+        key, member_name = item
+        # Zip files share their file pointer, each thread opens its own
+        zf = getattr(local, 'zipfile', None)
+        if zf is None:
+            zf = local.zipfile = zipfile.ZipFile(archive)
+            opened.append(zf)
+        return key, _decode_source(zf.read(member_name))
+
+    try:
+        if threads and threads > 1 and len(members) > 1:
+            pool = multiprocessing.pool.ThreadPool(threads)
+            try:
+                return pool.map(read, members)
+            finally:
+                pool.close()
+                pool.join()
+        return [read(item) for item in members]
+    finally:
+        for zf in opened:
+            zf.close()
+
+
+def _decode_source(data):
+    if isinstance(data, str):
+        return data
+    return data.decode('utf-8', 'replace')
+
+
+def is_compiled_file(pathname):
+    """Returns whether `pathname` is a compiled python file"""
+    return pathname.endswith(('.pyc', '.pyo'))
+
+
+def load_compiled(pathname):
+    """
+    Loads a code object from compiled python, without compiling
+
+
+    Args:
+        pathname (str): A source file, whose cached compiled file is loaded
+                        when it is up to date with the source, or a
+                        compiled file
+
+
+    Returns:
+        code object or `None` when no valid compiled file is found
+    """
+    if is_compiled_file(pathname):
+        compiled = pathname
+        source_stat = None
+    else:
+        compiled = cache_from_source(pathname)
+        try:
+            source_stat = os.stat(pathname)
+        except OSError:
+            return None
+
+    try:
+        with open(compiled, 'rb') as fp:
+            data = fp.read()
+    except (IOError, OSError):
+        return None
+
+    if data[:4] != MAGIC_NUMBER:
+        return None
+
+    # Header layouts, PEP 3147 added the source size and PEP 552 the flags
+    if sys.version_info >= (3, 7):
+        flags, = struct.unpack('<I', data[4:8])
+        header_size = 16
+        if flags & 0x1:
+            # Hash based, only checked against the source when asked to
+            mtime = size = None
+            if source_stat is not None and flags & 0x2:
+                with open(pathname, 'rb') as fp:
+                    if source_hash(fp.read()) != data[8:16]:
+                        return None
+        else:
+            mtime, size = struct.unpack('<II', data[8:16])
+    elif sys.version_info >= (3, 3):
+        mtime, size = struct.unpack('<II', data[4:12])
+        header_size = 12
+    else:
+        mtime, = struct.unpack('<I', data[4:8])
+        size = None
+        header_size = 8
+
+    if source_stat is not None and mtime is not None:
+        if mtime != int(source_stat.st_mtime) & 0xFFFFFFFF:
+            return None
+        if size is not None and size != source_stat.st_size & 0xFFFFFFFF:
+            return None
+
+    try:
+        return marshal.loads(data[header_size:])
+    except (EOFError, ValueError, TypeError):
+        return None
+
+
+class BaseImportScanner(object):
+    """
+    Base for the import scanners, a scanner reads the file once and
+    collects `(lineno, line, name, fromlist)` tuples for its imports
+    """
+    def __init__(self, pathname, source=None):
+        """
+        Args:
+            pathname (str): Path of the file to scan
+            source (str, optional): Source of the file when already read,
+                                    e.g. from an archive member
+        """
+        super(BaseImportScanner, self).__init__()
+        self._pathname = pathname
+        if source is None:
+            source = self._read_source(pathname)
+        self._source = source
+        self._line_offsets = None
+        self._records = None
         self._imports = None
 
+    @property
+    def pathname(self):
+        return self._pathname
+
+    @property
+    def records(self):
+        """
+        All the imports as `(lineno, line, name, fromlist, level)` tuples,
+        including relative imports without a module name. `level` is 0
+        for absolute imports, the number of leading dots for relative
+        imports and -1 for implicit relative imports (Python 2 bytecode).
+        """
+        if self._records is None:
+            self._records = []
+            if self._may_import():
+                self._scan()
+            # Only the import lines are kept from here on, the source
+            # buffer and its line index can go.
+            self._source = None
+            self._line_offsets = None
+        return self._records
+
     @property
     def imports(self):
         if self._imports is None:
-            self._imports = []
-            self._scan_code(self._code)
+            self._imports = [r[:4] for r in self.records if r[2]]
         return self._imports
 
-    def _get_source_code(self, pathname):
-        source = None
+    def _scan(self):
+        raise NotImplementedError
+
+    def _may_import(self):
+        """Cheap pre-check, a file without the keyword has no imports"""
+        return 'import' in self._source
+
+    def _read_source(self, pathname):
         with open(pathname, 'r') as fp:
-            source = dict(enumerate(fp.readlines()))
-        return source
+            return fp.read()
+
+    def _get_line(self, lineno):
+        """Returns the source line for `lineno` (1 based) with its newline"""
+        if self._line_offsets is None:
+            self._line_offsets = self._index_lines(self._source)
+
+        index = lineno - 1
+        offsets = self._line_offsets
+        if not 0 <= index < len(offsets):
+            return None
+
+        start = offsets[index]
+        if index + 1 < len(offsets):
+            end = offsets[index + 1]
+        else:
+            end = len(self._source)
+        return self._source[start:end]
+
+    def _index_lines(self, source):
+        """Builds an array of the offsets at which each line starts"""
+        offsets = array.array('L', [0])
+        pos = source.find('\n')
+        while pos != -1:
+            offsets.append(pos + 1)
+            pos = source.find('\n', pos + 1)
+
+        # A trailing newline does not start a new line
+        if len(offsets) > 1 and offsets[-1] == len(source):
+            offsets.pop()
+        return offsets
+
+    def _import_hook(self, lineno, line, name, fromlist, level=0):
+        self._records.append((lineno, line, name, fromlist, level))
+
+
+class AstImportScanner(BaseImportScanner):
+    """
+    Scanner extracting `import` statements from the syntax tree, it does
+    not need to compile to bytecode and works across Python versions
+    """
+    # Nodes that compile to a code object of their own
+    _SCOPE_NODES = tuple(
+        getattr(ast, n)
+        for n in ('FunctionDef', 'AsyncFunctionDef', 'ClassDef', 'Lambda')
+        if hasattr(ast, n)
+    )
+
+    def _scan(self):
+        tree = compile(
+            self._source + '\n', self._pathname, 'exec', ast.PyCF_ONLY_AST)
+        self._scan_scope(tree)
+
+    def _scan_scope(self, scope):
+        # Imports are reported scope by scope, the enclosing scope first,
+        # to yield the same order as scanning the nested code objects.
+        nested = []
+        stack = [iter(ast.iter_child_nodes(scope))]
+        while stack:
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+            elif isinstance(node, self._SCOPE_NODES):
+                nested.append(node)
+            elif isinstance(node, ast.Import):
+                line = self._get_line(node.lineno)
+                for alias in node.names:
+                    self._import_hook(node.lineno, line, alias.name, None)
+            elif isinstance(node, ast.ImportFrom):
+                fromlist = [a.name for a in node.names if a.name != '*']
+                self._import_hook(
+                    node.lineno,
+                    self._get_line(node.lineno),
+                    node.module or '',
+                    fromlist,
+                    node.level or 0,
+                )
+            else:
+                stack.append(iter(ast.iter_child_nodes(node)))
+
+        for node in nested:
+            self._scan_scope(node)
+
+
+class UsageScanner(AstImportScanner):
+    """
+    Scanner that also tracks which names bound by the imports are loaded
+    afterwards, to find the imports a module never uses. Usage is tracked
+    for the whole file rather than per scope, a name loaded anywhere counts
+    as used so that only imports that are certainly dead are reported.
+    """
+    def __init__(self, pathname, source=None):
+        super(UsageScanner, self).__init__(pathname, source=source)
+        self._bindings = None
+        self._loaded = None
+
+    @property
+    def bindings(self):
+        """
+        The names bound by the imports as `(lineno, line, module, name)`
+        tuples, `module` has the leading dots of relative imports
+        """
+        self.records
+        return self._bindings
+
+    @property
+    def unused(self):
+        """Returns the `bindings` whose name is never loaded"""
+        return [b for b in self.bindings if b[3] not in self._loaded]
+
+    def _scan(self):
+        tree = compile(
+            self._source + '\n', self._pathname, 'exec', ast.PyCF_ONLY_AST)
+        self._scan_scope(tree)
+        self._bindings = []
+        self._loaded = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Name):
+                if not isinstance(node.ctx, ast.Store):
+                    self._loaded.add(node.id)
+            elif isinstance(node, ast.Import):
+                self._bind_import(node)
+            elif isinstance(node, ast.ImportFrom):
+                self._bind_import_from(node)
+            elif isinstance(node, (ast.Assign, ast.AugAssign)):
+                self._load_exports(node)
+        self._bindings.sort()
+
+    def _may_import(self):
+        may_import = super(UsageScanner, self)._may_import()
+        if not may_import:
+            self._bindings = []
+            self._loaded = set()
+        return may_import
+
+    def _bind_import(self, node):
+        line = self._get_line(node.lineno)
+        for alias in node.names:
+            # `import a.b` binds `a`, `import a.b as c` binds `c`
+            name = alias.asname or alias.name.split('.', 1)[0]
+            self._bindings.append((node.lineno, line, alias.name, name))
+
+    def _bind_import_from(self, node):
+        module = '.' * (node.level or 0) + (node.module or '')
+        if module == '__future__':
+            return
+        line = self._get_line(node.lineno)
+        for alias in node.names:
+            if alias.name == '*':
+                continue
+            name = alias.asname or alias.name
+            self._bindings.append((node.lineno, line, module, name))
+
+    def _load_exports(self, node):
+        # Names listed in `__all__` are used by `from module import *`
+        if isinstance(node, ast.Assign):
+            targets = node.targets
+        else:
+            targets = [node.target]
+        if not any(isinstance(t, ast.Name) and t.id == '__all__'
+                   for t in targets):
+            return
+        if not isinstance(node.value, (ast.List, ast.Tuple)):
+            return
+        for elt in node.value.elts:
+            value = getattr(elt, 'value', None)
+            if value is None:
+                value = getattr(elt, 's', None)
+            if isinstance(value, (str, type(u''))):
+                self._loaded.add(value)
+
+
+class TokenImportScanner(BaseImportScanner):
+    """
+    Fast scanner extracting `import` statements from a single regular
+    expression pass over the source, skipping strings and comments. It
+    does not build a syntax tree and reports imports in source order.
+    """
+    # Strings and comments are matched only to be skipped over, so that
+    # an `import` inside a docstring is never taken for a statement.
+    _TOKEN_RE = re.compile(
+        r"""
+        '{3}[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*'{3}
+        | "{3}[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"{3}
+        | '[^'\\\n]*(?:\\.[^'\\\n]*)*'
+        | "[^"\\\n]*(?:\\.[^"\\\n]*)*"
+        | \#[^\n]*
+        | (?:^|[;:])[ \t]*(?P<stmt>import|from)\b
+        """,
+        re.MULTILINE | re.DOTALL | re.VERBOSE,
+    )
+    _FROM_RE = re.compile(r'from\s*(\.*)\s*([\w.]*)\s+import\s+(.*)', re.S)
+    _CLEAN_RE = re.compile(r'#[^\n]*|\\\n|[()]')
+    # Import statements hold no strings, only a comment can hide a `;`,
+    # a parenthesis or a backslash
+    _SEPARATOR_RE = re.compile(r'#[^\n]*|;')
+    _COMMENT_RE = re.compile(r'#[^\n]*')
+
+    def _scan(self):
+        source = self._source
+        lineno = 1
+        pos = 0
+        end = 0
+        for match in self._TOKEN_RE.finditer(source):
+            start = match.start('stmt')
+            # Skip non-statements and continuation lines of the last one
+            if start < end:
+                continue
+            lineno += source.count('\n', pos, start)
+            pos = start
+
+            statement = self._get_statement(source, start)
+            end = start + len(statement)
+            line = self._get_line(lineno)
+            for name, fromlist, level in self._parse_statement(statement):
+                self._import_hook(lineno, line, name, fromlist, level)
+
+    def _get_statement(self, source, start):
+        """
+        Returns the simple statement starting at `start`, up to the end of
+        the logical line or the first `;`. The statements following a `;`
+        or the `:` of a compound one-liner are matched on their own.
+        """
+        end = start
+        while True:
+            end = source.find('\n', end + 1)
+            if end == -1:
+                end = len(source)
+                break
+            statement = self._COMMENT_RE.sub('', source[start:end])
+            if (statement.count('(') <= statement.count(')')
+                    and not statement.endswith('\\')):
+                break
+        statement = source[start:end]
+        for match in self._SEPARATOR_RE.finditer(statement):
+            if match.group() == ';':
+                return statement[:match.start()]
+        return statement
+
+    def _parse_statement(self, statement):
+        statement = self._CLEAN_RE.sub(' ', statement)
+        if statement.startswith('import'):
+            for name in statement[6:].split(','):
+                yield name.split()[0], None, 0
+            return
+
+        match = self._FROM_RE.match(statement)
+        if match is None:
+            return
+        dots, name, names = match.groups()
+        fromlist = [n.split()[0] for n in names.split(',') if n.strip()]
+        yield name, [n for n in fromlist if n != '*'], len(dots)
+
+
+# Adapted from stdlib 'modulefinder'
+class ImportScanner(BaseImportScanner):
+    """
+    Scanner for extracting `import` statement from the compiled bytecode,
+    an up to date compiled file is loaded instead of compiling the source
+    and sourceless compiled files can be scanned too (without lines)
+    """
+    def _scan(self):
+        self._scan_code(self._get_code_oject(self._pathname))
+
+    def _read_source(self, pathname):
+        if is_compiled_file(pathname):
+            return None
+        return super(ImportScanner, self)._read_source(pathname)
+
+    def _may_import(self):
+        return (self._source is None
+                or super(ImportScanner, self)._may_import())
+
+    def _get_line(self, lineno):
+        if self._source is None:
+            return None
+        return super(ImportScanner, self)._get_line(lineno)
 
     def _get_code_oject(self, pathname):
-        code = None
-        with open(pathname, 'r') as fp:
-            code = compile(fp.read() + '\n', pathname, 'exec')
-        return code
+        code = load_compiled(pathname)
+        if code is not None:
+            return code
+        if self._source is None:
+            msg = 'Unable to load compiled file "{0}"'.format(pathname)
+            raise ValueError(msg)
+        return compile(self._source + '\n', pathname, 'exec')
 
     def _scanner(self, co):
+        if sys.version_info[0] >= 3:
+            return self._scan_instructions(co)
+        return self._scan_opcodes(co)
+
+    def _scan_instructions(self, co):
+        """
+        Python 3 flavour of `_scan_opcodes`, the instructions are read with
+        `dis` as their size and the opcodes loading constants vary between
+        versions
+        """
+        # The two instructions before the current one, extended arguments
+        # apart
+        loads = [None, None]
+        for instruction in dis.get_instructions(co):
+            opname = instruction.opname
+            if opname == 'EXTENDED_ARG':
+                continue
+            if opname in ('STORE_NAME', 'STORE_GLOBAL'):
+                yield "store", (instruction.offset, instruction.argval)
+            elif opname == 'IMPORT_NAME' and None not in loads:
+                level, fromlist = loads
+                if level.argval == 0:  # absolute import
+                    yield "absolute_import", (
+                        level.offset, fromlist.argval, instruction.argval)
+                else:  # relative import
+                    yield "relative_import", (
+                        level.offset, level.argval, fromlist.argval,
+                        instruction.argval)
+            loads = [loads[1], None]
+            if opname in ('LOAD_CONST', 'LOAD_SMALL_INT'):
+                loads[1] = instruction
+
+    def _scan_opcodes(self, co):
         code = co.co_code
         names = co.co_names
         consts = co.co_consts
@@ -87,86 +637,2741 @@ class ImportScanner(object):
                 i += 1
 
     def _scan_code(self, co):
+        line_map = list(self._addr_line_map(co))
+        # Python 3.9+ compiles the body of a `finally` once per way out of
+        # the `try`, the copies are the same import
+        seen = set()
         for what, args in self._scanner(co):
             addr = args[0]
             args = args[1:]
-            lineno = self._addr_to_lineno(co, addr)
-            line = None
-            if lineno:
-                line = self._source.get(lineno - 1)
+            lineno = self._addr_to_lineno(line_map, addr)
             if what == "store":
-                name, = args
+                continue
             elif what in ("import", "absolute_import"):
                 fromlist, name = args
-                if fromlist is not None:
-                    fromlist = filter(lambda f: f != '*', fromlist)
                 if what == "absolute_import":
                     level = 0
                 else:
                     level = -1
-                self._import_hook(lineno, line, name, fromlist)
             elif what == "relative_import":
                 level, fromlist, name = args
-                if name:
-                    self._import_hook(lineno, line, name, fromlist)
             else:
                 # We don't expect anything else from the generator.
                 raise RuntimeError(what)
 
+            key = (lineno, name, level, fromlist)
+            if fromlist is not None:
+                fromlist = [f for f in fromlist if f != '*']
+            if key in seen:
+                continue
+            seen.add(key)
+            line = None
+            if lineno:
+                line = self._get_line(lineno)
+            self._import_hook(lineno, line, name, fromlist, level)
+
         for c in co.co_consts:
             if isinstance(c, type(co)):
                 self._scan_code(c)
 
-    def _import_hook(self, lineno, line, name, fromlist):
-        self._imports.append((lineno, line, name, fromlist))
-
-    def _addr_to_lineno(self, co, addr):
-        return dict(self._addr_line_map(co)).get(addr)
+    def _addr_to_lineno(self, line_map, addr):
+        # An instruction belongs to the last line starting at or before it
+        index = bisect.bisect_right(line_map, (addr, sys.maxsize)) - 1
+        if index < 0:
+            return None
+        return line_map[index][1]
 
     def _addr_line_map(self, co):
-        def pairwise(iterable):
-            a = iter(iterable)
-            return itertools.izip(a, a)
-
-        last_line_num = None
-        line_num = co.co_firstlineno
-        byte_num = 0
-        for byte_incr, line_incr in pairwise(map(ord, co.co_lnotab)):
-            if byte_incr:
-                if line_num != last_line_num:
-                    yield (byte_num, line_num)
-                    last_line_num = line_num
-                byte_num += byte_incr
-            line_num += line_incr
-        if line_num != last_line_num:
-            yield (byte_num, line_num)
+        # Decodes the line table of any version, the instructions added by
+        # the compiler have no line on recent ones
+        for addr, lineno in dis.findlinestarts(co):
+            if lineno is not None:
+                yield (addr, lineno)
+
+
+# Scanning backends available to the ImportFinder
+SCANNERS = {
+    'ast': AstImportScanner,
+    'token': TokenImportScanner,
+    'bytecode': ImportScanner,
+}
+
+
+def get_scanner(scanner):
+    """
+    Returns the scanner class for a backend
+
+
+    Args:
+        scanner (str or class): Name of a backend in `SCANNERS`, or a
+                                `BaseImportScanner` subclass
+
+
+    Returns:
+        class
+    """
+    if isinstance(scanner, type) and issubclass(scanner, BaseImportScanner):
+        return scanner
+    try:
+        return SCANNERS[scanner]
+    except KeyError:
+        msg = "Unknown scanner '{0}', expected one of {1}".format(
+            scanner, sorted(SCANNERS.keys()))
+        raise ValueError(msg)
+
+
+class ScanCache(object):
+    """
+    On-disk cache of per-file scan results stored in SQLite
+
+    Entries are keyed by absolute file path and validated against the
+    file's mtime and size, and optionally against a hash of its contents
+    so that files merely touched (e.g. by a fresh checkout) are not
+    rescanned. A database written with another `FORMAT_VERSION` is
+    emptied when opened.
+    """
+    # Stored in `PRAGMA user_version`, bump it whenever the shape of the
+    # stored records changes
+    FORMAT_VERSION = 2
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS scans ('
+        'path TEXT PRIMARY KEY, '
+        'scanner TEXT, '
+        'mtime REAL, '
+        'size INTEGER, '
+        'digest TEXT, '
+        'imports BLOB)'
+    )
+
+    def __init__(self, path, use_hash=False):
+        """
+        Args:
+            path (str): Path of the cache database, created if missing
+            use_hash (bool, optional): When true, files whose mtime or
+                                       size changed are hashed and reused
+                                       if their contents did not change
+        """
+        super(ScanCache, self).__init__()
+        self._path = path
+        self._use_hash = use_hash
+        self._connection = sqlite3.connect(path)
+        version = self._connection.execute('PRAGMA user_version').fetchone()
+        with self._connection:
+            if version[0] != self.FORMAT_VERSION:
+                self._connection.execute('DROP TABLE IF EXISTS scans')
+                self._connection.execute(
+                    'PRAGMA user_version = {0:d}'.format(self.FORMAT_VERSION))
+            self._connection.execute(self._SCHEMA)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def use_hash(self):
+        return self._use_hash
+
+    def entries(self, root):
+        """
+        Returns the cached entries for all files under `root`
+
+
+        Args:
+            root (str): Directory to get the entries for
+
+
+        Returns:
+            dict: `{path: (scanner, mtime, size, digest, imports)}`
+        """
+        prefix = os.path.join(os.path.abspath(root), '')
+        # Range query on the primary key, `prefix + max char` bounds every
+        # path starting with prefix.
+        rows = self._connection.execute(
+            'SELECT path, scanner, mtime, size, digest, imports FROM scans '
+            'WHERE path >= ? AND path < ?',
+            (prefix, prefix + u'\U0010ffff'),
+        )
+        entries = {}
+        for path, scanner, mtime, size, digest, imports in rows:
+            entries[path] = (
+                scanner, mtime, size, digest, marshal.loads(bytes(imports)))
+        return entries
+
+    def update(self, entries):
+        """
+        Adds or replaces entries
+
+
+        Args:
+            entries (iterable): `(path, scanner, mtime, size, digest,
+                                imports)` tuples
+        """
+        rows = (
+            (path, scanner, mtime, size, digest,
+             sqlite3.Binary(marshal.dumps(imports)))
+            for path, scanner, mtime, size, digest, imports in entries
+        )
+        with self._connection:
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO scans VALUES (?, ?, ?, ?, ?, ?)',
+                rows,
+            )
+
+    def evict(self, paths):
+        """Removes the entries for `paths`"""
+        with self._connection:
+            self._connection.executemany(
+                'DELETE FROM scans WHERE path = ?',
+                ((path,) for path in paths),
+            )
+
+    def clear(self):
+        """Removes all entries"""
+        with self._connection:
+            self._connection.execute('DELETE FROM scans')
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def file_digest(file_path):
+    """Returns the sha1 hex digest of a file's contents"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Modules that gained or lost importers, `gained` and `lost` map top level
+# module names to lists of file paths, `paths` lists the updated files.
+ImportChanges = collections.namedtuple(
+    'ImportChanges', ['gained', 'lost', 'paths'])
+
+
+class PathMatcher(object):
+    """
+    Include and exclude rules with gitignore semantics, compiled into one
+    regular expression each. Paths are relative to the scanned root and
+    use `/` as separator.
+
+    - `*` and `?` do not match `/`, `**` matches across directories
+    - a pattern ending with `/` only matches directories
+    - a pattern with a `/` elsewhere is anchored at the root, otherwise it
+      matches at any depth
+    - a pattern starting with `!` includes again what an earlier pattern
+      excluded, the last matching pattern wins
+    - files inside an excluded directory are excluded
+
+    Nothing is excluded unless asked for, `DEFAULT_EXCLUDES` lists the
+    usual VCS, virtualenv, cache and build directories to pass as
+    `exclude`.
+    """
+    DEFAULT_EXCLUDES = [
+        '.git/', '.hg/', '.svn/', '.tox/', '.nox/', '.eggs/',
+        '.venv/', 'venv/', 'node_modules/', '__pycache__/', '*.egg-info/',
+        '.mypy_cache/', '.pytest_cache/', '/build/', '/dist/',
+    ]
+
+    def __init__(self, exclude=None, include=None):
+        """
+        Args:
+            exclude ([], optional): Patterns of the paths to skip,
+                                    nothing is skipped when not given
+            include ([], optional): Patterns of the files to scan, all
+                                    the files are scanned when not given
+        """
+        super(PathMatcher, self).__init__()
+        self._exclude = self._parse(exclude or [])
+        self._include = self._parse(include or [])
+        self._exclude_dirs = self._compile(self._exclude, dirs=True)
+        self._exclude_files = self._compile(self._exclude, dirs=False)
+        self._include_files = self._compile(self._include, dirs=False)
+
+    def is_excluded(self, path, is_dir=False):
+        """
+        Returns whether a path is excluded, for a directory whether it
+        should be pruned from the walk
+
+
+        Args:
+            path (str): Path relative to the root, `/` separated
+            is_dir (bool, optional): Whether the path is a directory
+        """
+        if is_dir:
+            return self._matches(self._exclude_dirs, path)
+        if self._matches(self._exclude_files, path):
+            return True
+        if self._include_files is not None:
+            return not self._matches(self._include_files, path)
+        return False
+
+    def _matches(self, compiled, path):
+        """Returns whether the last pattern matching `path` is positive"""
+        if compiled is None:
+            return False
+        regex, negated = compiled
+        match = regex.match(path)
+        if match is None:
+            return False
+        return not negated[match.lastindex - 1]
+
+    def _parse(self, patterns):
+        out = []
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            negated = pattern.startswith('!')
+            if negated:
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if pattern:
+                out.append((self._translate(pattern), negated, dir_only))
+        return out
+
+    def _compile(self, rules, dirs):
+        if not dirs:
+            rules = [r for r in rules if not r[2]]
+        if not rules:
+            return None
+        # Alternatives are tried in order, the last pattern goes first so
+        # that the group matching is the last pattern that matches
+        rules = list(reversed(rules))
+        regex = re.compile('|'.join(
+            '({0})'.format(r[0]) for r in rules), re.DOTALL)
+        return regex, [r[1] for r in rules]
+
+    def _translate(self, pattern):
+        """Translates a pattern to a regular expression matching a path"""
+        anchored = '/' in pattern
+        pattern = pattern.lstrip('/')
+        out = []
+        i, n = 0, len(pattern)
+        while i < n:
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            c = pattern[i]
+            i += 1
+            if c == '*':
+                out.append('[^/]*')
+            elif c == '?':
+                out.append('[^/]')
+            elif c == '[':
+                end = pattern.find(']', i + 1)
+                if end == -1:
+                    out.append(re.escape(c))
+                    continue
+                chars = pattern[i:end].replace('\\', '\\\\')
+                if chars.startswith('!'):
+                    chars = '^' + chars[1:]
+                out.append('[{0}]'.format(chars))
+                i = end + 1
+            elif c == '\\' and i < n:
+                out.append(re.escape(pattern[i]))
+                i += 1
+            else:
+                out.append(re.escape(c))
+        regex = ''.join(out)
+        if not anchored:
+            regex = '(?:.*/)?' + regex
+        return regex + r'\Z'
+
+
+class _PathTable(object):
+    """
+    Interns file paths as nodes of a tree of path components, each
+    directory and name is stored once however many paths share it
+    """
+    def __init__(self):
+        super(_PathTable, self).__init__()
+        self._components = []
+        self._component_ids = {}
+        self._parents = array.array('l')
+        self._names = array.array('L')
+        # {(parent + 1) << 32 | component_id: node}
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self._parents)
+
+    def intern(self, path):
+        """Returns the node of `path`, adding it when new"""
+        node = -1
+        for component in path.split(os.sep):
+            component_id = self._component_ids.get(component)
+            if component_id is None:
+                component_id = len(self._components)
+                self._components.append(component)
+                self._component_ids[component] = component_id
+            key = (node + 1) << 32 | component_id
+            child = self._nodes.get(key)
+            if child is None:
+                child = len(self._parents)
+                self._parents.append(node)
+                self._names.append(component_id)
+                self._nodes[key] = child
+            node = child
+        return node
+
+    def lookup(self, path):
+        """Returns the node of `path`, `None` when it was never interned"""
+        node = -1
+        for component in path.split(os.sep):
+            component_id = self._component_ids.get(component)
+            if component_id is None:
+                return None
+            node = self._nodes.get((node + 1) << 32 | component_id)
+            if node is None:
+                return None
+        return node
+
+    def parent(self, node):
+        return self._parents[node]
+
+    def path(self, node):
+        if node == -1:
+            return ''
+        components = []
+        while node != -1:
+            components.append(self._components[self._names[node]])
+            node = self._parents[node]
+        return os.sep.join(reversed(components))
+
+
+def _increment(counter, key, value):
+    """Adds `value` to a counter dict, dropping the keys down to 0"""
+    value += counter.get(key, 0)
+    if value:
+        counter[key] = value
+    else:
+        counter.pop(key, None)
+
+
+def _read_file_source(file_path):
+    """Returns the source of a file, `None` for compiled files"""
+    if is_compiled_file(file_path):
+        return None
+    with open(file_path, 'r') as fp:
+        return fp.read()
+
+
+class ImportData(object):
+    """
+    Compact store of the imports found by an `ImportFinder`, exposed as a
+    read only mapping of `{top_level_name: {file_path: [(lineno, line)]}}`.
+
+    The file paths are interned component by component, the lines, names
+    and fromlists are interned too, the same import line is shared by many
+    files. Every file keeps its scanner records as ids in a flat array and
+    every module keeps its import sites in two arrays of `(file, record)`,
+    the sites of a file are contiguous. The lines are the ones the scanner
+    read, they always match their line numbers. Counters of sites and
+    files per module, file and directory are kept up to date as files are
+    added and removed, for rankings.
+    """
+    # Ids of a record, `(lineno, line, name, fromlist, level + 1)`
+    _RECORD_SIZE = 5
+
+    def __init__(self):
+        super(ImportData, self).__init__()
+        self._paths = _PathTable()
+        # Interned lines, names and fromlists, id 0 is `None`
+        self._values = [None]
+        self._value_ids = {None: 0}
+        # {file_node: records}
+        self._records = {}
+        # {top_level_name: (file_nodes, record_indices)}
+        self._modules = {}
+        # {file_node: (top_level_names)}
+        self._file_modules = {}
+        # Counters, {top_level_name: sites}, {top_level_name: files},
+        # {file_node: sites}, {dir_node: [sites, files]} and
+        # {dir_node: {top_level_name: files}}
+        self._module_sites = {}
+        self._module_files = {}
+        self._file_sites = {}
+        self._dir_counts = {}
+        self._dir_modules = {}
+
+    def add_file(self, file_path, records):
+        """
+        Adds the imports of a file from its scanner records, a file added
+        before has to be removed first
+
+
+        Args:
+            file_path (str): Path of the file
+            records ([]): `BaseImportScanner.records` of the file
+
+
+        Returns:
+            set: The top level names imported by the file
+        """
+        node = self._paths.intern(file_path)
+        intern = self._intern
+        ids = array.array('l')
+        sites = collections.OrderedDict()
+        for index, (lineno, line, name, fromlist, level) in enumerate(
+                records):
+            if fromlist is not None:
+                fromlist = tuple(fromlist)
+            ids.extend((lineno or 0, intern(line), intern(name),
+                        intern(fromlist), level + 1))
+            # Relative imports without a module name, `from . import x`
+            if name:
+                sites.setdefault(name.split('.', 1)[0], []).append(index)
+        self._records[node] = ids
+
+        for top_level_name, indices in sites.items():
+            columns = self._modules.get(top_level_name)
+            if columns is None:
+                columns = self._modules[top_level_name] = (
+                    array.array('l'), array.array('l'))
+            columns[0].extend([node] * len(indices))
+            columns[1].extend(indices)
+            self._count(node, top_level_name, len(indices), 1)
+        if sites:
+            self._file_modules[node] = tuple(sites)
+        return set(sites)
+
+    def remove_file(self, file_path):
+        """Removes the imports of a file, returns the names it imported"""
+        node = self._paths.lookup(file_path)
+        if node is None or self._records.pop(node, None) is None:
+            return set()
+        module_names = self._file_modules.pop(node, ())
+        for module_name in module_names:
+            file_nodes, indices = self._modules[module_name]
+            start = file_nodes.index(node)
+            stop = start
+            while stop < len(file_nodes) and file_nodes[stop] == node:
+                stop += 1
+            del file_nodes[start:stop]
+            del indices[start:stop]
+            if not file_nodes:
+                del self._modules[module_name]
+            self._count(node, module_name, stop - start, -1)
+        return set(module_names)
+
+    def records(self, file_path):
+        """
+        Returns the scanner records of a file, see
+        `BaseImportScanner.records`, `None` when it was not added
+        """
+        node = self._paths.lookup(file_path)
+        if node not in self._records:
+            return None
+        return self._file_records(node)
+
+    def iter_records(self):
+        """Yields `(file_path, records)` for every file added"""
+        path = self._paths.path
+        for node in self._records:
+            yield path(node), self._file_records(node)
+
+    def file_paths(self):
+        """Returns the paths of the files added, importing or not"""
+        path = self._paths.path
+        return [path(node) for node in self._records]
+
+    def _intern(self, value):
+        value_id = self._value_ids.get(value)
+        if value_id is None:
+            value_id = self._value_ids[value] = len(self._values)
+            self._values.append(value)
+        return value_id
+
+    def _file_records(self, node):
+        values = self._values
+        ids = self._records[node]
+        out = []
+        for offset in range(0, len(ids), self._RECORD_SIZE):
+            lineno, line, name, fromlist, level = ids[
+                offset:offset + self._RECORD_SIZE]
+            fromlist = values[fromlist]
+            if fromlist is not None:
+                fromlist = list(fromlist)
+            out.append((lineno or None, values[line], values[name],
+                        fromlist, level - 1))
+        return out
+
+    def _count(self, node, module_name, num_sites, sign):
+        """Adds (`sign` 1) or removes (-1) the sites of a file's module"""
+        _increment(self._module_sites, module_name, sign * num_sites)
+        _increment(self._module_files, module_name, sign)
+        dir_node = self._paths.parent(node)
+        dir_counts = self._dir_counts.setdefault(dir_node, [0, 0])
+        dir_counts[0] += sign * num_sites
+        file_sites = self._file_sites.get(node, 0)
+        if not file_sites:
+            dir_counts[1] += 1
+        _increment(self._file_sites, node, sign * num_sites)
+        if node not in self._file_sites:
+            dir_counts[1] -= 1
+        if not dir_counts[1]:
+            del self._dir_counts[dir_node]
+
+        dir_modules = self._dir_modules.setdefault(dir_node, {})
+        _increment(dir_modules, module_name, sign)
+        if not dir_modules:
+            del self._dir_modules[dir_node]
+
+    def module_counts(self):
+        """Yields `(top_level_name, sites, files)` for every module"""
+        for module_name, sites in self._module_sites.items():
+            yield module_name, sites, self._module_files[module_name]
+
+    def file_counts(self):
+        """Yields `(file_path, sites, top_level_names)` for every file"""
+        path = self._paths.path
+        for node, sites in self._file_sites.items():
+            yield path(node), sites, self._file_modules[node]
+
+    def directory_counts(self):
+        """
+        Yields `(directory, sites, files, top_level_names)` for every
+        directory with importing files, not counting subdirectories
+        """
+        path = self._paths.path
+        for dir_node, (sites, files) in self._dir_counts.items():
+            yield (path(dir_node), sites, files,
+                   tuple(self._dir_modules[dir_node]))
+
+    def modules_of(self, file_path):
+        """Returns the top level names imported by a file"""
+        node = self._paths.lookup(file_path)
+        return set(self._file_modules.get(node, ()))
+
+    def __getitem__(self, module_name):
+        if module_name not in self._modules:
+            raise KeyError(module_name)
+        return ModuleImports(self, module_name)
+
+    def get(self, module_name, default=None):
+        if module_name not in self._modules:
+            return default
+        return ModuleImports(self, module_name)
+
+    def pop(self, module_name, *default):
+        """Removes a module, returns its imports as a plain dict"""
+        if module_name not in self._modules:
+            if default:
+                return default[0]
+            raise KeyError(module_name)
+        module_imports = ModuleImports(self, module_name)
+        out = module_imports.to_dict()
+        ranges = list(module_imports._get_ranges().values())
+        del self._modules[module_name]
+        for node, start, stop in ranges:
+            self._count(node, module_name, stop - start, -1)
+            module_names = tuple(
+                n for n in self._file_modules[node] if n != module_name)
+            if module_names:
+                self._file_modules[node] = module_names
+            else:
+                del self._file_modules[node]
+        return out
+
+    def __contains__(self, module_name):
+        return module_name in self._modules
+
+    def __iter__(self):
+        return iter(list(self._modules))
+
+    def __len__(self):
+        return len(self._modules)
+
+    def keys(self):
+        return list(self._modules)
+
+    def values(self):
+        return [ModuleImports(self, name) for name in self._modules]
+
+    def items(self):
+        return [(name, ModuleImports(self, name)) for name in self._modules]
+
+    def to_dict(self):
+        """Returns the data as plain nested dicts"""
+        return dict((name, imports.to_dict()) for name, imports
+                    in self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, ImportData):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '<{0} {1} modules, {2} files>'.format(
+            self.__class__.__name__, len(self._modules),
+            len(self._file_modules))
+
+    def _sites(self, module_name, node, start, stop):
+        indices = self._modules[module_name][1]
+        values = self._values
+        ids = self._records[node]
+        out = []
+        for index in indices[start:stop]:
+            offset = index * self._RECORD_SIZE
+            out.append((ids[offset] or None, values[ids[offset + 1]]))
+        return out
+
+
+class ModuleImports(object):
+    """
+    View of the imports of one top level module in `ImportData`, a read
+    only mapping of `{file_path: [(lineno, line)]}`
+    """
+    def __init__(self, import_data, module_name):
+        super(ModuleImports, self).__init__()
+        self._import_data = import_data
+        self._module_name = module_name
+        self._ranges = None
+
+    def _get_ranges(self):
+        """Returns `{file_path: (node, start, stop)}`, in scan order"""
+        if self._ranges is None:
+            file_nodes = self._import_data._modules[self._module_name][0]
+            path = self._import_data._paths.path
+            self._ranges = collections.OrderedDict()
+            start = 0
+            for stop in range(1, len(file_nodes) + 1):
+                if (stop == len(file_nodes)
+                        or file_nodes[stop] != file_nodes[start]):
+                    node = file_nodes[start]
+                    self._ranges[path(node)] = (node, start, stop)
+                    start = stop
+        return self._ranges
+
+    def __getitem__(self, file_path):
+        node, start, stop = self._get_ranges()[file_path]
+        return self._import_data._sites(self._module_name, node, start, stop)
+
+    def get(self, file_path, default=None):
+        if file_path not in self._get_ranges():
+            return default
+        return self[file_path]
+
+    def __contains__(self, file_path):
+        return file_path in self._get_ranges()
+
+    def __iter__(self):
+        return iter(self._get_ranges())
+
+    def __len__(self):
+        return len(self._get_ranges())
+
+    def keys(self):
+        return list(self._get_ranges())
+
+    def values(self):
+        return [self[file_path] for file_path in self._get_ranges()]
+
+    def items(self):
+        return [(file_path, self[file_path])
+                for file_path in self._get_ranges()]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if isinstance(other, ModuleImports):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+def _scan_file(task):
+    """Scans a single file, module level to be picklable for worker pools"""
+    scanner_class, file_path, source = task
+    return file_path, scanner_class(file_path, source=source).records
+
+
+def _scan_chunk(tasks, cancel=None):
+    """
+    Scans a chunk of files in a worker, errors are sent back as results.
+    The rest of the chunk is skipped once `cancel`, an event shared
+    through a manager, is set.
+    """
+    try:
+        records = []
+        for task in tasks:
+            if cancel is not None and cancel.is_set():
+                break
+            records.append(_scan_file(task))
+        return True, records
+    except Exception as e:
+        return False, e
 
 
 class ImportFinder(object):
     """"Finds imports for a package"""
-    def __init__(self, package_root):
+    # Files handed to a worker at once when streaming
+    _STREAM_CHUNKSIZE = 16
+    # Seconds between checks of `cancel` and of the workers while waiting
+    # for results
+    _POLL_INTERVAL = 0.1
+
+    def __init__(self, package_root, scanner='token', workers=None,
+                 cache=None, sourceless=False, threads=None, pool=None,
+                 exclude=None, include=None, dedupe=None):
+        """
+        Args:
+            package_root (str or []): Root directory of the package to
+                                      scan, or a zip based archive (zip,
+                                      wheel, egg or zipapp) whose members
+                                      are read in place. Several roots,
+                                      e.g. packages and a site-packages
+                                      directory, are scanned together.
+            scanner (str or class, optional): Scanning backend, see
+                                              `get_scanner`
+            workers (int, optional): Number of processes to spread the
+                                     scanning over, `None` scans in the
+                                     current process
+            cache (ScanCache or str, optional): Cache of scan results, or
+                                                the path of its database,
+                                                only changed files are
+                                                rescanned. A cache opened
+                                                from a path is closed by
+                                                `close`.
+            sourceless (bool, optional): When true, compiled files without
+                                         a source are scanned too
+            threads (int, optional): Number of threads decompressing
+                                     archive members, `None` reads them in
+                                     the current thread
+            pool (multiprocessing.Pool, optional): Pool shared with other
+                                                   finders, used instead
+                                                   of starting one for
+                                                   `workers` and left
+                                                   running
+            exclude ([], optional): Gitignore style patterns of the paths
+                                    to skip, see `PathMatcher`, e.g.
+                                    `PathMatcher.DEFAULT_EXCLUDES`
+            include ([], optional): Gitignore style patterns of the files
+                                    to scan, all the files by default
+            dedupe (str, optional): How files reached through several
+                                    paths are found, scanning them once:
+                                    'inode' compares the device and inode
+                                    (hard links, symlinks, overlapping
+                                    roots), 'hash' the contents (copies
+                                    too). Defaults to 'inode' with several
+                                    roots, `False` turns it off.
+        """
         self._package_root = package_root
+        if isinstance(package_root, (list, tuple)):
+            self._roots = list(package_root)
+        else:
+            self._roots = [package_root]
+        if dedupe is None:
+            dedupe = 'inode' if len(self._roots) > 1 else False
+        if dedupe not in (False, 'inode', 'hash'):
+            msg = "Unknown dedupe '{0}', expected 'inode' or 'hash'".format(
+                dedupe)
+            raise ValueError(msg)
+        self._dedupe = dedupe
+        self._scanner_class = get_scanner(scanner)
+        self._workers = workers
+        self._owns_cache = False
+        if cache is not None and not isinstance(cache, ScanCache):
+            cache = ScanCache(cache)
+            self._owns_cache = True
+        self._cache = cache
+        self._sourceless = sourceless
+        self._threads = threads
+        self._pool = pool
+        self._matcher = PathMatcher(exclude=exclude, include=include)
+        # {archive_path: {file_path: ZipInfo}}
+        self._archive_members = {}
         self._import_data = None
+        # Imports of the files scanned by `module_imports`, the paths of
+        # these files and the up to date entries of the cache
+        self._partial_data = None
+        self._partial_scanned = set()
+        self._partial_cache = None
+        # {file_path: [file_path, ...]}, the paths of deduplicated files
+        self._aliases = {}
+
+    @property
+    def package_root(self):
+        return self._package_root
+
+    @property
+    def roots(self):
+        """Returns the list of roots scanned"""
+        return list(self._roots)
+
+    def close(self):
+        """Closes the scan cache when the finder opened it"""
+        if self._owns_cache:
+            self._cache.close()
+            self._owns_cache = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     @property
     def import_data(self):
+        """
+        Returns the `ImportData` of the package, a mapping of
+        `{top_level_name: {file_path: [(lineno, line)]}}`
+        """
         if self._import_data is None:
             self._import_data = self._get_imports()
         return self._import_data
 
-    def _get_imports(self):
-        imports = {}
-        for dirpath, dirnames, filenames in os.walk(self._package_root):
+    def scan(self, progress=None, cancel=None):
+        """
+        Scans the files again and rebuilds `import_data`
+
+
+        Args:
+            progress (callable, optional): Called as `progress(file_path,
+                                           done, total)` as each file is
+                                           scanned
+            cancel (threading.Event, optional): Stops the scan when set,
+                                                an event of a
+                                                `multiprocessing.Manager`
+                                                also skips the chunks
+                                                queued on the workers
+
+
+        Returns:
+            dict: `import_data`
+
+
+        Raises:
+            ScanCancelledError: When `cancel` was set during the scan
+        """
+        self._import_data = self._get_imports(
+            progress=progress, cancel=cancel)
+        return self._import_data
+
+    @property
+    def file_imports(self):
+        """
+        Returns the `(lineno, line, name, fromlist, level)` scanner records
+        of every scanned file, see `BaseImportScanner.records`. Built from
+        `import_data` on each call, `ImportData.records` reads the records
+        of a single file.
+
+
+        Returns:
+            dict: {file_path: records}
+        """
+        return dict(self.import_data.iter_records())
+
+    def file_paths(self):
+        """Returns the paths of all the files to scan"""
+        return list(self._iter_file_paths())
+
+    def iter_imports(self, max_pending=None, cancel=None):
+        """
+        Streams the scan results file by file as they finish, in walk
+        order when scanning in this process and in completion order with
+        `workers`. The tree is walked lazily and at most `max_pending`
+        chunks of files are in flight, a slow consumer holds the workers
+        back instead of piling up results. Closing the generator, or
+        setting `cancel`, stops the scan and terminates the workers.
+
+
+        Args:
+            max_pending (int, optional): Maximum number of chunks being
+                                         scanned or waiting to be consumed,
+                                         defaults to twice the workers
+            cancel (threading.Event, optional): Stops the scan when set,
+                                                an event of a
+                                                `multiprocessing.Manager`
+                                                also skips the chunks
+                                                queued on the workers
+
+
+        Yields:
+            `(file_path, imports)`, see `BaseImportScanner.imports`
+        """
+        aliases = {}
+        file_paths = self._iter_unique(self._iter_file_paths(), aliases)
+        scanned = self._iter_scan(
+            file_paths, max_pending=max_pending, cancel=cancel)
+        for file_path, records in scanned:
+            imports = [r[:4] for r in records if r[2]]
+            yield file_path, imports
+            for alias in aliases.pop(file_path, ()):
+                yield alias, imports
+
+        # Duplicates found after their file was yielded are scanned again
+        # rather than keeping every result around for them
+        if cancel is not None and cancel.is_set():
+            return
+        late = [alias for paths in aliases.values() for alias in paths]
+        scanned = self._iter_scan(late, max_pending=max_pending, cancel=cancel)
+        for file_path, records in scanned:
+            yield file_path, [r[:4] for r in records if r[2]]
+
+    def module_imports(self, module_name):
+        """
+        Finds the imports of a single top level module without scanning
+        the whole package, when `import_data` is not built yet. Files
+        with an up to date entry in the cache are not read, files whose
+        source does not mention the name are skipped before scanning, the
+        others are scanned and their imports kept for the next modules
+        asked for.
+
+
+        Args:
+            module_name (str): Top level name of the module
+
+
+        Returns:
+            dict: {file_path: [(lineno, line)]}
+        """
+        if self._import_data is not None:
+            module_data = self._import_data.get(module_name)
+            return module_data.to_dict() if module_data else {}
+
+        if self._partial_data is None:
+            self._partial_data = ImportData()
+            self._partial_cache = self._get_cached_records()
+        partial_data = self._partial_data
+        aliases = {}
+        file_paths = self._iter_unique(self._iter_file_paths(), aliases)
+        for file_path in file_paths:
+            if file_path in self._partial_scanned:
+                continue
+            records = self._partial_cache.pop(
+                os.path.abspath(file_path), None)
+            if records is not None and records[0] == self._stat(file_path):
+                records = records[1]
+            else:
+                source = self._read_file_source(file_path)
+                # An import of the module spells out its name, compiled
+                # files have no source to check and are always scanned
+                if source is not None and module_name not in source:
+                    continue
+                scanner_class = self._scanner_for(file_path)
+                records = scanner_class(file_path, source=source).records
+            partial_data.add_file(file_path, records)
+            self._partial_scanned.add(file_path)
+
+        module_data = partial_data.get(module_name)
+        out = module_data.to_dict() if module_data else {}
+        for file_path, paths in aliases.items():
+            if file_path in out:
+                for alias in paths:
+                    out[alias] = list(out[file_path])
+        return out
+
+    def update_files(self, file_paths):
+        """
+        Rescans `file_paths` and patches only their entries in
+        `import_data`, paths that no longer exist are removed
+
+
+        Args:
+            file_paths ([]): Paths of created, modified or deleted files
+
+
+        Returns:
+            ImportChanges: top level modules that gained or lost importers
+        """
+        import_data = self.import_data
+        # The other paths of a changed file are updated with it
+        file_paths = list(file_paths)
+        seen = set(file_paths)
+        for file_path in list(file_paths):
+            for path in self._aliases.pop(file_path, ()):
+                if path not in seen:
+                    seen.add(path)
+                    file_paths.append(path)
+
+        before = {}
+        for file_path in file_paths:
+            before[file_path] = import_data.remove_file(file_path)
+
+        aliases = {}
+        existing = list(self._iter_unique(
+            (p for p in file_paths if os.path.isfile(p)), aliases))
+        for file_path, file_imports in self._scan_files(existing):
+            import_data.add_file(file_path, file_imports)
+            for alias in aliases.get(file_path, ()):
+                import_data.add_file(alias, file_imports)
+        self._set_aliases(aliases)
+
+        gained = collections.defaultdict(list)
+        lost = collections.defaultdict(list)
+        for file_path in file_paths:
+            old = before[file_path]
+            new = import_data.modules_of(file_path)
+            for module_name in new.difference(old):
+                gained[module_name].append(file_path)
+            for module_name in old.difference(new):
+                lost[module_name].append(file_path)
+
+        return ImportChanges(dict(gained), dict(lost), list(file_paths))
+
+    def _get_imports(self, progress=None, cancel=None):
+        # The files already scanned by `module_imports` are not scanned
+        # again
+        imports = self._partial_data
+        if imports is None:
+            imports = ImportData()
+        known = dict((p, imports.records(p)) for p in self._partial_scanned)
+        self._partial_data = None
+        self._partial_scanned = set()
+        self._partial_cache = None
+        self._aliases = {}
+        aliases = {}
+        file_paths = list(self._iter_unique(self._iter_file_paths(), aliases))
+        if self._cache is None:
+            scanned = self._scan_files(
+                file_paths, progress=progress, cancel=cancel, known=known)
+        else:
+            scanned = self._scan_files_cached(
+                file_paths, progress=progress, cancel=cancel, known=known)
+
+        for file_path, file_imports in scanned:
+            if file_path not in known:
+                imports.add_file(file_path, file_imports)
+            for alias in aliases.get(file_path, ()):
+                imports.add_file(alias, file_imports)
+        # Files deleted since `module_imports` scanned them
+        for file_path in set(known).difference(file_paths):
+            imports.remove_file(file_path)
+        self._set_aliases(aliases)
+
+        return imports
+
+    def _set_aliases(self, aliases):
+        """Maps every path of a file to all its paths, from `_iter_unique`"""
+        for file_path, paths in aliases.items():
+            group = [file_path] + paths
+            for path in group:
+                self._aliases[path] = group
+
+    def _get_cached_records(self):
+        """Returns `{path: ((mtime, size), records)}` from the cache"""
+        if self._cache is None:
+            return {}
+        scanner_name = self._scanner_class.__name__
+        out = {}
+        for root in self._roots:
+            for path, entry in self._cache.entries(root).items():
+                scanner, mtime, size, _, records = entry
+                if scanner == scanner_name:
+                    out[path] = ((mtime, size), records)
+        return out
+
+    def _read_file_source(self, file_path):
+        """Reads the source of a file, archive members included"""
+        member = self._archive_member(file_path)
+        if member is not None:
+            archive, info = member
+            return read_archive_members(
+                archive, [(file_path, info.filename)])[0][1]
+        return _read_file_source(file_path)
+
+    def _iter_unique(self, file_paths, aliases):
+        """
+        Yields the first path of every distinct file, the other paths to
+        the same file are collected in `aliases`, {file_path: [paths]}
+        """
+        if not self._dedupe:
+            for file_path in file_paths:
+                yield file_path
+            return
+
+        seen = {}
+        # Files are only hashed once another file has the same size
+        sizes = {}
+        # Overlapping roots reach the same paths more than once
+        paths = set()
+        for file_path in file_paths:
+            if file_path in paths:
+                continue
+            paths.add(file_path)
+            if self._archive_member(file_path) is not None:
+                yield file_path
+                continue
+
+            st = os.stat(file_path)
+            key = None
+            if st.st_ino:
+                key = (st.st_dev, st.st_ino)
+                if key not in seen and self._dedupe == 'hash':
+                    first = sizes.setdefault(st.st_size, file_path)
+                    if first != file_path:
+                        # Identical contents are as good as the same inode
+                        if first is not None:
+                            seen[(st.st_size, file_digest(first))] = first
+                            sizes[st.st_size] = None
+                        key = (st.st_size, file_digest(file_path))
+
+            if key is None:
+                yield file_path
+            elif key not in seen:
+                seen[key] = file_path
+                yield file_path
+            else:
+                aliases.setdefault(seen[key], []).append(file_path)
+
+    def _iter_file_paths(self):
+        for root in self._roots:
+            for file_path in self._iter_root_paths(root):
+                yield file_path
+
+    def _iter_root_paths(self, root):
+        if is_archive(root):
+            for file_path in self._iter_archive_paths(root):
+                yield file_path
+            return
+
+        matcher = self._matcher
+        for dirpath, dirnames, filenames in os.walk(root):
+            if self._sourceless and '__pycache__' in dirnames:
+                # Only caches of sources, which are scanned anyway
+                dirnames.remove('__pycache__')
+            prefix = os.path.relpath(dirpath, root)
+            if prefix == os.curdir:
+                prefix = ''
+            else:
+                prefix = prefix.replace(os.sep, '/') + '/'
+            # Pruned in place, excluded directories are never walked
+            dirnames[:] = [
+                d for d in dirnames
+                if not matcher.is_excluded(prefix + d, is_dir=True)
+            ]
             for filename in filenames:
                 if not filename.endswith('.py'):
+                    if not (self._sourceless and is_compiled_file(filename)
+                            and filename[:-1] not in filenames):
+                        continue
+                if matcher.is_excluded(prefix + filename):
                     continue
-                file_path = os.path.join(dirpath, filename)
-                file_imports = ImportScanner(file_path).imports
-                for (lineno, line, name, _) in file_imports:
-                    top_level_name = name.split('.', 1)[0]
-                    imports.setdefault(
-                        top_level_name,
-                        collections.defaultdict(list)
-                    )[file_path].append((lineno, line))
+                yield os.path.join(dirpath, filename)
 
-        return imports
+    def _iter_archive_paths(self, archive):
+        # Filled while walking, lazy consumers can look members up early
+        members = self._archive_members[archive] = {}
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if (info.filename.endswith('.py')
+                        and not self._is_excluded_member(info.filename)):
+                    file_path = os.path.join(
+                        archive, *info.filename.split('/'))
+                    members[file_path] = info
+                    yield file_path
+
+    def _is_excluded_member(self, member_name):
+        """Applies the rules to an archive member and its directories"""
+        parts = member_name.split('/')
+        for i in range(1, len(parts)):
+            if self._matcher.is_excluded('/'.join(parts[:i]), is_dir=True):
+                return True
+        return self._matcher.is_excluded(member_name)
+
+    def _archive_member(self, file_path):
+        """Returns `(archive, ZipInfo)` for an archive member path or `None`"""
+        for archive, members in self._archive_members.items():
+            info = members.get(file_path)
+            if info is not None:
+                return archive, info
+        return None
+
+    def _read_archive_sources(self, file_paths):
+        """Returns `{file_path: source}` for the archive members"""
+        if not self._archive_members:
+            return {}
+
+        by_archive = collections.defaultdict(list)
+        for file_path in file_paths:
+            member = self._archive_member(file_path)
+            if member is not None:
+                archive, info = member
+                by_archive[archive].append((file_path, info.filename))
+
+        sources = {}
+        for archive, members in by_archive.items():
+            sources.update(
+                read_archive_members(archive, members, threads=self._threads))
+        return sources
+
+    def _stat(self, file_path):
+        """
+        Returns `(mtime, size)` validating a cache entry, the CRC stands in
+        for the mtime of archive members
+        """
+        member = self._archive_member(file_path)
+        if member is not None:
+            info = member[1]
+            return float(info.CRC), info.file_size
+        st = os.stat(file_path)
+        return st.st_mtime, st.st_size
+
+    def _digest(self, file_path):
+        member = self._archive_member(file_path)
+        if member is not None:
+            return '{0:08x}'.format(member[1].CRC)
+        return file_digest(file_path)
+
+    def _scanner_for(self, file_path):
+        # Only the bytecode scanner reads compiled files
+        if is_compiled_file(file_path):
+            return ImportScanner
+        return self._scanner_class
+
+    def _scan_files_cached(self, file_paths, progress=None, cancel=None,
+                           known=None):
+        """
+        Yields `(file_path, imports)` in the order of `file_paths`, only
+        rescanning the files whose cache entry is stale, see `_scan_files`
+        for `known`
+        """
+        known = known or {}
+        cache = self._cache
+        scanner_name = self._scanner_class.__name__
+        entries = {}
+        for root in self._roots:
+            entries.update(cache.entries(root))
+
+        results = {}
+        stats = {}
+        digests = {}
+        updates = []
+        stale = []
+        for file_path in file_paths:
+            key = os.path.abspath(file_path)
+            st_mtime, st_size = self._stat(file_path)
+            stats[file_path] = (key, st_mtime, st_size)
+            entry = entries.pop(key, None)
+            if file_path in known:
+                results[file_path] = known[file_path]
+                if entry is None or entry[:3] != (
+                        scanner_name, st_mtime, st_size):
+                    digest = None
+                    if cache.use_hash:
+                        digest = self._digest(file_path)
+                    updates.append((
+                        key, scanner_name, st_mtime, st_size, digest,
+                        known[file_path]
+                    ))
+                continue
+            if entry is None or entry[0] != scanner_name:
+                stale.append(file_path)
+                continue
+
+            _, mtime, size, digest, file_imports = entry
+            if mtime == st_mtime and size == st_size:
+                results[file_path] = file_imports
+                continue
+
+            if cache.use_hash:
+                digests[file_path] = self._digest(file_path)
+                if digest == digests[file_path]:
+                    # Only touched, refresh the stat values of the entry
+                    results[file_path] = file_imports
+                    updates.append((
+                        key, scanner_name, st_mtime, st_size, digest,
+                        file_imports
+                    ))
+                    continue
+            stale.append(file_path)
+
+        scanned = self._scan_files(stale, progress=progress, cancel=cancel)
+        for file_path, file_imports in scanned:
+            results[file_path] = file_imports
+            key, mtime, size = stats[file_path]
+            digest = None
+            if cache.use_hash:
+                digest = digests.get(file_path) or self._digest(file_path)
+            updates.append(
+                (key, scanner_name, mtime, size, digest, file_imports))
+
+        cache.update(updates)
+        # Whatever is left was not found during the walk
+        cache.evict(entries.keys())
+
+        return ((p, results[p]) for p in file_paths)
+
+    def _iter_scan(self, file_paths, max_pending=None, cancel=None,
+                   chunksize=None):
+        """Yields `(file_path, records)` for an iterable of paths"""
+        chunks = self._iter_chunks(
+            file_paths, chunksize or self._STREAM_CHUNKSIZE)
+        if self._pool is None and (not self._workers or self._workers < 2):
+            for chunk in chunks:
+                for task in self._get_tasks(chunk):
+                    if cancel is not None and cancel.is_set():
+                        return
+                    yield _scan_file(task)
+            return
+
+        max_pending = max_pending or self._num_workers() * 2
+        # Only an event shared through a manager reaches the workers
+        worker_cancel = None
+        if isinstance(cancel, multiprocessing.managers.BaseProxy):
+            worker_cancel = cancel
+        done = queue.Queue()
+        handles = []
+        pending = 0
+        exhausted = False
+        pool = self._pool or multiprocessing.Pool(self._workers)
+        workers = set(self._pool_workers(pool))
+        try:
+            while True:
+                if cancel is not None and cancel.is_set():
+                    break
+                while not exhausted and pending < max_pending:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        exhausted = True
+                        break
+                    handles.append(pool.apply_async(
+                        _scan_chunk, (self._get_tasks(chunk), worker_cancel),
+                        callback=done.put))
+                    pending += 1
+                if not pending:
+                    break
+
+                try:
+                    ok, results = done.get(timeout=self._POLL_INTERVAL)
+                except queue.Empty:
+                    # A chunk that failed in the pool, e.g. its tasks could
+                    # not be pickled, never reaches the callback
+                    for handle in handles:
+                        if handle.ready() and not handle.successful():
+                            handle.get()
+                    handles = [h for h in handles if not h.ready()]
+                    # The chunk of a worker that died is never done
+                    workers.update(self._pool_workers(pool))
+                    self._check_workers(workers)
+                    continue
+                pending -= 1
+                if not ok:
+                    raise results
+                for result in results:
+                    yield result
+        finally:
+            # Also reached when the consumer closes the generator early,
+            # workers still busy with pending chunks are stopped. A shared
+            # pool is left to finish them, or to skip them once a shared
+            # cancel event is set.
+            if pool is not self._pool:
+                pool.terminate()
+                pool.join()
+
+    @staticmethod
+    def _pool_workers(pool):
+        # Pools do not expose their processes either
+        return getattr(pool, '_pool', None) or ()
+
+    @staticmethod
+    def _check_workers(workers):
+        """Raises `ScanWorkerError` when a worker exited abnormally"""
+        for process in workers:
+            if process.exitcode not in (None, 0):
+                msg = 'Scanning worker {0} exited with code {1}'.format(
+                    process.pid, process.exitcode)
+                raise exception.ScanWorkerError(msg)
+
+    def _num_workers(self):
+        if self._workers:
+            return self._workers
+        # Pools do not expose their size
+        return getattr(self._pool, '_processes', None) or 1
+
+    @staticmethod
+    def _iter_chunks(iterable, size):
+        iterator = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(iterator, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _get_tasks(self, file_paths):
+        sources = self._read_archive_sources(file_paths)
+        return [(self._scanner_for(p), p, sources.get(p))
+                for p in file_paths]
+
+    def _scan_files(self, file_paths, progress=None, cancel=None,
+                    known=None):
+        """
+        Yields `(file_path, imports)` in the order of `file_paths`, the
+        files in `known`, `{file_path: imports}`, are not scanned again
+        """
+        known = known or {}
+        results = dict((p, known[p]) for p in file_paths if p in known)
+        stale = [p for p in file_paths if p not in results]
+        # A few chunks per worker evens out files of uneven cost while
+        # keeping the per task overhead low.
+        chunksize = max(1, len(stale) // (self._num_workers() * 4))
+        scanned = self._iter_scan(stale, cancel=cancel, chunksize=chunksize)
+        for file_path, file_imports in scanned:
+            results[file_path] = file_imports
+            if progress is not None:
+                progress(file_path, len(results), len(file_paths))
+
+        if cancel is not None and cancel.is_set():
+            msg = 'Scan of "{0}" cancelled after {1} of {2} files'.format(
+                self._package_root, len(results), len(file_paths))
+            raise exception.ScanCancelledError(msg)
+        return ((p, results[p]) for p in file_paths)
+
+
+class ImportWatcher(object):
+    """
+    Watches the files of an `ImportFinder` by polling stat snapshots and
+    patches its `import_data` as files are created, modified or deleted
+    """
+    def __init__(self, finder, interval=1.0):
+        """
+        Args:
+            finder (ImportFinder): Finder whose `import_data` is kept
+                                   up to date
+            interval (float, optional): Seconds between two polls when
+                                        running with `start`
+        """
+        super(ImportWatcher, self).__init__()
+        self._finder = finder
+        self._interval = interval
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # Snapshot first, anything changing during the scan is then
+        # picked up by the first poll.
+        self._snapshot = self._take_snapshot()
+        self._finder.import_data
+
+    @property
+    def finder(self):
+        return self._finder
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def subscribe(self, callback):
+        """
+        Adds a callback called with an `ImportChanges` after each poll
+        that found changed files
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def poll(self):
+        """
+        Compares the files against the last snapshot and updates the
+        finder, returns an `ImportChanges` or `None` if nothing changed
+        """
+        with self._lock:
+            snapshot = self._take_snapshot()
+            previous = self._snapshot
+            changed = [p for p, stat in snapshot.items()
+                       if previous.get(p) != stat]
+            changed += [p for p in previous if p not in snapshot]
+            self._snapshot = snapshot
+            if not changed:
+                return None
+            changes = self._finder.update_files(sorted(changed))
+
+        for callback in list(self._subscribers):
+            callback(changes)
+        return changes
+
+    def start(self):
+        """Starts polling on a daemon thread"""
+        if self.running:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stops polling and waits for the polling thread to finish"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            self.poll()
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for file_path in self._finder.file_paths():
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            snapshot[file_path] = (st.st_mtime, st.st_size)
+        return snapshot
+
+
+# Differences between two `ImportSnapshot`, the modules and files are sorted
+# lists and the sites lists of `(module_name, file_path, lineno, line)`.
+ImportDiff = collections.namedtuple(
+    'ImportDiff', [
+        'added_modules', 'removed_modules', 'added_files', 'removed_files',
+        'added_sites', 'removed_sites',
+    ])
+
+
+class ImportSnapshot(object):
+    """
+    Scan result that can be saved and diffed against a later scan, e.g. to
+    catch dependency drift in CI. Every file has a fingerprint of its
+    imports, files whose fingerprint did not change are not compared site
+    by site. The fingerprint leaves the line numbers out, code moving
+    around does not make a difference.
+    """
+    _VERSION = 1
+
+    def __init__(self, files):
+        """
+        Args:
+            files (dict): {file_path: (fingerprint, sites)}, `sites` lists
+                          `(module_name, lineno, line)` tuples
+        """
+        super(ImportSnapshot, self).__init__()
+        self._files = files
+        self._modules = None
+
+    @classmethod
+    def from_import_data(cls, import_data):
+        """
+        Args:
+            import_data (dict): `ImportFinder.import_data`
+        """
+        sites = collections.defaultdict(list)
+        for module_name, module_data in import_data.items():
+            for file_path, file_sites in module_data.items():
+                sites[file_path].extend(
+                    (module_name, lineno, line) for lineno, line in file_sites)
+
+        files = {}
+        for file_path, file_sites in sites.items():
+            file_sites.sort(key=lambda s: (s[1] or 0, s[0]))
+            files[file_path] = (cls._fingerprint(file_sites), file_sites)
+        return cls(files)
+
+    @classmethod
+    def from_finder(cls, finder):
+        return cls.from_import_data(finder.import_data)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a snapshot saved with `save`"""
+        with open(path, 'r') as fp:
+            data = json.load(fp)
+        if data.get('version') != cls._VERSION:
+            msg = 'Unsupported snapshot version {0!r} in "{1}"'.format(
+                data.get('version'), path)
+            raise ValueError(msg)
+        # The sites stay lists, they are only unpacked
+        files = dict(
+            (file_path, tuple(entry))
+            for file_path, entry in data['files'].items()
+        )
+        return cls(files)
+
+    def save(self, path):
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        data = {'version': self._VERSION, 'files': self._files}
+        with open(path, 'w') as fp:
+            json.dump(data, fp)
+
+    @property
+    def files(self):
+        return sorted(self._files)
+
+    @property
+    def modules(self):
+        if self._modules is None:
+            self._modules = set(
+                s[0] for _, sites in self._files.values() for s in sites)
+        return sorted(self._modules)
+
+    def fingerprint(self, file_path):
+        return self._files[file_path][0]
+
+    def sites(self, file_path):
+        """Returns the `(module_name, lineno, line)` sites of a file"""
+        return [tuple(s) for s in self._files[file_path][1]]
+
+    def diff(self, other):
+        """
+        Compares a later snapshot against this one
+
+
+        Args:
+            other (ImportSnapshot): The later snapshot
+
+
+        Returns:
+            ImportDiff: What `other` added and removed
+        """
+        old, new = self._files, other._files
+        added_files = sorted(set(new).difference(old))
+        removed_files = sorted(set(old).difference(new))
+
+        added_sites = []
+        removed_sites = []
+        for file_path in added_files:
+            added_sites.extend(self._file_sites(file_path, new[file_path][1]))
+        for file_path in removed_files:
+            removed_sites.extend(
+                self._file_sites(file_path, old[file_path][1]))
+        for file_path in old:
+            if file_path not in new or old[file_path][0] == new[file_path][0]:
+                continue
+            old_sites, new_sites = old[file_path][1], new[file_path][1]
+            added_sites.extend(self._file_sites(
+                file_path, self._subtract(new_sites, old_sites)))
+            removed_sites.extend(self._file_sites(
+                file_path, self._subtract(old_sites, new_sites)))
+
+        old_modules, new_modules = set(self.modules), set(other.modules)
+        return ImportDiff(
+            sorted(new_modules.difference(old_modules)),
+            sorted(old_modules.difference(new_modules)),
+            added_files,
+            removed_files,
+            sorted(added_sites, key=self._sort_key),
+            sorted(removed_sites, key=self._sort_key),
+        )
+
+    @staticmethod
+    def _sort_key(site):
+        module_name, file_path, lineno, _ = site
+        return file_path, lineno or 0, module_name
+
+    @staticmethod
+    def _site_key(site):
+        module_name, lineno, line = site
+        if line is None:
+            return module_name, lineno
+        return module_name, line.strip()
+
+    @classmethod
+    def _fingerprint(cls, sites):
+        digest = hashlib.sha1()
+        for module_name, text in sorted(
+                cls._site_key(s) for s in sites):
+            text = '{0}\0{1}\n'.format(module_name, text)
+            if not isinstance(text, bytes):
+                text = text.encode('utf-8')
+            digest.update(text)
+        return digest.hexdigest()
+
+    @classmethod
+    def _subtract(cls, sites, others):
+        """Returns the sites not matched by one of `others`"""
+        counts = collections.Counter(cls._site_key(s) for s in others)
+        out = []
+        for site in sites:
+            key = cls._site_key(site)
+            if counts[key]:
+                counts[key] -= 1
+            else:
+                out.append(site)
+        return out
+
+    @staticmethod
+    def _file_sites(file_path, sites):
+        return [(module_name, file_path, lineno, line)
+                for module_name, lineno, line in sites]
+
+
+class ModuleGraph(object):
+    """
+    Resolved module dependency graph of a package
+
+    Nodes are the package's internal modules followed by the external top
+    level names they import. Edges are stored as compact adjacency arrays
+    (CSR), `offsets[i]:offsets[i + 1]` slices the targets of node `i`.
+    """
+    def __init__(self, names, num_internal, offsets, targets, files=None):
+        """
+        Args:
+            names ([]): Node names, internal modules first
+            num_internal (int): Number of internal modules in `names`
+            offsets (array): Start of each node's targets, `len(names) + 1`
+                             long
+            targets (array): Target node indices
+            files (dict, optional): {module_name: file_path}
+        """
+        super(ModuleGraph, self).__init__()
+        self._names = names
+        self._num_internal = num_internal
+        self._offsets = offsets
+        self._targets = targets
+        self._files = files or {}
+        self._index = dict((name, i) for i, name in enumerate(names))
+        self._reverse = None
+        self._sccs = None
+        self._modules_by_file = None
+
+    @classmethod
+    def from_finder(cls, finder):
+        """Builds the graph from the records of an `ImportFinder`"""
+        bases = []
+        for root in finder.roots:
+            root = os.path.abspath(root)
+            # A root that is a package itself contributes its own name
+            if os.path.isfile(os.path.join(root, '__init__.py')):
+                bases.append((root, os.path.dirname(root)))
+            else:
+                bases.append((root, root))
+        # Nested roots first, a file belongs to the deepest root
+        bases.sort(key=lambda b: len(b[0]), reverse=True)
+
+        import_data = finder.import_data
+        modules = {}
+        for file_path in import_data.file_paths():
+            module_name, is_package = cls._module_name(
+                cls._base_of(bases, file_path), file_path)
+            if module_name:
+                modules[module_name] = (file_path, is_package)
+
+        names = sorted(modules)
+        index = dict((name, i) for i, name in enumerate(names))
+        externals = {}
+        offsets = array.array('l', [0])
+        targets = array.array('l')
+        for module_name in names:
+            file_path, is_package = modules[module_name]
+            records = import_data.records(file_path)
+            deps = set()
+            for (_, _, name, fromlist, level) in records:
+                for dep, internal in cls._resolve(
+                        index, module_name, is_package, name, fromlist,
+                        level):
+                    if not internal:
+                        dep = externals.setdefault(
+                            dep, len(names) + len(externals))
+                    deps.add(dep)
+            targets.extend(sorted(deps))
+            offsets.append(len(targets))
+
+        num_internal = len(names)
+        for name, _ in sorted(externals.items(), key=lambda x: x[1]):
+            names.append(name)
+            offsets.append(len(targets))
+
+        files = dict((n, modules[n][0]) for n in names[:num_internal])
+        return cls(names, num_internal, offsets, targets, files=files)
+
+    @staticmethod
+    def _base_of(bases, file_path):
+        """Returns the directory module names of a file are relative to"""
+        file_path = os.path.abspath(file_path)
+        for root, base in bases:
+            if file_path.startswith(os.path.join(root, '')):
+                return base
+        return bases[-1][1]
+
+    @staticmethod
+    def _module_name(base, file_path):
+        """Returns `(module_name, is_package)` for a file under `base`"""
+        relpath = os.path.relpath(os.path.abspath(file_path), base)
+        parts = os.path.splitext(relpath)[0].split(os.sep)
+        is_package = parts[-1] == '__init__'
+        if is_package:
+            parts.pop()
+        return '.'.join(parts), is_package
+
+    @staticmethod
+    def _resolve(index, module_name, is_package, name, fromlist, level):
+        """Yields `(target, internal)`, internal targets are node indices"""
+        package = module_name if is_package else module_name.rpartition(
+            '.')[0]
+        if level > 0:
+            parts = package.split('.') if package else []
+            if level - 1 > len(parts):
+                return
+            parts = parts[:len(parts) - (level - 1)]
+            candidates = [('.'.join(parts + ([name] if name else [])), 1)]
+        else:
+            candidates = [(name, 1)]
+            # Implicit relative imports of Python 2 are tried first, these
+            # must resolve below the package and never to the package
+            # itself. Absolute imports (level 0) never resolve relatively.
+            if level == -1 and package and name:
+                candidates.insert(0, (
+                    '{0}.{1}'.format(package, name),
+                    package.count('.') + 2,
+                ))
+
+        for target, min_parts in candidates:
+            if not target:
+                continue
+            found = False
+            # `from package import module` depends on the submodules
+            for from_name in fromlist or ():
+                submodule = '{0}.{1}'.format(target, from_name)
+                if submodule in index:
+                    found = True
+                    yield index[submodule], True
+            if found:
+                return
+
+            # Longest internal prefix of the imported name
+            parts = target.split('.')
+            while len(parts) >= min_parts:
+                prefix = '.'.join(parts)
+                if prefix in index:
+                    found = True
+                    yield index[prefix], True
+                    break
+                parts.pop()
+
+            if found:
+                return
+
+        if level <= 0 and name:
+            yield name.split('.', 1)[0], False
+
+    @property
+    def modules(self):
+        """Returns the internal module names"""
+        return self._names[:self._num_internal]
+
+    @property
+    def externals(self):
+        """Returns the external top level names imported by the package"""
+        return self._names[self._num_internal:]
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def is_internal(self, name):
+        return self._index[name] < self._num_internal
+
+    def file_path(self, module_name):
+        return self._files.get(module_name)
+
+    def module_for_file(self, file_path):
+        """Returns the internal module of `file_path` or `None`"""
+        if self._modules_by_file is None:
+            self._modules_by_file = dict(
+                (os.path.abspath(path), name)
+                for name, path in self._files.items())
+        return self._modules_by_file.get(os.path.abspath(file_path))
+
+    def index_of(self, name):
+        """Returns the node index of `name`"""
+        return self._index[name]
+
+    def successors(self, i):
+        """Returns the target node indices of node `i`"""
+        return self._targets[self._offsets[i]:self._offsets[i + 1]]
+
+    def imports_of(self, name):
+        """Returns the names directly imported by `name`"""
+        i = self._index[name]
+        return [self._names[t]
+                for t in self._targets[self._offsets[i]:self._offsets[i + 1]]]
+
+    def importers_of(self, name):
+        """Returns the internal modules directly importing `name`"""
+        offsets, sources = self._get_reverse()
+        i = self._index[name]
+        return [self._names[s] for s in sources[offsets[i]:offsets[i + 1]]]
+
+    def reverse_dependencies(self, name):
+        """Returns the internal modules importing `name`, transitively"""
+        offsets, sources = self._get_reverse()
+        start = self._index[name]
+        seen = set([start])
+        stack = [start]
+        while stack:
+            i = stack.pop()
+            for s in sources[offsets[i]:offsets[i + 1]]:
+                if s not in seen:
+                    seen.add(s)
+                    stack.append(s)
+        seen.discard(start)
+        return sorted(self._names[i] for i in seen)
+
+    def strongly_connected_components(self):
+        """
+        Returns the strongly connected components of the internal modules
+        as lists of node indices, each component comes after every
+        component it imports
+        """
+        if self._sccs is None:
+            self._sccs = self._tarjan()
+        return self._sccs
+
+    def cycles(self):
+        """Returns the import cycles as sorted lists of module names"""
+        out = []
+        for scc in self.strongly_connected_components():
+            if len(scc) == 1:
+                i = scc[0]
+                targets = self._targets[self._offsets[i]:self._offsets[i + 1]]
+                if i not in targets:
+                    continue
+            out.append(sorted(self._names[i] for i in scc))
+        return out
+
+    def import_order(self):
+        """
+        Returns the internal modules in an order where each module comes
+        after the modules it imports, modules of a cycle are adjacent
+        """
+        return [self._names[i]
+                for scc in self.strongly_connected_components()
+                for i in sorted(scc)]
+
+    def _get_reverse(self):
+        if self._reverse is None:
+            num_nodes = len(self._names)
+            counts = array.array('l', [0]) * (num_nodes + 1)
+            for t in self._targets:
+                counts[t + 1] += 1
+            for i in range(num_nodes):
+                counts[i + 1] += counts[i]
+
+            sources = array.array('l', [0]) * len(self._targets)
+            fill = array.array('l', counts)
+            for i in range(self._num_internal):
+                for t in self._targets[self._offsets[i]:self._offsets[i + 1]]:
+                    sources[fill[t]] = i
+                    fill[t] += 1
+            self._reverse = (counts, sources)
+        return self._reverse
+
+    def _tarjan(self):
+        # Iterative Tarjan over the internal nodes, external nodes have no
+        # outgoing edges and never take part in a cycle.
+        num_internal = self._num_internal
+        offsets = self._offsets
+        targets = self._targets
+        index = array.array('l', [-1]) * num_internal
+        lowlink = array.array('l', [0]) * num_internal
+        on_stack = bytearray(num_internal)
+        stack = []
+        sccs = []
+        counter = 0
+
+        for root in range(num_internal):
+            if index[root] != -1:
+                continue
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack[root] = 1
+            work = [(root, offsets[root])]
+            while work:
+                node, pos = work[-1]
+                end = offsets[node + 1]
+                while pos < end:
+                    target = targets[pos]
+                    pos += 1
+                    if target >= num_internal:
+                        continue
+                    if index[target] == -1:
+                        break
+                    if on_stack[target] and index[target] < lowlink[node]:
+                        lowlink[node] = index[target]
+                else:
+                    target = None
+
+                if target is not None and index[target] == -1:
+                    work[-1] = (node, pos)
+                    index[target] = lowlink[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = 1
+                    work.append((target, offsets[target]))
+                    continue
+
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    scc = []
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = 0
+                        scc.append(member)
+                        if member == node:
+                            break
+                    sccs.append(scc)
+        return sccs
+
+
+class ReachabilityIndex(object):
+    """
+    Transitive import closure index over a `ModuleGraph`
+
+    The graph is condensed into its DAG of strongly connected components
+    and each component gets a bitset (a python int) of the components it
+    reaches, and lazily one of the components reaching it. Closure
+    queries are then a few big integer operations.
+    """
+    def __init__(self, graph):
+        super(ReachabilityIndex, self).__init__()
+        self._graph = graph
+        self._sccs = graph.strongly_connected_components()
+        num_internal = len(graph.modules)
+        component = array.array('l', [0]) * num_internal
+        for c, scc in enumerate(self._sccs):
+            for i in scc:
+                component[i] = c
+        self._component = component
+        self._dag, self._cyclic = self._condense()
+        self._descendants = self._build_descendants()
+        self._ancestors = None
+
+    @property
+    def graph(self):
+        return self._graph
+
+    def transitive_imports(self, module_name):
+        """Returns the internal modules `module_name` imports transitively"""
+        c = self._component_of(module_name)
+        return self._names(self._descendants[c], exclude=c)
+
+    def transitive_importers(self, module_name):
+        """Returns the internal modules importing `module_name` transitively"""
+        c = self._component_of(module_name)
+        return self._names(self._get_ancestors()[c], exclude=c)
+
+    def affected_by(self, paths):
+        """
+        Returns the internal modules affected by a change to `paths`, the
+        changed modules themselves and every module importing them
+
+
+        Args:
+            paths ([]): Changed file paths, paths not belonging to the
+                        graph are ignored
+
+
+        Returns:
+            [] of module names
+        """
+        ancestors = self._get_ancestors()
+        bits = 0
+        for path in paths:
+            module_name = self._graph.module_for_file(path)
+            if module_name is not None:
+                bits |= ancestors[self._component_of(module_name)]
+        return self._names(bits)
+
+    def _component_of(self, module_name):
+        return self._component[self._graph.index_of(module_name)]
+
+    def _condense(self):
+        graph = self._graph
+        component = self._component
+        num_internal = len(component)
+        dag = []
+        cyclic = bytearray(len(self._sccs))
+        for c, scc in enumerate(self._sccs):
+            successors = set()
+            for i in scc:
+                for t in graph.successors(i):
+                    if t < num_internal:
+                        successors.add(component[t])
+            if len(scc) > 1 or c in successors:
+                cyclic[c] = 1
+            successors.discard(c)
+            dag.append(tuple(successors))
+        return dag, cyclic
+
+    def _build_descendants(self):
+        # Components come in reverse topological order, every successor
+        # of a component is complete before the component itself.
+        descendants = []
+        for c, successors in enumerate(self._dag):
+            bits = 1 << c
+            for s in successors:
+                bits |= descendants[s]
+            descendants.append(bits)
+        return descendants
+
+    def _get_ancestors(self):
+        if self._ancestors is None:
+            ancestors = [1 << c for c in range(len(self._dag))]
+            for c in range(len(self._dag) - 1, -1, -1):
+                for s in self._dag[c]:
+                    ancestors[s] |= ancestors[c]
+            self._ancestors = ancestors
+        return self._ancestors
+
+    def _names(self, bits, exclude=None):
+        """Returns the module names of the components set in `bits`"""
+        # A module is only part of its own closure through a cycle
+        if exclude is not None and not self._cyclic[exclude]:
+            bits &= ~(1 << exclude)
+
+        names = self._graph.modules
+        out = []
+        # Bit `c` is the character at `c` in the reversed binary string
+        flags = bin(bits)[:1:-1]
+        c = flags.find('1')
+        while c != -1:
+            out.extend(names[i] for i in self._sccs[c])
+            c = flags.find('1', c + 1)
+        return sorted(out)
+
+
+def normalize_distribution_name(name):
+    """Returns the PEP 503 normalized form of a distribution name"""
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+class DistributionIndex(object):
+    """
+    Index mapping top level import names to what provides them, the
+    standard library, an installed distribution or a local package
+
+    The index is built once per interpreter from the standard library
+    and the distribution metadata in the site directories, persisted as
+    JSON and rebuilt only when a site directory changes.
+    """
+    STDLIB = 'stdlib'
+    DISTRIBUTION = 'distribution'
+    LOCAL = 'local'
+
+    def __init__(self, names=None, site_dirs=None):
+        """
+        Args:
+            names (dict, optional): {import_name: (kind, distribution)}
+            site_dirs (dict, optional): {site_dir: mtime} the index was
+                                        built from
+        """
+        super(DistributionIndex, self).__init__()
+        self._names = names or {}
+        self._site_dirs = site_dirs or {}
+
+    @classmethod
+    def default_path(cls):
+        """Returns the path the index of this interpreter is kept at"""
+        key = '{0}:{1}'.format(sys.executable, sys.version)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache')
+        return os.path.join(
+            cache_dir, 'compage', 'distindex-{0}.json'.format(digest))
+
+    @classmethod
+    def load(cls, path=None, site_dirs=None):
+        """
+        Returns the persisted index, building and saving it when missing
+        or out of date with the site directories
+
+
+        Args:
+            path (str, optional): Path of the persisted index, defaults to
+                                  `default_path()`
+            site_dirs ([], optional): Site directories to index, defaults
+                                      to the ones of the interpreter
+
+
+        Returns:
+            DistributionIndex
+        """
+        path = path or cls.default_path()
+        site_dir_mtimes = cls._site_dir_mtimes(site_dirs)
+        try:
+            with open(path, 'r') as fp:
+                data = json.load(fp)
+        except (IOError, OSError, ValueError):
+            data = None
+
+        if data is not None and data.get('site_dirs') == site_dir_mtimes:
+            names = dict((k, tuple(v)) for k, v in data['names'].items())
+            return cls(names=names, site_dirs=site_dir_mtimes)
+
+        index = cls.build(site_dirs=site_dirs)
+        index.save(path)
+        return index
+
+    @classmethod
+    def build(cls, site_dirs=None):
+        """
+        Builds the index of the running interpreter
+
+
+        Args:
+            site_dirs ([], optional): Site directories to index, defaults
+                                      to the ones of the interpreter
+
+
+        Returns:
+            DistributionIndex
+        """
+        if site_dirs is None:
+            site_dirs = cls._site_dirs()
+        names = {}
+        for name in cls._stdlib_names():
+            names[name] = (cls.STDLIB, None)
+        for site_dir in site_dirs:
+            for dist_name, top_level in cls._site_distributions(site_dir):
+                for name in top_level:
+                    # The standard library shadows backports
+                    names.setdefault(name, (cls.DISTRIBUTION, dist_name))
+        return cls(names=names, site_dirs=cls._site_dir_mtimes(site_dirs))
+
+    def save(self, path):
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.isdir(dir_name):
+            os.makedirs(dir_name)
+        data = {'names': self._names, 'site_dirs': self._site_dirs}
+        with open(path, 'w') as fp:
+            json.dump(data, fp)
+
+    def add_local(self, package_root):
+        """Adds the top level packages and modules under `package_root`"""
+        for _, name, _ in pkgutil.iter_modules([package_root]):
+            self._names[name] = (self.LOCAL, None)
+
+    def resolve(self, import_name):
+        """
+        Returns `(kind, distribution)` for a top level import name, kind
+        is one of `STDLIB`, `DISTRIBUTION` or `LOCAL`, both are `None`
+        for unknown names
+        """
+        return self._names.get(import_name.split('.', 1)[0], (None, None))
+
+    def distribution(self, import_name):
+        """Returns the distribution providing `import_name` or `None`"""
+        return self.resolve(import_name)[1]
+
+    def __contains__(self, import_name):
+        return import_name in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    @staticmethod
+    def _stdlib_names():
+        names = set(sys.builtin_module_names)
+        stdlib_names = getattr(sys, 'stdlib_module_names', None)
+        if stdlib_names is not None:
+            names.update(stdlib_names)
+            return names
+
+        stdlib = sysconfig.get_paths()['stdlib']
+        paths = [stdlib, os.path.join(stdlib, 'lib-dynload')]
+        for _, name, _ in pkgutil.iter_modules(paths):
+            names.add(name)
+        names.discard('site-packages')
+        return names
+
+    @staticmethod
+    def _site_dirs():
+        site_dirs = []
+        if hasattr(site, 'getsitepackages'):
+            site_dirs.extend(site.getsitepackages())
+        if getattr(site, 'ENABLE_USER_SITE', False):
+            site_dirs.append(site.getusersitepackages())
+        # Virtualenvs and PYTHONPATH entries not known to `site`
+        site_dirs.extend(p for p in sys.path if p.endswith('-packages'))
+
+        out = []
+        for site_dir in site_dirs:
+            if os.path.isdir(site_dir) and site_dir not in out:
+                out.append(site_dir)
+        return out
+
+    @classmethod
+    def _site_dir_mtimes(cls, site_dirs=None):
+        if site_dirs is None:
+            site_dirs = cls._site_dirs()
+        return dict((d, os.stat(d).st_mtime) for d in site_dirs)
+
+    @classmethod
+    def _site_distributions(cls, site_dir):
+        """Yields `(distribution, top_level_names)` of a site directory"""
+        for entry in os.listdir(site_dir):
+            base, ext = os.path.splitext(entry)
+            if ext not in ('.dist-info', '.egg-info'):
+                continue
+            meta_dir = os.path.join(site_dir, entry)
+            if not os.path.isdir(meta_dir):
+                continue
+
+            dist_name = base.split('-', 1)[0]
+            top_level = cls._read_lines(
+                os.path.join(meta_dir, 'top_level.txt'))
+            if not top_level:
+                top_level = cls._record_top_level(meta_dir)
+            yield dist_name, top_level
+
+    @staticmethod
+    def _read_lines(path):
+        try:
+            with open(path, 'r') as fp:
+                return [l.strip() for l in fp if l.strip()]
+        except (IOError, OSError):
+            return []
+
+    @classmethod
+    def _record_top_level(cls, meta_dir):
+        """Top level names from the files listed in a RECORD"""
+        names = set()
+        for line in cls._read_lines(os.path.join(meta_dir, 'RECORD')):
+            path = line.split(',', 1)[0]
+            first = path.split('/', 1)[0]
+            if (first.endswith(('.dist-info', '.egg-info', '.data')) or
+                    first.startswith(('..', '__'))):
+                continue
+            if '/' in path:
+                names.add(first)
+            elif first.endswith('.py'):
+                names.add(first[:-3])
+            elif first.endswith(('.so', '.pyd')):
+                names.add(first.split('.', 1)[0])
+        return sorted(names)
+
+
+# Run in a fresh interpreter by `ImportProfiler`, wraps `__import__` to time
+# every import that loads new modules and prints the records as JSON.
+_PROFILE_DRIVER = r'''
+import sys
+import time
+try:
+    import builtins
+except ImportError:
+    import __builtin__ as builtins
+try:
+    import tracemalloc
+    tracemalloc.start()
+
+    def memory():
+        return tracemalloc.get_traced_memory()[0]
+except ImportError:
+    def memory():
+        return 0
+
+timer = getattr(time, 'perf_counter', time.time)
+original_import = builtins.__import__
+records = []
+stack = []
+
+
+def resolve(name, globals, level):
+    if not level or not globals:
+        return name
+    package = globals.get('__package__') or globals.get('__name__', '')
+    if level > 1:
+        package = package.rsplit('.', level - 1)[0]
+    return '{0}.{1}'.format(package, name) if name else package
+
+
+def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    count = len(sys.modules)
+    parent = stack[-1][0] if stack else None
+    module_name = resolve(name, globals, level)
+    # Name the record after what gets loaded, the module itself or the
+    # submodules of a `from package import module`
+    if module_name in sys.modules:
+        for item in fromlist or ():
+            submodule = '{0}.{1}'.format(module_name, item)
+            if submodule not in sys.modules:
+                module_name = submodule
+                break
+    stack.append([module_name, 0.0, 0])
+    start_time, start_memory = timer(), memory()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = timer() - start_time
+        allocated = memory() - start_memory
+        _, child_time, child_memory = stack.pop()
+        if len(sys.modules) > count:
+            records.append((
+                module_name, parent, elapsed - child_time, elapsed,
+                allocated - child_memory, allocated))
+            if stack:
+                stack[-1][1] += elapsed
+                stack[-1][2] += allocated
+
+
+builtins.__import__ = timed_import
+try:
+    __import__(sys.argv[1])
+finally:
+    builtins.__import__ = original_import
+# Only imported now, the profiled module may import it too
+import json
+sys.stdout.write('\n' + sys.argv[2] + json.dumps(records) + '\n')
+'''
+
+
+# Measured cost of importing a module, times in seconds and memory in
+# bytes, `parent` is the module whose import triggered it.
+ImportCost = collections.namedtuple(
+    'ImportCost', [
+        'module', 'parent', 'self_time', 'cumulative_time', 'self_memory',
+        'cumulative_memory',
+    ])
+
+
+class ImportProfiler(object):
+    """
+    Measures what importing a module costs, in a clean subprocess, per
+    imported module with self and cumulative time and memory similar to
+    `python -X importtime`
+    """
+    _MARKER = '__compage_import_profile__:'
+
+    def __init__(self, module_name, python=None, sys_path=None, env=None):
+        """
+        Args:
+            module_name (str): Module to import
+            python (str, optional): Interpreter to run, defaults to the
+                                    current one
+            sys_path ([], optional): Paths to prepend to the module search
+                                     path, e.g. the package's site
+            env (dict, optional): Environment of the subprocess
+        """
+        super(ImportProfiler, self).__init__()
+        self._module_name = module_name
+        self._python = python or sys.executable
+        self._sys_path = sys_path or []
+        self._env = env
+        self._costs = None
+
+    @property
+    def costs(self):
+        """Returns the `ImportCost` of every module loaded, in load order"""
+        if self._costs is None:
+            self._costs = self._run()
+        return self._costs
+
+    def module_costs(self):
+        """
+        Returns the cumulative import time per top level name, counted
+        where the import enters the package so that submodules are not
+        counted twice
+
+
+        Returns:
+            dict: {top_level_name: seconds}
+        """
+        out = collections.defaultdict(float)
+        for cost in self.costs:
+            top_level_name = cost.module.split('.', 1)[0]
+            parent = (cost.parent or '').split('.', 1)[0]
+            if parent != top_level_name:
+                out[top_level_name] += cost.cumulative_time
+        return dict(out)
+
+    def join(self, import_data):
+        """
+        Attributes the measured cost to the import statements found by an
+        `ImportFinder`
+
+
+        Args:
+            import_data (dict): `ImportFinder.import_data`
+
+
+        Returns:
+            [] of `(seconds, module_name, file_path, lineno, line)`, most
+            expensive first
+        """
+        module_costs = self.module_costs()
+        out = []
+        for module_name, module_data in import_data.items():
+            seconds = module_costs.get(module_name)
+            if seconds is None:
+                continue
+            for file_path, sites in module_data.items():
+                for lineno, line in sites:
+                    out.append((seconds, module_name, file_path, lineno, line))
+        return sorted(out, key=lambda x: (-x[0], x[1], x[2], x[3]))
+
+    def _run(self):
+        env = dict(self._env if self._env is not None else os.environ)
+        if self._sys_path:
+            paths = list(self._sys_path)
+            if env.get('PYTHONPATH'):
+                paths.append(env['PYTHONPATH'])
+            env['PYTHONPATH'] = os.pathsep.join(paths)
+
+        process = subprocess.Popen(
+            [self._python, '-c', _PROFILE_DRIVER, self._module_name,
+             self._MARKER],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+        )
+        out, err = process.communicate()
+        out = _decode_source(out)
+        if process.returncode != 0 or self._MARKER not in out:
+            msg = "Unable to profile the import of '{0}':\n{1}".format(
+                self._module_name, _decode_source(err))
+            raise exception.ImportProfileError(msg)
+
+        data = out.rsplit(self._MARKER, 1)[1].strip()
+        return [ImportCost(*record) for record in json.loads(data)]
+
+
+# An import whose bound name is never used, `cost` is either the measured
+# seconds or the estimated bytes of code the import loads.
+UnusedImport = collections.namedtuple(
+    'UnusedImport', ['cost', 'module', 'name', 'file_path', 'lineno', 'line'])
+
+
+def find_unused_imports(finder, costs=None, include_init=False):
+    """
+    Finds the imports never used by the module importing them, ranked by
+    what they cost so that the ones slowing down startup the most come
+    first
+
+
+    Args:
+        finder (ImportFinder): Finder for the files to check, only source
+                               files on disk are checked
+        costs (dict, optional): Measured cost per top level name, e.g.
+                                `ImportProfiler.module_costs()`, the cost
+                                is estimated with `estimate_import_cost`
+                                when not given
+        include_init (bool, optional): Also check `__init__.py` files,
+                                       their imports are usually meant to
+                                       be re-exported
+
+
+    Returns:
+        [] of `UnusedImport`, most expensive first
+    """
+    estimates = {}
+    out = []
+    for file_path in finder.file_paths():
+        if not file_path.endswith('.py') or not os.path.isfile(file_path):
+            continue
+        if (not include_init
+                and os.path.basename(file_path) == '__init__.py'):
+            continue
+
+        for lineno, line, module, name in UsageScanner(file_path).unused:
+            if costs is not None:
+                cost = costs.get(module.split('.', 1)[0], 0.0)
+            else:
+                key = module
+                if module.startswith('.'):
+                    key = (os.path.dirname(file_path), module)
+                if key not in estimates:
+                    estimates[key] = estimate_import_cost(
+                        module, file_path=file_path)
+                cost = estimates[key]
+            out.append(
+                UnusedImport(cost, module, name, file_path, lineno, line))
+    return sorted(out, key=lambda x: (-x.cost, x.file_path, x.lineno))
+
+
+def estimate_import_cost(module_name, file_path=None):
+    """
+    Estimates what importing a module costs without importing it, as the
+    size in bytes of the code of its top level package. Builtin modules
+    and modules that can not be found are estimated at 0.
+
+
+    Args:
+        module_name (str): Name of the module, relative names start with
+                           dots
+        file_path (str, optional): File importing the module, required to
+                                   locate relative imports
+
+
+    Returns:
+        int
+    """
+    if module_name.startswith('.'):
+        if file_path is None:
+            return 0
+        level = len(module_name) - len(module_name.lstrip('.'))
+        base = os.path.dirname(file_path)
+        for _ in range(level - 1):
+            base = os.path.dirname(base)
+        parts = module_name[level:].split('.')[:1]
+        return _estimate_path_cost(os.path.join(base, *parts))
+
+    top_level_name = module_name.split('.', 1)[0]
+    if top_level_name in sys.builtin_module_names:
+        return 0
+    return _estimate_path_cost(_find_module_path(top_level_name))
+
+
+def _find_module_path(top_level_name):
+    """Returns the file or package directory of a top level module"""
+    if find_spec is not None:
+        try:
+            spec = find_spec(top_level_name)
+        except (ImportError, ValueError):
+            return None
+        if spec is None:
+            return None
+        if spec.submodule_search_locations:
+            return list(spec.submodule_search_locations)[0]
+        return spec.origin
+
+    import imp
+    try:
+        fp, pathname, _ = imp.find_module(top_level_name)
+    except ImportError:
+        return None
+    if fp is not None:
+        fp.close()
+    return pathname
+
+
+def _estimate_path_cost(path):
+    if not path:
+        return 0
+    if os.path.isdir(path):
+        size = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                if filename.endswith(('.py', '.so', '.pyd')):
+                    size += os.path.getsize(os.path.join(dirpath, filename))
+        return size
+    if os.path.isfile(path + '.py'):
+        return os.path.getsize(path + '.py')
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return 0
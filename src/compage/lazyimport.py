@@ -0,0 +1,337 @@
+"""
+Deferred imports, lazily loading module proxies and shims binding them
+generated from the scan data
+"""
+import os
+import sys
+import ast
+import time
+import types
+import importlib
+import threading
+
+
+from compage import formatter
+
+
+__all__ = [
+    'LazyModule',
+    'LazyImporter',
+    'module_level_imports',
+    'generate_shim',
+    'generate_shims',
+]
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is not imported yet, the first access to
+    one of its attributes imports the real module, which then replaces the
+    proxy in `sys.modules`
+    """
+    def __init__(self, name, on_load=None, import_name=None):
+        """
+        Args:
+            name (str): Name of the module to load
+            on_load (callable, optional): Called as `on_load(name, seconds)`
+                                          once the module is imported
+            import_name (str, optional): Module imported to load `name`,
+                                         e.g. 'os.path' for 'os' bound by
+                                         `import os.path`, defaults to
+                                         `name`
+        """
+        super(LazyModule, self).__init__(name)
+        # Set through the dict, `__setattr__` would load the module
+        state = _lazy_state(self)
+        state['_lazy_on_load'] = on_load
+        state['_lazy_import_name'] = import_name or name
+        state['_lazy_lock'] = threading.RLock()
+        state['_lazy_module'] = None
+
+    def __getattribute__(self, attr):
+        # Once loaded every access goes to the real module, a copy of its
+        # dict would not see the globals it rebinds later
+        module = _lazy_state(self)['_lazy_module']
+        if module is None:
+            return super(LazyModule, self).__getattribute__(attr)
+        return getattr(module, attr)
+
+    def __getattr__(self, attr):
+        return getattr(LazyModule._lazy_load(self), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(LazyModule._lazy_load(self), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(LazyModule._lazy_load(self), attr)
+
+    def __dir__(self):
+        return dir(LazyModule._lazy_load(self))
+
+    def __repr__(self):
+        module = _lazy_state(self)['_lazy_module']
+        if module is None:
+            return "<lazy module '{0}'>".format(self.__name__)
+        return repr(module)
+
+    def _lazy_load(self):
+        state = _lazy_state(self)
+        with state['_lazy_lock']:
+            module = state['_lazy_module']
+            if module is not None:
+                return module
+
+            name = self.__name__
+            if sys.modules.get(name) is self:
+                del sys.modules[name]
+            start = time.time()
+            try:
+                importlib.import_module(state['_lazy_import_name'])
+                module = sys.modules[name]
+            except Exception:
+                # Left in place so that the next access tries again
+                sys.modules.setdefault(name, self)
+                raise
+            seconds = time.time() - start
+
+            state['_lazy_module'] = module
+            on_load = state['_lazy_on_load']
+            if on_load is not None:
+                on_load(name, seconds)
+            return module
+
+
+def _lazy_state(proxy):
+    # The proxy's own dict, `proxy.__dict__` is the real module's once loaded
+    return object.__getattribute__(proxy, '__dict__')
+
+
+class LazyImporter(object):
+    """
+    Defers the import of the modules in an allowlist by placing lazy
+    proxies in `sys.modules`, and keeps track of the ones actually loaded
+    to verify that deferring them pays off, e.g. during a test run::
+
+        with LazyImporter(['numpy', 'yaml']) as lazy:
+            run_tests()
+        print(lazy.report())
+
+    The parent package of a submodule in the allowlist is imported when
+    the importer is installed.
+    """
+    def __init__(self, allowlist):
+        """
+        Args:
+            allowlist ([]): Names of the modules to defer
+        """
+        super(LazyImporter, self).__init__()
+        self._allowlist = sorted(set(allowlist))
+        self._proxies = {}
+        self._deferred = []
+        self._loaded = {}
+        self._lock = threading.Lock()
+
+    @property
+    def allowlist(self):
+        return list(self._allowlist)
+
+    @property
+    def installed(self):
+        return bool(self._proxies)
+
+    @property
+    def deferred(self):
+        """Names of the modules that were not imported at install time"""
+        return list(self._deferred)
+
+    @property
+    def loaded(self):
+        """Returns {module_name: seconds} for the deferred modules loaded"""
+        with self._lock:
+            return dict(self._loaded)
+
+    def install(self):
+        """Puts a proxy in `sys.modules` for every module not imported yet"""
+        for name in self._allowlist:
+            if name in sys.modules or name in self._proxies:
+                continue
+            proxy = LazyModule(name, on_load=self._on_load)
+            sys.modules[name] = proxy
+            parent_name, _, child = name.rpartition('.')
+            if parent_name:
+                setattr(importlib.import_module(parent_name), child, proxy)
+            self._proxies[name] = proxy
+            if name not in self._deferred:
+                self._deferred.append(name)
+        return self
+
+    def uninstall(self):
+        """Removes the proxies that were never loaded"""
+        for name, proxy in self._proxies.items():
+            if sys.modules.get(name) is not proxy:
+                continue
+            del sys.modules[name]
+            parent_name, _, child = name.rpartition('.')
+            parent = sys.modules.get(parent_name)
+            if parent is not None and getattr(parent, child, None) is proxy:
+                delattr(parent, child)
+        self._proxies = {}
+
+    def verify(self):
+        """Returns {module_name: loaded} for every deferred module"""
+        loaded = self.loaded
+        return dict((name, name in loaded) for name in self._deferred)
+
+    def report(self, width=70):
+        """Formats which deferred modules were loaded and which were not"""
+        loaded = self.loaded
+        out = ['\nLazy Import Report']
+        msg = 'Deferred modules loaded:'
+        out.append(formatter.format_header(msg=msg, width=width))
+        for name in sorted(loaded, key=lambda n: (-loaded[n], n)):
+            out.append("'{0}' ({1:.6f}s)".format(name, loaded[name]))
+
+        unused = [n for n in self._deferred if n not in loaded]
+        msg = 'Deferred modules never loaded:'
+        out.append(formatter.format_header(msg=msg, width=width))
+        out.append(formatter.format_iterable(unused))
+        return formatter.format_output(out, width=width)
+
+    def _on_load(self, name, seconds):
+        with self._lock:
+            self._loaded[name] = seconds
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.uninstall()
+
+
+def _is_allowed(module_name, allowlist):
+    return any(module_name == name or module_name.startswith(name + '.')
+               for name in allowlist)
+
+
+def module_level_imports(file_path, allowlist, source=None):
+    """
+    Finds the module level imports of allowlisted modules, i.e. the ones a
+    `__getattr__` shim can defer. Relative imports and imports nested in
+    functions, classes or conditional blocks are left alone.
+
+
+    Args:
+        file_path (str): Path of the file
+        allowlist ([]): Names of the modules to defer, submodules of a
+                        name match too
+        source (str, optional): Source of the file when already read
+
+
+    Returns:
+        [] of `(lineno, name, module_name, target, attr)`, `name` is the
+        name bound in the module, importing `module_name` makes
+        `sys.modules[target]` available and `attr` is the attribute taken
+        from it for `from` imports (None otherwise)
+    """
+    if source is None:
+        with open(file_path, 'r') as fp:
+            source = fp.read()
+    tree = compile(source + '\n', file_path, 'exec', ast.PyCF_ONLY_AST)
+
+    out = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if not _is_allowed(alias.name, allowlist):
+                    continue
+                if alias.asname:
+                    out.append((node.lineno, alias.asname, alias.name,
+                                alias.name, None))
+                else:
+                    top_level_name = alias.name.split('.', 1)[0]
+                    out.append((node.lineno, top_level_name, alias.name,
+                                top_level_name, None))
+        elif isinstance(node, ast.ImportFrom):
+            if node.level or not _is_allowed(node.module or '', allowlist):
+                continue
+            for alias in node.names:
+                if alias.name == '*':
+                    continue
+                out.append((node.lineno, alias.asname or alias.name,
+                            node.module, node.module, alias.name))
+    return out
+
+
+_SHIM_TEMPLATE = '''\
+# Deferred imports, replace the imports on line(s) {lines}
+from compage.lazyimport import LazyModule
+
+{entries}
+'''
+
+
+def generate_shim(file_path, allowlist, source=None):
+    """
+    Generates the code binding the names of the allowlisted `import`
+    statements of a file to `LazyModule` proxies, which import the module
+    on the first attribute access. The shim replaces the import
+    statements and the module's code keeps using the names as before.
+    `from` imports bind the attribute itself, they need the module at
+    import time and are left alone.
+
+
+    Args:
+        file_path (str): Path of the file
+        allowlist ([]): Names of the modules to defer
+        source (str, optional): Source of the file when already read
+
+
+    Returns:
+        str: Source of the shim, None when there is nothing to defer
+    """
+    imports = [
+        i for i in module_level_imports(file_path, allowlist, source=source)
+        if i[4] is None
+    ]
+    if not imports:
+        return None
+
+    lines = sorted(set(i[0] for i in imports))
+    entries = []
+    for _, name, module_name, target, _ in imports:
+        if module_name == target:
+            entries.append('{0} = LazyModule({1!r})'.format(name, target))
+        else:
+            entries.append('{0} = LazyModule({1!r}, import_name={2!r})'.format(
+                name, target, module_name))
+    return _SHIM_TEMPLATE.format(
+        lines=', '.join(map(str, lines)), entries='\n'.join(entries))
+
+
+def generate_shims(finder, allowlist):
+    """
+    Generates the shims for all the files of a package, the scan data
+    selects the files importing an allowlisted module
+
+
+    Args:
+        finder (ImportFinder): Finder for the package
+        allowlist ([]): Names of the modules to defer
+
+
+    Returns:
+        dict: {file_path: shim_source}
+    """
+    file_paths = set()
+    for module_name, module_data in finder.import_data.items():
+        if _is_allowed(module_name, allowlist):
+            file_paths.update(module_data.keys())
+
+    out = {}
+    for file_path in sorted(file_paths):
+        if not os.path.isfile(file_path):
+            continue
+        shim = generate_shim(file_path, allowlist)
+        if shim is not None:
+            out[file_path] = shim
+    return out
@@ -1,111 +1,587 @@
 """Various Reporters"""
+import os
+import csv
+import json
+import heapq
+import threading
+import collections
+import multiprocessing
+
+
 from compage import introspection, formatter
 
-__all__ = ['ImportReporter']
+__all__ = ['ImportReporter', 'LRUCache', 'CacheInfo']
+
+
+# Statistics of an `LRUCache`, as `functools.lru_cache` reports them
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class LRUCache(object):
+    """Thread safe cache keeping the most recently used entries"""
+    def __init__(self, maxsize=128):
+        """
+        Args:
+            maxsize (int, optional): Number of entries kept, `None` keeps
+                                     them all
+        """
+        super(LRUCache, self).__init__()
+        self._maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self._misses += 1
+                return default
+            self._data[key] = value
+            self._hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if self._maxsize is not None:
+                while len(self._data) > self._maxsize:
+                    self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(
+                self._hits, self._misses, self._maxsize, len(self._data))
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
 
 
 class ImportReporter(object):
+    # Fields of the records written by the exporters
+    RECORD_FIELDS = ('module', 'file', 'lineno', 'line')
+    # Records written to the sink at once
+    _WRITE_BATCH_SIZE = 1024
+    # What `rank_report` groups the imports by and weights them with
+    RANK_GROUPS = ('module', 'directory', 'file', 'distribution')
+    RANK_WEIGHTS = ('imports', 'files', 'cost')
+
     def __init__(
-            self, package_root, required_packages=None, ignore=None, width=70):
+            self, package_root, required_packages=None, ignore=None, width=70,
+            scanner='token', workers=None, cache=None, import_data=None,
+            dist_index=None, exclude=None, include=None, render_workers=None,
+            cache_size=256):
 
         super(ImportReporter, self).__init__()
         self._package_root = package_root
+        self._scanner = scanner
+        self._workers = workers
+        self._cache = cache
+        self._exclude = exclude
+        self._include = include
         self._required_packages = required_packages or []
         self._ignore = ignore or []
         self._width = width
-        self._import_data = self._get_import_data(self._package_root)
+        if dist_index is True:
+            dist_index = introspection.DistributionIndex.load()
+        self._dist_index = dist_index
+        self._required_distributions = set(
+            map(introspection.normalize_distribution_name,
+                self._required_packages))
+        # Scanned on first use, single module reports scan only the files
+        # mentioning the module
+        self._import_data = None
+        if import_data is not None:
+            self._import_data = self._get_import_data(
+                self._package_root, import_data=import_data)
+        self._finder = None
+        self._render_workers = render_workers
         self._report = None
-        self._rank = None
-        self._module_reports = {}
+        # Rendered module reports, without their header
+        self._module_reports = LRUCache(cache_size)
+
+    @property
+    def import_data(self):
+        if self._import_data is None:
+            self._import_data = self._get_import_data(self._package_root)
+        return self._import_data
 
     @property
     def modules(self):
-        return sorted(self._import_data.keys())
+        return sorted(self.import_data.keys())
 
     def import_report(self):
         if self._report is None:
-            self._report = self._get_report()
+            self._report = ''.join(self.iter_import_report())
         return self._report
 
-    def rank_report(self):
-        if self._rank is None:
-            self._rank = self._get_rank()
-        return self._rank
+    def iter_import_report(self):
+        """
+        Yields the import report in order, piece by piece, the module
+        reports are rendered ahead by `render_workers` processes
+        """
+        yield formatter.format_output(['\nImport Report'], width=self._width)
+        module_names = sorted(self.import_data.keys())
+        for module_report in self._iter_module_reports(module_names):
+            yield '\n' + module_report
+
+        if not self._required_packages:
+            return
+        required_extras = self._get_required_extras()
+        if required_extras:
+            msg = 'Following packages are required but never imported:'
+            out = [
+                formatter.format_header(msg=msg, width=self._width),
+                formatter.format_iterable(required_extras),
+            ]
+            yield '\n' + formatter.format_output(out, width=self._width)
+
+    def cache_info(self):
+        """Returns the `CacheInfo` of the module reports cache"""
+        return self._module_reports.info()
+
+    def rank_report(self, group_by='module', weight='imports', top=None,
+                    costs=None):
+        """
+        Ranks the imports, from counters the import data keeps up to date
+        so that the ranking reflects incremental scans without recounting
+
+
+        Args:
+            group_by (str, optional): One of `RANK_GROUPS`, the imported
+                                      module, the directory or file doing
+                                      the import, or the distribution of
+                                      the module (needs `dist_index`)
+            weight (str, optional): One of `RANK_WEIGHTS`, the number of
+                                    import sites, of importing files, or
+                                    the cost of the distinct modules
+                                    imported (needs `costs`)
+            top (int, optional): Only returns the `top` heaviest groups
+            costs (dict, optional): Cost per top level name, e.g.
+                                    `ImportProfiler.module_costs()`
+
+
+        Returns:
+            [] of `(group, weight)`, heaviest first
+        """
+        if group_by not in self.RANK_GROUPS:
+            msg = "Unknown group '{0}', expected one of {1}".format(
+                group_by, list(self.RANK_GROUPS))
+            raise ValueError(msg)
+        if weight not in self.RANK_WEIGHTS:
+            msg = "Unknown weight '{0}', expected one of {1}".format(
+                weight, list(self.RANK_WEIGHTS))
+            raise ValueError(msg)
+        if weight == 'cost' and costs is None:
+            raise ValueError("Ranking by 'cost' needs the module costs")
+        if group_by == 'distribution' and self._dist_index is None:
+            raise ValueError("Ranking by 'distribution' needs a dist_index")
+
+        rank = self._get_rank(group_by, weight, costs)
+        if top is not None:
+            return heapq.nlargest(top, rank, key=lambda x: x[1])
+        return sorted(rank, key=lambda x: x[1], reverse=True)
 
     def module_report(self, module_name):
-        return formatter.format_output(
-            self._get_module_report(module_name), width=self._width)
+        report_header = ("\nImport Report for '{0}'").format(module_name)
+        return '\n'.join([
+            formatter.format_output([report_header], width=self._width),
+            self._get_module_report(module_name),
+        ])
 
-    def _get_import_data(self, package_root):
-        import_data = introspection.ImportFinder(package_root).import_data
-        for name in self._ignore:
-            import_data.pop(name, None)
-        return import_data
+    def snapshot(self):
+        """Returns an `ImportSnapshot` of the import data"""
+        return introspection.ImportSnapshot.from_import_data(self.import_data)
 
-    def _get_report(self):
-        out = []
-        report_header = '\nImport Report'
-        out.append(report_header)
-        for module_name in sorted(self._import_data.keys()):
-            out += self._get_module_report(module_name, has_header=True)
+    def diff_report(self, baseline):
+        """
+        Reports the modules, files and import sites added or removed since
+        a baseline
 
-        if not self._required_packages:
-            return formatter.format_output(out, width=self._width)
 
-        required_extras = sorted(
-            set(self._required_packages).difference(self._import_data.keys()))
-        if required_extras:
-            msg = 'Following packages are required but never imported:'
+        Args:
+            baseline (ImportSnapshot or str): Earlier snapshot, or the path
+                                              it was saved to
+        """
+        if not isinstance(baseline, introspection.ImportSnapshot):
+            baseline = introspection.ImportSnapshot.load(baseline)
+        diff = baseline.diff(self.snapshot())
+
+        out = ['\nImport Diff Report']
+        sections = [
+            ('Added modules:', diff.added_modules, None),
+            ('Removed modules:', diff.removed_modules, None),
+            ('Added files:', diff.added_files, '"{0}"'),
+            ('Removed files:', diff.removed_files, '"{0}"'),
+        ]
+        for msg, names, item_format in sections:
+            if not names:
+                continue
+            out.append(formatter.format_header(msg=msg, width=self._width))
+            if item_format is None:
+                out.append(formatter.format_iterable(names))
+            else:
+                out += [item_format.format(n) for n in names]
+
+        for msg, sites in (('Added import sites:', diff.added_sites),
+                           ('Removed import sites:', diff.removed_sites)):
+            if not sites:
+                continue
             out.append(formatter.format_header(msg=msg, width=self._width))
-            out.append(formatter.format_iterable(required_extras))
+            for (module_name, file_path, lineno, line) in sites:
+                out.append("'{0}' in \"{1}\" line {2}:\n{3}".format(
+                    module_name, file_path, lineno, line))
+
+        if len(out) == 1:
+            out.append('No changes')
         return formatter.format_output(out, width=self._width)
 
-    def _get_module_report(self, module_name, has_header=False):
-        out = []
-        if not has_header:
-            report_header = ("\nImport Report for '{0}'").format(module_name)
-            out.append(report_header)
+    def iter_records(self):
+        """
+        Yields a `(module, file, lineno, line)` record per import site.
+        Before the import data is built the records are streamed as the
+        files are scanned, in scan order, without keeping them around.
+        Otherwise they are sorted by module and file.
+        """
+        if self._import_data is None:
+            ignore = set(self._ignore)
+            for file_path, imports in self._get_finder().iter_imports():
+                for lineno, line, name, _ in imports:
+                    module_name = name.split('.', 1)[0]
+                    if module_name not in ignore:
+                        yield (module_name, file_path, lineno,
+                               _strip_line(line))
+            return
 
-        if module_name not in self._module_reports:
-            self._module_reports[module_name] = self._generate_module_report(
-                module_name)
-        out += self._module_reports.get(module_name)
+        for module_name in sorted(self._import_data.keys()):
+            module_data = self._import_data[module_name]
+            for file_path in sorted(module_data.keys()):
+                for lineno, line in module_data[file_path]:
+                    yield module_name, file_path, lineno, _strip_line(line)
 
-        return out
+    def write_jsonl(self, sink):
+        """
+        Writes the records as JSON Lines, one object per import site
 
-    def _generate_module_report(self, module_name):
-        out = []
-        module_data = self._import_data.get(module_name)
-        if not module_data:
-            msg = "No data found for module '{0}'".format(module_name)
-            out.append(msg)
-            return out
 
-        required = None
+        Args:
+            sink (file): File like object to write to
+
+
+        Returns:
+            int: Number of records written
+        """
+        dumps = json.dumps
+        # Formatted by hand to keep the fields in order
+        template = '{{' + ', '.join(
+            '"{0}": {{{1}}}'.format(f, i)
+            for i, f in enumerate(self.RECORD_FIELDS)) + '}}'
+        # Consecutive records mostly share their values, which are only
+        # encoded when they change
+        last = [None] * len(self.RECORD_FIELDS)
+        encoded = ['null'] * len(self.RECORD_FIELDS)
+        count = 0
+        batch = []
+        for record in self.iter_records():
+            for i, value in enumerate(record):
+                if value != last[i]:
+                    last[i] = value
+                    encoded[i] = dumps(value)
+            batch.append(template.format(*encoded))
+            if len(batch) == self._WRITE_BATCH_SIZE:
+                sink.write('\n'.join(batch) + '\n')
+                count += len(batch)
+                batch = []
+        if batch:
+            sink.write('\n'.join(batch) + '\n')
+            count += len(batch)
+        return count
+
+    def write_csv(self, sink, header=True):
+        """
+        Writes the records as CSV, one row per import site. With Python 3
+        the sink should be opened with `newline=''`.
+
+
+        Args:
+            sink (file): File like object to write to
+            header (bool, optional): Whether to write the field names first
+
+
+        Returns:
+            int: Number of records written
+        """
+        writer = csv.writer(sink)
+        if header:
+            writer.writerow(self.RECORD_FIELDS)
+        count = 0
+        for record in self.iter_records():
+            writer.writerow(record)
+            count += 1
+        return count
+
+    def close(self):
+        """Closes the scan cache when it was given as a path"""
+        if self._finder is not None:
+            self._finder.close()
+
+    def _get_finder(self):
+        if self._finder is None:
+            self._finder = introspection.ImportFinder(
+                self._package_root,
+                scanner=self._scanner,
+                workers=self._workers,
+                cache=self._cache,
+                exclude=self._exclude,
+                include=self._include,
+            )
+        return self._finder
+
+    def _get_import_data(self, package_root, import_data=None):
+        if import_data is None:
+            import_data = self._get_finder().import_data
+        for name in self._ignore:
+            import_data.pop(name, None)
+        return import_data
+
+    def _get_module_data(self, module_name):
+        if self._import_data is not None:
+            return self._import_data.get(module_name)
+        if module_name in self._ignore:
+            return None
+        return self._get_finder().module_imports(module_name)
+
+    def _is_required(self, module_name):
+        if module_name in self._required_packages:
+            return True
+        if self._dist_index is None:
+            return False
+        # Import names often differ from distribution names, e.g. `yaml`
+        # is provided by `PyYAML`
+        dist_name = self._dist_index.distribution(module_name)
+        return (dist_name is not None and
+                introspection.normalize_distribution_name(dist_name)
+                in self._required_distributions)
+
+    def _get_required_extras(self):
+        imported = set(self.import_data.keys())
+        if self._dist_index is not None:
+            for module_name in list(imported):
+                dist_name = self._dist_index.distribution(module_name)
+                if dist_name is not None:
+                    imported.add(
+                        introspection.normalize_distribution_name(dist_name))
+        return sorted(
+            p for p in set(self._required_packages)
+            if p not in imported and
+            introspection.normalize_distribution_name(p) not in imported)
+
+    def _get_module_report(self, module_name):
+        module_report = self._module_reports.get(module_name)
+        if module_report is None:
+            module_report = self._render_module_report(module_name)
+            self._module_reports.put(module_name, module_report)
+        return module_report
+
+    def _render_module_report(self, module_name):
+        return _render_module_report(*self._get_render_args(module_name))
+
+    def _get_render_args(self, module_name):
+        """Returns the picklable arguments of `_render_module_report`"""
+        module_data = self._get_module_data(module_name)
+        if module_data:
+            module_data = dict(module_data)
+
         if self._required_packages:
-            if module_name in self._required_packages:
+            if self._is_required(module_name):
                 required = '\nIn Required: Yes'
             else:
                 required = '\nIn Required: No'
         else:
             required = ''
+        return module_name, module_data, required, self._width
+
+    def _iter_module_reports(self, module_names):
+        """Yields the module reports in order, rendering them in parallel"""
+        if not self._render_workers or self._render_workers < 2:
+            for module_name in module_names:
+                yield self._get_module_report(module_name)
+            return
+
+        # A bounded window of reports is rendered ahead of the consumer
+        window = self._render_workers * 4
+        pending = collections.deque()
+        module_names = iter(module_names)
+        # Rendering is bound to the interpreter, the workers are processes
+        # rendering from the data of a single module
+        pool = multiprocessing.Pool(self._render_workers)
+        try:
+            while True:
+                while len(pending) < window:
+                    module_name = next(module_names, None)
+                    if module_name is None:
+                        break
+                    module_report = self._module_reports.get(module_name)
+                    result = None
+                    if module_report is None:
+                        result = pool.apply_async(
+                            _render_module_report,
+                            self._get_render_args(module_name))
+                    pending.append((module_name, module_report, result))
+                if not pending:
+                    break
+                # Cached in order, the workers finish in any order and
+                # the most recent reports must be the ones kept
+                module_name, module_report, result = pending.popleft()
+                if result is not None:
+                    module_report = result.get()
+                    self._module_reports.put(module_name, module_report)
+                yield module_report
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def _get_rank(self, group_by, weight, costs):
+        """Yields `(group, weight)` for every group"""
+        def cost_of(module_names):
+            return sum(costs.get(m, 0.0) for m in module_names)
+
+        if group_by == 'module':
+            for module_name, sites, files in self._module_counts():
+                if weight == 'imports':
+                    yield module_name, sites
+                elif weight == 'files':
+                    yield module_name, files
+                else:
+                    yield module_name, costs.get(module_name, 0.0)
+
+        elif group_by == 'file':
+            for file_path, sites, module_names in self._file_counts():
+                if weight == 'imports':
+                    yield file_path, sites
+                elif weight == 'files':
+                    yield file_path, 1
+                else:
+                    yield file_path, cost_of(module_names)
+
+        elif group_by == 'directory':
+            for dir_path, sites, files, module_names in (
+                    self._directory_counts()):
+                if weight == 'imports':
+                    yield dir_path, sites
+                elif weight == 'files':
+                    yield dir_path, files
+                else:
+                    yield dir_path, cost_of(module_names)
+
+        else:
+            dists = {}
+            for module_name, sites, _ in self._module_counts():
+                dist_name = self._dist_index.distribution(module_name)
+                dist = dists.setdefault(dist_name or module_name, [0, set()])
+                dist[0] += sites
+                dist[1].add(module_name)
+            if weight == 'files':
+                # Files importing several modules of a distribution count
+                # once
+                files = collections.Counter()
+                for _, _, module_names in self._file_counts():
+                    files.update(set(
+                        self._dist_index.distribution(m) or m
+                        for m in module_names))
+            for dist_name, (sites, module_names) in dists.items():
+                if weight == 'imports':
+                    yield dist_name, sites
+                elif weight == 'files':
+                    yield dist_name, files[dist_name]
+                else:
+                    yield dist_name, cost_of(module_names)
+
+    def _module_counts(self):
+        if isinstance(self.import_data, introspection.ImportData):
+            return self.import_data.module_counts()
+        return ((module_name, sum(map(len, module_data.values())),
+                 len(module_data))
+                for module_name, module_data in self.import_data.items())
+
+    def _file_counts(self):
+        if isinstance(self.import_data, introspection.ImportData):
+            return self.import_data.file_counts()
+        # Plain dicts are counted on every call
+        files = {}
+        for module_name, module_data in self.import_data.items():
+            for file_path, sites in module_data.items():
+                counts = files.setdefault(file_path, [0, []])
+                counts[0] += len(sites)
+                counts[1].append(module_name)
+        return ((file_path, sites, tuple(module_names))
+                for file_path, (sites, module_names) in files.items())
+
+    def _directory_counts(self):
+        if isinstance(self.import_data, introspection.ImportData):
+            return self.import_data.directory_counts()
+        dirs = {}
+        for file_path, sites, module_names in self._file_counts():
+            counts = dirs.setdefault(
+                os.path.dirname(file_path), [0, 0, set()])
+            counts[0] += sites
+            counts[1] += 1
+            counts[2].update(module_names)
+        return ((dir_path, sites, files, tuple(module_names))
+                for dir_path, (sites, files, module_names) in dirs.items())
+
+
+def _render_module_report(module_name, module_data, required, width):
+    """
+    Renders the report of a module, module level to be picklable for
+    worker pools
+
+
+    Args:
+        module_name (str): Top level name of the module
+        module_data (dict): {file_path: [(lineno, line)]}, `None` when
+                            the module is not imported
+        required (str): 'In Required' part of the header, may be empty
+        width (int): Width of the report
+
+
+    Returns:
+        str: The report, without its header
+    """
+    out = []
+    if not module_data:
+        msg = "No data found for module '{0}'".format(module_name)
+        out.append(msg)
+        return formatter.format_output(out, width=width)
+
+    msg = "Module Name: '{0}'{1}".format(
+        module_name, required)
+    out.append(formatter.format_header(msg=msg, width=width))
+
+    for file_path in sorted(module_data.keys()):
+        import_data = module_data[file_path]
+        out.append('"{0}"'.format(file_path))
+        for (lineno, line) in import_data:
+            msg = "line {0}:\n{1}".format(lineno, line)
+            out.append(msg)
+
+    return formatter.format_output(out, width=width)
+
 
-        msg = "Module Name: '{0}'{1}".format(
-            module_name, required)
-        out.append(formatter.format_header(msg=msg, width=self._width))
-
-        for file_path in sorted(module_data.keys()):
-            import_data = module_data[file_path]
-            out.append('"{0}"'.format(file_path))
-            for (lineno, line) in import_data:
-                msg = "line {0}:\n{1}".format(lineno, line)
-                out.append(msg)
-
-        return out
-
-    def _get_rank(self):
-        _rank = []
-        for module_name, import_data in self._import_data.iteritems():
-            import_count = sum(map(len, import_data.values()))
-            _rank.append((module_name, import_count))
-        return sorted(_rank, key=lambda x: x[1], reverse=True)
+def _strip_line(line):
+    if line is None:
+        return None
+    return line.rstrip('\r\n')
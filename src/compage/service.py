@@ -4,6 +4,8 @@ A Code Server Manager - classes, functions and other code objects can be
 added as a service and retrieved when needed. Mostly helps in patterns like
 dependency injection.
 """
+import time
+import threading
 import collections
 
 
@@ -24,20 +26,35 @@ validatetoken = decorator.validatetype(
 )
 
 
+# Placeholder for a factory that runs on the first lookup of its token
+class _LazyService(object):
+    __slots__ = ('factory', 'args', 'kwargs', 'lock')
+
+    def __init__(self, factory, args, kwargs):
+        self.factory = factory
+        self.args = args
+        self.kwargs = kwargs
+        self.lock = threading.Lock()
+
+
 # Super Simple code object container using an OrderedDict
 class _CodeObjectServices(object):
     def __init__(self):
         super(_CodeObjectServices, self).__init__()
         self._services = collections.OrderedDict()
+        self._materialized = collections.OrderedDict()
+        # Guards the changes, lookups do not take it
+        self._lock = threading.Lock()
 
     @validatetoken
     def add_service(self, token, service, force=False, execute=False,
-                    pre_args=None, pre_kwargs=None):
+                    pre_args=None, pre_kwargs=None, lazy=False):
 
-        if token in self.tokens and not force:
-            msg = ("service with token '{0}' already exists, "
-                   "use force=True to overwrite".format(token))
-            raise exception.ServiceAlreadyExistsError(msg)
+        self._check_exists(token, force)
+        if lazy and not (execute and callable(service)):
+            msg = ("service with token '{0}' can only be added lazily when "
+                   "it is callable and executed".format(token))
+            raise exception.LazyServiceError(msg)
 
         if callable(service) and execute:
             # Execute (call ) the service object before storing it.
@@ -45,26 +62,51 @@ class _CodeObjectServices(object):
             # and an object instance in case of a class.
             args = pre_args or []
             kwargs = pre_kwargs or {}
-            service_obj = service(*args, **kwargs)
+            seconds = None
+            if lazy:
+                service_obj = _LazyService(service, args, kwargs)
+            else:
+                start = time.time()
+                service_obj = service(*args, **kwargs)
+                seconds = time.time() - start
         else:
             service_obj = service
-
-        self._services[token] = service_obj
+            seconds = None
+
+        with self._lock:
+            # Checked again, the service may have been added meanwhile
+            self._check_exists(token, force)
+            self._services[token] = service_obj
+            if seconds is None:
+                self._materialized.pop(token, None)
+            else:
+                self._materialized[token] = seconds
+
+    def _check_exists(self, token, force):
+        if token in self._services and not force:
+            msg = ("service with token '{0}' already exists, "
+                   "use force=True to overwrite".format(token))
+            raise exception.ServiceAlreadyExistsError(msg)
 
     @validatetoken
     def remove_service(self, token):
-        try:
-            self._services.pop(token)
-        except KeyError:
-            msg = "Service with token '{0}' does not exists, unable to remove"
-            raise exception.ServiceNotFoundError(msg)
+        with self._lock:
+            try:
+                self._services.pop(token)
+                self._materialized.pop(token, None)
+            except KeyError:
+                msg = ("Service with token '{0}' does not exists, "
+                       "unable to remove")
+                raise exception.ServiceNotFoundError(msg)
 
     @validatetoken
     def service_exists(self, token):
         return token in self._services
 
     def clear_all(self):
-        self._services.clear()
+        with self._lock:
+            self._services.clear()
+            self._materialized.clear()
 
     @property
     def id(self):
@@ -76,49 +118,66 @@ class _CodeObjectServices(object):
 
     @property
     def count(self):
-        return len(self.tokens)
+        return len(self._services)
+
+    @property
+    def materialized(self):
+        return collections.OrderedDict(self._materialized)
+
+    @property
+    def pending(self):
+        return [token for token, service in list(self._services.items())
+                if type(service) is _LazyService]
 
     def __getitem__(self, token):
-        if not self.count:
-            raise exception.NoServiceError("No services exists")
+        # The lookup comes first, the empty check is only needed to pick
+        # the exception once it failed
         try:
             service = self._services[token]
         except KeyError:
+            if not self._services:
+                raise exception.NoServiceError("No services exists")
             msg = ("No service with token '{0}'".format(token))
             raise exception.ServiceNotFoundError(msg)
-        else:
+        if type(service) is _LazyService:
+            return self._materialize(token, service)
+        return service
+
+    def _materialize(self, token, lazy_service):
+        with lazy_service.lock:
+            # Another thread may have built it while this one was waiting
+            try:
+                service = self._services[token]
+            except KeyError:
+                msg = ("No service with token '{0}'".format(token))
+                raise exception.ServiceNotFoundError(msg)
+            if service is not lazy_service:
+                if type(service) is _LazyService:
+                    # Replaced with another lazy factory (force=True)
+                    return self._materialize(token, service)
+                return service
+
+            start = time.time()
+            service = lazy_service.factory(
+                *lazy_service.args, **lazy_service.kwargs)
+            seconds = time.time() - start
+            # A factory that raised stays in place so the next lookup
+            # tries again. The token may have been removed or replaced
+            # while the factory ran, the caller still gets its service
+            # but it is not stored.
+            with self._lock:
+                if self._services.get(token) is lazy_service:
+                    self._services[token] = service
+                    self._materialized[token] = seconds
             return service
 
 
-# The descriptor allows for getting and attaching
-# _static_ objects stored in services dict.
-class _ServiceDescriptor(object):
-    def __init__(self, token, services):
-        super(_ServiceDescriptor, self).__init__()
-        self._token = token
-        self._services = services
-
-    def __get__(self, instance, owner):
-        return self.service
-
-    def __getattr__(self, name):
-        if name != 'service':
-            msg = "Unexpected attribute request other then 'service'"
-            raise exception.UnexpectedAttributeError(msg)
-
-        self.service = self._get_service()
-        return self.service
-
-    def _get_service(self):
-        return self._services[self._token]
-
-
 class ServiceManager(object):
     _services = _CodeObjectServices()
 
     @classmethod
     def add(cls, token, service, force=False, execute=True, pre_args=None,
-            pre_kwargs=None):
+            pre_kwargs=None, lazy=False):
         """
         Adds a service
 
@@ -133,6 +192,11 @@ class ServiceManager(object):
                                     adding
             pre_kwargs ({}, optional): Keyword arguments for pre execution of
                                       code before adding
+            lazy (bool, optional): When true, the execution is deferred to
+                                   the first `get` of the token, which runs
+                                   it once even with concurrent callers.
+                                   The service must be callable and
+                                   executed.
 
 
 
@@ -147,6 +211,7 @@ class ServiceManager(object):
             execute=execute,
             pre_args=pre_args,
             pre_kwargs=pre_kwargs,
+            lazy=lazy,
         )
 
     @classmethod
@@ -178,10 +243,7 @@ class ServiceManager(object):
         Returns:
             service (code object)
         """
-        class _Service(object):
-            obj = _ServiceDescriptor(token, cls._services)
-
-        return _Service.obj
+        return cls._services[token]
 
     @classmethod
     def remove_all(cls):
@@ -226,6 +288,29 @@ class ServiceManager(object):
         """
         return cls._services.count
 
+    @decorator.classproperty
+    def materialized(cls):
+        """
+        Returns the services built by executing their code, with the seconds
+        the execution took, in the order they were built
+
+
+        Returns:
+            OrderedDict: {token: seconds}
+        """
+        return cls._services.materialized
+
+    @decorator.classproperty
+    def pending(cls):
+        """
+        Returns the tokens of lazy services not built yet
+
+
+        Returns:
+            []
+        """
+        return cls._services.pending
+
     @decorator.classproperty
     def id(cls):
         """
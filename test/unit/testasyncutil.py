@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+
+try:
+    import asyncio
+    from compage import asyncutil
+except ImportError:
+    asyncio = None
+
+
+from compage import introspection, report
+
+
+@unittest.skipIf(asyncio is None, 'asyncio is not available')
+class TestAsyncImportReporter(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        for i in range(5):
+            path = os.path.join(cls.root, 'mod{0}.py'.format(i))
+            with open(path, 'w') as fp:
+                fp.write('import os\nimport json\n')
+        cls.pool = asyncutil.WorkerPool(processes=2, threads=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        if os.path.exists(cls.root):
+            shutil.rmtree(cls.root)
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def _run(self, get_future):
+        """Calls `get_future` from the running loop and waits on it"""
+        result = self.loop.create_future()
+
+        def on_done(future):
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(future.result())
+
+        self.loop.call_soon(lambda: get_future().add_done_callback(on_done))
+        return self.loop.run_until_complete(result)
+
+    def test_import_data(self):
+        progress = []
+        finder = asyncutil.AsyncImportFinder(self.root, self.pool)
+        import_data = self._run(lambda: finder.import_data(
+            progress=lambda *a: progress.append(a)))
+        self.assertEqual(
+            import_data, introspection.ImportFinder(self.root).import_data)
+        self.assertEqual(len(progress), 5)
+        self.assertEqual(progress[-1][1:], (5, 5))
+
+    def test_no_running_loop(self):
+        finder = asyncutil.AsyncImportFinder(self.root, self.pool)
+        with self.assertRaises(RuntimeError):
+            finder.import_data()
+
+        finder = asyncutil.AsyncImportFinder(
+            self.root, self.pool, loop=self.loop)
+        self.assertEqual(
+            self.loop.run_until_complete(finder.import_data()),
+            introspection.ImportFinder(self.root).import_data)
+
+    def test_reports(self):
+        reporter = asyncutil.AsyncImportReporter(self.root, self.pool)
+        expected = report.ImportReporter(self.root)
+        results = self._run(lambda: asyncio.gather(
+            reporter.import_report(),
+            reporter.rank_report(),
+            reporter.module_report('os'),
+        ))
+        self.assertEqual(results, [
+            expected.import_report(),
+            expected.rank_report(),
+            expected.module_report('os'),
+        ])
+
+    def test_cancel_skips_queued_chunks(self):
+        cancel = self.pool.event()
+        tasks = [(introspection.TokenImportScanner,
+                  os.path.join(self.root, 'mod0.py'), None)]
+        self.assertEqual(
+            len(introspection._scan_chunk(tasks, cancel)[1]), 1)
+        cancel.set()
+        self.assertEqual(introspection._scan_chunk(tasks, cancel), (True, []))
+
+
+if __name__ == '__main__':
+    unittest.main()
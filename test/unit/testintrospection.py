@@ -0,0 +1,1082 @@
+import os
+import sys
+import shutil
+import sqlite3
+import marshal
+import py_compile
+import tempfile
+import threading
+import unittest
+import zipfile
+
+
+from compage import introspection, exception
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+SOURCE = (
+    'import os\n'
+    'import os.path as osp, sys\n'
+    'from collections import (\n'
+    '    OrderedDict,\n'
+    '    defaultdict)\n'
+    'from json import *\n'
+    '\n'
+    '\n'
+    'def foo():\n'
+    '    import re\n'
+    '    return re\n'
+    '\n'
+    '\n'
+    'class Bar(object):\n'
+    '    import string\n'
+    '\n'
+    '    def baz(self):\n'
+    '        from textwrap import wrap\n'
+    '\n'
+    'try:\n'
+    '    import json\n'
+    'except ImportError:\n'
+    '    json = None\n'
+)
+
+
+EXPECTED_IMPORTS = [
+    (1, 'import os\n', 'os', None),
+    (2, 'import os.path as osp, sys\n', 'os.path', None),
+    (2, 'import os.path as osp, sys\n', 'sys', None),
+    (3, 'from collections import (\n', 'collections',
+     ['OrderedDict', 'defaultdict']),
+    (6, 'from json import *\n', 'json', []),
+    (21, '    import json\n', 'json', None),
+    (10, '    import re\n', 're', None),
+    (15, '    import string\n', 'string', None),
+    (18, '        from textwrap import wrap\n', 'textwrap', ['wrap']),
+]
+
+
+class CrashingScanner(introspection.TokenImportScanner):
+    """Scanner killing the worker process it runs in"""
+    def _scan(self):
+        os._exit(1)
+
+
+class TestImportScanners(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.file_path = os.path.join(cls.root, 'mod.py')
+        with open(cls.file_path, 'w') as fp:
+            fp.write(SOURCE)
+
+        cls.no_import_path = os.path.join(cls.root, 'empty.py')
+        with open(cls.no_import_path, 'w') as fp:
+            fp.write('x = 1\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.root):
+            shutil.rmtree(cls.root)
+
+    def _imports(self, scanner_class, path):
+        return [(lineno, line, name, list(fromlist)
+                 if fromlist is not None else None)
+                for lineno, line, name, fromlist
+                in scanner_class(path).imports]
+
+    def test_ast_scanner(self):
+        self.assertEqual(
+            self._imports(introspection.AstImportScanner, self.file_path),
+            EXPECTED_IMPORTS,
+        )
+
+    def test_token_scanner(self):
+        self.assertEqual(
+            self._imports(introspection.TokenImportScanner, self.file_path),
+            sorted(EXPECTED_IMPORTS, key=lambda i: i[0]),
+        )
+
+    def test_token_scanner_skips_strings(self):
+        path = os.path.join(self.root, 'strings.py')
+        with open(path, 'w') as fp:
+            fp.write(
+                '"""\nimport foo\n"""\n'
+                'x = "import bar"  # import baz\n'
+                'from os \\\n'
+                '    import path\n'
+            )
+        self.assertEqual(
+            self._imports(introspection.TokenImportScanner, path),
+            [(5, 'from os \\\n', 'os', ['path'])],
+        )
+        os.remove(path)
+
+    def test_token_scanner_compound_statements(self):
+        path = os.path.join(self.root, 'compound.py')
+        with open(path, 'w') as fp:
+            fp.write(
+                'import os; import sys  # ; import foo\n'
+                'try: from json import (loads,  # a; b\n'
+                '                       dumps)\n'
+                'except ImportError: import simplejson; x = {1: "import"}\n'
+                'importer = 1; fromage = 2\n'
+            )
+        expected = self._imports(introspection.AstImportScanner, path)
+        self.assertEqual(
+            self._imports(introspection.TokenImportScanner, path), expected)
+        self.assertEqual(
+            [i[2] for i in expected], ['os', 'sys', 'json', 'simplejson'])
+        os.remove(path)
+
+    def test_token_scanner_parentheses_in_comments(self):
+        sources = [
+            'import os  # legacy :(\n'
+            'import sys\n'
+            'import json\n'
+            'def foo():\n'
+            '    import re\n',
+            'from a import (b,  # see (c\n'
+            '    d)\n'
+            'import e\n',
+            'import f  # trailing \\\n'
+            'import g\n',
+        ]
+        path = os.path.join(self.root, 'comments.py')
+        for source in sources:
+            with open(path, 'w') as fp:
+                fp.write(source)
+            expected = self._imports(introspection.AstImportScanner, path)
+            self.assertEqual(
+                self._imports(introspection.TokenImportScanner, path),
+                expected)
+        self.assertEqual([i[2] for i in expected], ['f', 'g'])
+        os.remove(path)
+
+    def test_backends_agree(self):
+        self.assertEqual(
+            self._imports(introspection.AstImportScanner, self.file_path),
+            self._imports(introspection.ImportScanner, self.file_path),
+        )
+
+    def test_no_imports(self):
+        for scanner_class in introspection.SCANNERS.values():
+            self.assertEqual(scanner_class(self.no_import_path).imports, [])
+
+    def test_get_scanner(self):
+        self.assertIs(
+            introspection.get_scanner('bytecode'),
+            introspection.ImportScanner,
+        )
+        self.assertIs(
+            introspection.get_scanner(introspection.AstImportScanner),
+            introspection.AstImportScanner,
+        )
+        with self.assertRaises(ValueError):
+            introspection.get_scanner('foo')
+
+    def test_bytecode_scanner_finally(self):
+        root = tempfile.mkdtemp()
+        path = os.path.join(root, 'finally.py')
+        with open(path, 'w') as fp:
+            fp.write('try:\n    pass\nfinally:\n    import os\n')
+        self.assertEqual(
+            self._imports(introspection.ImportScanner, path),
+            [(4, '    import os\n', 'os', None)])
+        shutil.rmtree(root)
+
+    def test_finder_backends_agree(self):
+        import_data = {}
+        for name in introspection.SCANNERS:
+            import_data[name] = introspection.ImportFinder(
+                self.root, scanner=name).import_data
+        self.assertEqual(import_data['ast'], import_data['bytecode'])
+        for module_name, module_data in import_data['token'].items():
+            for file_path, imports in module_data.items():
+                self.assertEqual(
+                    sorted(imports),
+                    sorted(import_data['ast'][module_name][file_path]),
+                )
+
+    def test_finder_workers(self):
+        serial = introspection.ImportFinder(self.root).import_data
+        parallel = introspection.ImportFinder(
+            self.root, workers=2).import_data
+        self.assertEqual(parallel, serial)
+
+    def test_finder_cache(self):
+        cache_path = os.path.join(tempfile.mkdtemp(), 'scans.db')
+        cache = introspection.ScanCache(cache_path, use_hash=True)
+        expected = introspection.ImportFinder(self.root).import_data
+
+        cached = introspection.ImportFinder(self.root, cache=cache)
+        self.assertEqual(cached.import_data, expected)
+        self.assertEqual(
+            sorted(cache.entries(self.root)),
+            sorted(os.path.abspath(p) for p in (
+                self.file_path, self.no_import_path)),
+        )
+
+        # Touched files are reused, deleted ones are evicted
+        os.utime(self.file_path, (0, 0))
+        path = os.path.join(self.root, 'extra.py')
+        with open(path, 'w') as fp:
+            fp.write('import foo\n')
+        found = introspection.ImportFinder(self.root, cache=cache).import_data
+        self.assertEqual(
+            found['foo'], {path: [(1, 'import foo\n')]})
+        os.remove(path)
+
+        found = introspection.ImportFinder(self.root, cache=cache).import_data
+        self.assertEqual(found, expected)
+        self.assertNotIn(
+            os.path.abspath(path), cache.entries(self.root))
+        self.assertEqual(
+            cache.entries(self.root)[
+                os.path.abspath(self.file_path)][1], 0)
+
+        cache.close()
+        shutil.rmtree(os.path.dirname(cache_path))
+
+    def test_finder_cache_version(self):
+        cache_dir = tempfile.mkdtemp()
+        cache_path = os.path.join(cache_dir, 'scans.db')
+        # Records of the first format had no level
+        connection = sqlite3.connect(cache_path)
+        connection.execute(introspection.ScanCache._SCHEMA)
+        st = os.stat(self.file_path)
+        with connection:
+            connection.execute(
+                'INSERT INTO scans VALUES (?, ?, ?, ?, ?, ?)',
+                (os.path.abspath(self.file_path), 'TokenImportScanner',
+                 st.st_mtime, st.st_size, None,
+                 sqlite3.Binary(marshal.dumps([(1, None, 'os', None)]))))
+        connection.close()
+
+        expected = introspection.ImportFinder(self.root).import_data
+        with introspection.ImportFinder(self.root, cache=cache_path) as finder:
+            self.assertEqual(finder.import_data, expected)
+            cache = finder._cache
+            version = cache._connection.execute(
+                'PRAGMA user_version').fetchone()[0]
+            self.assertEqual(version, introspection.ScanCache.FORMAT_VERSION)
+        with self.assertRaises(sqlite3.ProgrammingError):
+            cache.entries(self.root)
+        shutil.rmtree(cache_dir)
+
+    def test_watcher(self):
+        finder = introspection.ImportFinder(self.root)
+        watcher = introspection.ImportWatcher(finder)
+        changes = []
+        watcher.subscribe(changes.append)
+        self.assertIsNone(watcher.poll())
+
+        path = os.path.join(self.root, 'watched.py')
+        with open(path, 'w') as fp:
+            fp.write('import foo\nimport os\n')
+        watcher.poll()
+        self.assertEqual(changes[-1].gained, {'foo': [path], 'os': [path]})
+        self.assertEqual(
+            finder.import_data['foo'], {path: [(1, 'import foo\n')]})
+
+        with open(path, 'w') as fp:
+            fp.write('import bar\nimport os\n')
+        os.utime(path, (0, 0))
+        watcher.poll()
+        self.assertEqual(changes[-1].gained, {'bar': [path]})
+        self.assertEqual(changes[-1].lost, {'foo': [path]})
+        self.assertNotIn('foo', finder.import_data)
+
+        os.remove(path)
+        watcher.poll()
+        self.assertEqual(changes[-1].lost, {'bar': [path], 'os': [path]})
+        self.assertEqual(
+            finder.import_data,
+            introspection.ImportFinder(self.root).import_data,
+        )
+        self.assertEqual(len(changes), 3)
+
+    def test_load_compiled(self):
+        root = tempfile.mkdtemp()
+        path = os.path.join(root, 'compiled.py')
+        with open(path, 'w') as fp:
+            fp.write('import foo\n')
+        self.assertIsNone(introspection.load_compiled(path))
+
+        py_compile.compile(path, doraise=True)
+        code = introspection.load_compiled(path)
+        self.assertEqual(code.co_names[0], 'foo')
+
+        # Stale once the source changes
+        os.utime(path, (0, 0))
+        self.assertIsNone(introspection.load_compiled(path))
+        shutil.rmtree(root)
+
+    @unittest.skipIf(sys.version_info < (3, 7), 'PEP 552 compiled files')
+    def test_load_compiled_hash_based(self):
+        root = tempfile.mkdtemp()
+        path = os.path.join(root, 'compiled.py')
+        with open(path, 'w') as fp:
+            fp.write('import foo\n')
+
+        py_compile.compile(
+            path, doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH)
+        self.assertEqual(
+            introspection.load_compiled(path).co_names[0], 'foo')
+        # Checked against the source, whatever its stat says
+        os.utime(path, (0, 0))
+        self.assertIsNotNone(introspection.load_compiled(path))
+        with open(path, 'w') as fp:
+            fp.write('import bar\n')
+        self.assertIsNone(introspection.load_compiled(path))
+
+        # Never checked
+        py_compile.compile(
+            path, doraise=True,
+            invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        with open(path, 'w') as fp:
+            fp.write('import baz\n')
+        self.assertEqual(
+            introspection.load_compiled(path).co_names[0], 'bar')
+        shutil.rmtree(root)
+
+    def test_sourceless(self):
+        root = tempfile.mkdtemp()
+        path = os.path.join(root, 'compiled.py')
+        with open(path, 'w') as fp:
+            fp.write('import foo\n')
+        py_compile.compile(path, path + 'c', doraise=True)
+        os.remove(path)
+
+        finder = introspection.ImportFinder(root)
+        self.assertEqual(finder.import_data, {})
+        finder = introspection.ImportFinder(root, sourceless=True)
+        self.assertEqual(
+            finder.import_data['foo'], {path + 'c': [(1, None)]})
+        shutil.rmtree(root)
+
+    def test_archive(self):
+        root = tempfile.mkdtemp()
+        archive = os.path.join(root, 'pkg-1.0-py2.py3-none-any.whl')
+        with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('pkg/__init__.py', 'import os\n')
+            zf.writestr('pkg/mod.py', 'x = 1\nimport foo.bar\n')
+            zf.writestr('pkg-1.0.dist-info/RECORD', 'import foo\n')
+        self.assertTrue(introspection.is_archive(archive))
+        self.assertFalse(introspection.is_archive(root))
+
+        expected = {
+            'os': {
+                os.path.join(archive, 'pkg', '__init__.py'):
+                    [(1, 'import os\n')],
+            },
+            'foo': {
+                os.path.join(archive, 'pkg', 'mod.py'):
+                    [(2, 'import foo.bar\n')],
+            },
+        }
+        for threads in (None, 2):
+            finder = introspection.ImportFinder(archive, threads=threads)
+            self.assertEqual(finder.import_data, expected)
+
+        cache = introspection.ScanCache(os.path.join(root, 'scans.db'))
+        for i in range(2):
+            finder = introspection.ImportFinder(archive, cache=cache)
+            self.assertEqual(finder.import_data, expected)
+            self.assertEqual(len(cache.entries(archive)), 2)
+        cache.close()
+        shutil.rmtree(root)
+
+    def test_module_imports(self):
+        finder = introspection.ImportFinder(self.root)
+        self.assertEqual(
+            finder.module_imports('collections'),
+            {self.file_path: [(3, 'from collections import (\n')]})
+        self.assertEqual(finder._partial_scanned, set([self.file_path]))
+        self.assertEqual(finder.module_imports('missing'), {})
+        self.assertEqual(
+            finder.module_imports('os'), finder.import_data['os'])
+
+    def test_module_imports_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        with introspection.ScanCache(
+                os.path.join(cache_dir, 'scans.db')) as cache:
+            expected = introspection.ImportFinder(
+                self.root, cache=cache).import_data
+
+            # Files with an up to date entry are not read
+            def read_file_source(file_path):
+                raise AssertionError(file_path)
+
+            finder = introspection.ImportFinder(self.root, cache=cache)
+            finder._read_file_source = read_file_source
+            self.assertEqual(finder.module_imports('os'), expected['os'])
+            self.assertEqual(
+                finder.module_imports('json'), expected['json'])
+        shutil.rmtree(cache_dir)
+
+    def test_module_imports_then_import_data(self):
+        cache_dir = tempfile.mkdtemp()
+        with introspection.ScanCache(
+                os.path.join(cache_dir, 'scans.db')) as cache:
+            finder = introspection.ImportFinder(self.root, cache=cache)
+            finder.module_imports('os')
+            self.assertEqual(finder._partial_scanned, set([self.file_path]))
+
+            # The full scan starts from the files already scanned
+            get_tasks = finder._get_tasks
+            scanned = []
+
+            def record_tasks(file_paths):
+                scanned.extend(file_paths)
+                return get_tasks(file_paths)
+
+            finder._get_tasks = record_tasks
+            self.assertEqual(
+                finder.import_data,
+                introspection.ImportFinder(self.root).import_data)
+            self.assertEqual(scanned, [self.no_import_path])
+
+            # And their cache entries are written
+            finder = introspection.ImportFinder(self.root, cache=cache)
+            finder._get_tasks = None
+            self.assertEqual(finder.import_data['os'], {
+                self.file_path: [(1, 'import os\n'),
+                                 (2, 'import os.path as osp, sys\n')]})
+        shutil.rmtree(cache_dir)
+
+    def test_iter_imports(self):
+        expected = [
+            (self.file_path,
+             introspection.TokenImportScanner(self.file_path).imports),
+            (self.no_import_path, []),
+        ]
+        for workers in (None, 2):
+            finder = introspection.ImportFinder(self.root, workers=workers)
+            self.assertEqual(sorted(finder.iter_imports()), sorted(expected))
+
+    def test_iter_imports_cancel(self):
+        finder = introspection.ImportFinder(self.root, workers=2)
+        stream = finder.iter_imports(max_pending=1)
+        next(stream)
+        stream.close()
+
+        cancel = threading.Event()
+        cancel.set()
+        finder = introspection.ImportFinder(self.root)
+        self.assertEqual(list(finder.iter_imports(cancel=cancel)), [])
+
+    def test_iter_imports_dead_worker(self):
+        finder = introspection.ImportFinder(
+            self.root, scanner=CrashingScanner, workers=2)
+        with self.assertRaises(exception.ScanWorkerError):
+            list(finder.iter_imports())
+
+    def test_iter_imports_unpicklable_scanner(self):
+        class LocalScanner(introspection.TokenImportScanner):
+            pass
+
+        finder = introspection.ImportFinder(
+            self.root, scanner=LocalScanner, workers=2)
+        with self.assertRaises((pickle.PicklingError, AttributeError,
+                                TypeError)):
+            list(finder.iter_imports())
+
+    def test_usage_scanner(self):
+        scanner = introspection.UsageScanner(self.file_path)
+        self.assertEqual(scanner.imports, introspection.AstImportScanner(
+            self.file_path).imports)
+        self.assertEqual(
+            [(lineno, module, name)
+             for lineno, _, module, name in scanner.unused],
+            [(1, 'os', 'os'), (2, 'os.path', 'osp'), (2, 'sys', 'sys'),
+             (3, 'collections', 'OrderedDict'),
+             (3, 'collections', 'defaultdict'),
+             (15, 'string', 'string'), (18, 'textwrap', 'wrap'),
+             (21, 'json', 'json')],
+        )
+
+    def test_usage_scanner_exports(self):
+        file_path = os.path.join(self.root, 'exports.py')
+        with open(file_path, 'w') as fp:
+            fp.write(
+                'from __future__ import print_function\n'
+                'import os, sys\n'
+                'from .sibling import helper\n'
+                '__all__ = ["helper"]\n'
+                'print(os.sep)\n'
+            )
+        try:
+            unused = introspection.UsageScanner(file_path).unused
+        finally:
+            os.remove(file_path)
+        self.assertEqual(
+            unused, [(2, 'import os, sys\n', 'sys', 'sys')])
+
+    def test_find_unused_imports(self):
+        finder = introspection.ImportFinder(self.root)
+        unused = introspection.find_unused_imports(
+            finder, costs={'textwrap': 2.0, 'sys': 1.0})
+        self.assertEqual(
+            [(u.cost, u.module, u.lineno) for u in unused[:3]],
+            [(2.0, 'textwrap', 18), (1.0, 'sys', 2), (0.0, 'os', 1)],
+        )
+
+        unused = introspection.find_unused_imports(finder)
+        self.assertEqual(unused[-1].module, 'sys')
+        self.assertEqual(unused[-1].cost, 0)
+        self.assertGreater(
+            dict((u.module, u.cost) for u in unused)['collections'], 0)
+
+
+class TestMultipleRoots(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.roots = [os.path.join(self.root, n) for n in ('a', 'b')]
+        for root in self.roots:
+            os.mkdir(root)
+        self.file_path = os.path.join(self.roots[0], 'mod.py')
+        with open(self.file_path, 'w') as fp:
+            fp.write('import os\n')
+        self.link_path = os.path.join(self.roots[1], 'link.py')
+        os.symlink(self.file_path, self.link_path)
+        self.copy_path = os.path.join(self.roots[1], 'copy.py')
+        shutil.copy(self.file_path, self.copy_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _scan(self, **kwargs):
+        scanned = []
+        # The roots overlap, the files under `a` are reached twice
+        finder = introspection.ImportFinder(
+            self.roots + [self.root], **kwargs)
+        finder.scan(progress=lambda p, *_: scanned.append(p))
+        return finder, scanned
+
+    def test_inode(self):
+        finder, scanned = self._scan()
+        self.assertEqual(
+            sorted(scanned), sorted([self.file_path, self.copy_path]))
+        self.assertEqual(
+            sorted(finder.import_data['os']),
+            sorted([self.file_path, self.link_path, self.copy_path]))
+        self.assertEqual(
+            finder.import_data['os'][self.link_path], [(1, 'import os\n')])
+
+    def test_hash(self):
+        finder, scanned = self._scan(dedupe='hash')
+        self.assertEqual(scanned, [self.file_path])
+        self.assertEqual(
+            sorted(finder.import_data['os']),
+            sorted([self.file_path, self.link_path, self.copy_path]))
+        self.assertEqual(
+            sorted(p for p, _ in finder.iter_imports()),
+            sorted([self.file_path, self.link_path, self.copy_path]))
+
+    def test_update_files(self):
+        finder, _ = self._scan(dedupe='hash')
+        with open(self.copy_path, 'w') as fp:
+            fp.write('import sys\n')
+        changes = finder.update_files([self.copy_path])
+        self.assertEqual(changes.gained, {'sys': [self.copy_path]})
+        self.assertEqual(
+            sorted(finder.import_data['os']),
+            sorted([self.file_path, self.link_path]))
+
+    def test_update_primary(self):
+        finder, _ = self._scan()
+        with open(self.file_path, 'w') as fp:
+            fp.write('import json\n')
+        changes = finder.update_files([self.file_path])
+        self.assertEqual(
+            sorted(changes.gained['json']),
+            sorted([self.file_path, self.link_path]))
+        self.assertEqual(
+            sorted(finder.import_data['json']),
+            sorted([self.file_path, self.link_path]))
+        self.assertEqual(list(finder.import_data['os']), [self.copy_path])
+
+    def test_iter_imports(self):
+        finder = introspection.ImportFinder(self.roots + [self.root])
+        imports = dict(finder.iter_imports())
+        self.assertEqual(
+            sorted(imports),
+            sorted([self.file_path, self.link_path, self.copy_path]))
+        self.assertEqual(imports[self.link_path], imports[self.file_path])
+
+    def test_no_dedupe(self):
+        finder, scanned = self._scan(dedupe=False)
+        self.assertEqual(len(scanned), 6)
+        with self.assertRaises(ValueError):
+            introspection.ImportFinder(self.root, dedupe='name')
+
+
+class TestPathMatcher(unittest.TestCase):
+    def test_patterns(self):
+        matcher = introspection.PathMatcher(
+            exclude=['*.pyc', 'build/', '/docs', 'a/**/z.py', '!keep.pyc',
+                     '# comment', 'data[0-9].py'])
+        self.assertTrue(matcher.is_excluded('x/y.pyc'))
+        self.assertFalse(matcher.is_excluded('x/keep.pyc'))
+        self.assertTrue(matcher.is_excluded('pkg/build', is_dir=True))
+        self.assertFalse(matcher.is_excluded('pkg/build'))
+        self.assertTrue(matcher.is_excluded('docs', is_dir=True))
+        self.assertFalse(matcher.is_excluded('pkg/docs', is_dir=True))
+        self.assertTrue(matcher.is_excluded('a/z.py'))
+        self.assertTrue(matcher.is_excluded('a/b/c/z.py'))
+        self.assertFalse(matcher.is_excluded('b/a/z.py'))
+        self.assertTrue(matcher.is_excluded('data1.py'))
+        self.assertFalse(matcher.is_excluded('datax.py'))
+        self.assertFalse(matcher.is_excluded('# comment'))
+
+    def test_include(self):
+        matcher = introspection.PathMatcher(
+            exclude=[], include=['src/**', '!src/gen_*.py'])
+        self.assertFalse(matcher.is_excluded('src/pkg/mod.py'))
+        self.assertTrue(matcher.is_excluded('src/gen_mod.py'))
+        self.assertTrue(matcher.is_excluded('setup.py'))
+        self.assertFalse(matcher.is_excluded('tests', is_dir=True))
+
+    def test_defaults(self):
+        matcher = introspection.PathMatcher(
+            exclude=introspection.PathMatcher.DEFAULT_EXCLUDES)
+        for path in ('.git', 'pkg/__pycache__', 'venv', 'build',
+                     'pkg.egg-info', 'node_modules'):
+            self.assertTrue(matcher.is_excluded(path, is_dir=True), path)
+        self.assertFalse(matcher.is_excluded('pkg/build', is_dir=True))
+
+        # Opt-in, nothing is excluded by default
+        matcher = introspection.PathMatcher()
+        self.assertFalse(matcher.is_excluded('.git', is_dir=True))
+        self.assertFalse(matcher.is_excluded('build/mod.py'))
+
+    def test_finder(self):
+        root = tempfile.mkdtemp()
+        try:
+            for path in ('pkg/mod.py', 'pkg/gen_mod.py', '.git/hook.py',
+                         'venv/lib/site.py', 'build/lib/mod.py'):
+                path = os.path.join(root, *path.split('/'))
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, 'w') as fp:
+                    fp.write('import os\n')
+
+            finder = introspection.ImportFinder(
+                root, exclude=introspection.PathMatcher.DEFAULT_EXCLUDES)
+            self.assertEqual(
+                sorted(finder.file_paths()),
+                [os.path.join(root, 'pkg', 'gen_mod.py'),
+                 os.path.join(root, 'pkg', 'mod.py')])
+
+            # Every file is scanned by default
+            self.assertEqual(
+                len(introspection.ImportFinder(root).file_paths()), 5)
+
+            finder = introspection.ImportFinder(
+                root, exclude=['gen_*.py'], include=['*.py'])
+            self.assertEqual(
+                sorted(finder.file_paths()),
+                [os.path.join(root, '.git', 'hook.py'),
+                 os.path.join(root, 'build', 'lib', 'mod.py'),
+                 os.path.join(root, 'pkg', 'mod.py'),
+                 os.path.join(root, 'venv', 'lib', 'site.py')])
+            self.assertEqual(
+                sorted(finder.import_data['os']),
+                sorted(finder.file_paths()))
+        finally:
+            shutil.rmtree(root)
+
+
+class TestImportData(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.root, 'pkg', 'mod.py')
+        os.mkdir(os.path.dirname(self.file_path))
+        with open(self.file_path, 'w') as fp:
+            fp.write(SOURCE)
+        self.records = introspection.AstImportScanner(self.file_path).records
+        self.import_data = introspection.ImportData()
+        self.import_data.add_file(self.file_path, self.records)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_mapping(self):
+        expected = {}
+        for lineno, line, name, _ in introspection.AstImportScanner(
+                self.file_path).imports:
+            expected.setdefault(name.split('.')[0], {}).setdefault(
+                self.file_path, []).append((lineno, line))
+        self.assertEqual(self.import_data, expected)
+        self.assertEqual(sorted(self.import_data.keys()), sorted(expected))
+        self.assertEqual(
+            self.import_data['os'][self.file_path],
+            [(1, 'import os\n'), (2, 'import os.path as osp, sys\n')])
+        self.assertIsNone(self.import_data.get('missing'))
+        self.assertNotIn('missing', self.import_data)
+
+    def test_interned_paths(self):
+        other_path = os.path.join(self.root, 'pkg', 'other.py')
+        with open(other_path, 'w') as fp:
+            fp.write('import os\n')
+        self.import_data.add_file(
+            other_path,
+            introspection.AstImportScanner(other_path).records)
+        self.assertEqual(
+            sorted(self.import_data['os'].keys()),
+            sorted([self.file_path, other_path]))
+        # Only the file name is new
+        self.assertEqual(
+            len(self.import_data._paths),
+            len(self.file_path.split(os.sep)) + 1)
+
+    def test_records(self):
+        self.assertEqual(
+            self.import_data.records(self.file_path),
+            [(lineno, line, name,
+              list(fromlist) if fromlist is not None else None, level)
+             for lineno, line, name, fromlist, level in self.records])
+        self.assertIsNone(self.import_data.records('missing.py'))
+
+        # Files without imports are kept, a graph has them as modules
+        empty_path = os.path.join(self.root, 'pkg', 'empty.py')
+        self.import_data.add_file(empty_path, [])
+        self.assertEqual(self.import_data.records(empty_path), [])
+        self.assertEqual(
+            sorted(self.import_data.file_paths()),
+            sorted([self.file_path, empty_path]))
+        self.import_data.remove_file(empty_path)
+        self.assertEqual(self.import_data.file_paths(), [self.file_path])
+
+    def test_lines_from_scan(self):
+        # The lines are the scanned ones, whatever is on disk now
+        with open(self.file_path, 'w') as fp:
+            fp.write('\n')
+        self.assertEqual(
+            self.import_data['json'][self.file_path][0],
+            (6, 'from json import *\n'))
+
+        other_path = os.path.join(self.root, 'pkg', 'other.py')
+        self.import_data.add_file(
+            other_path, [(1, 'import os\n', 'os', None, 0)])
+        self.assertIs(
+            self.import_data['os'][other_path][0][1],
+            self.import_data['os'][self.file_path][0][1])
+
+    def test_counts(self):
+        self.assertEqual(
+            sorted(self.import_data.module_counts())[:2],
+            [('collections', 1, 1), ('json', 2, 1)])
+        dir_path = os.path.dirname(self.file_path)
+        self.assertEqual(
+            list(self.import_data.file_counts())[0][:2], (self.file_path, 9))
+        self.assertEqual(
+            list(self.import_data.directory_counts())[0][:3],
+            (dir_path, 9, 1))
+
+        self.import_data.pop('json')
+        self.assertEqual(
+            sorted(self.import_data.module_counts())[:2],
+            [('collections', 1, 1), ('os', 2, 1)])
+        self.assertEqual(
+            list(self.import_data.file_counts())[0][:2], (self.file_path, 7))
+        self.import_data.remove_file(self.file_path)
+        self.assertEqual(list(self.import_data.module_counts()), [])
+        self.assertEqual(list(self.import_data.directory_counts()), [])
+
+    def test_remove_file(self):
+        self.assertEqual(
+            self.import_data.pop('sys'),
+            {self.file_path: [(2, 'import os.path as osp, sys\n')]})
+        self.assertEqual(
+            self.import_data.modules_of(self.file_path),
+            set(['os', 'collections', 'json', 're', 'string', 'textwrap']))
+        self.assertEqual(
+            self.import_data.remove_file(self.file_path),
+            set(['os', 'collections', 'json', 're', 'string', 'textwrap']))
+        self.assertEqual(self.import_data, {})
+        self.assertEqual(self.import_data.remove_file(self.file_path), set())
+
+
+class TestImportSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.sources = {
+            'a.py': 'import os\nimport sys\n',
+            'b.py': 'import json\n',
+            'c.py': 'import re\n',
+        }
+        self._write()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _write(self):
+        for name, source in self.sources.items():
+            with open(os.path.join(self.root, name), 'w') as fp:
+                fp.write(source)
+
+    def _snapshot(self):
+        return introspection.ImportSnapshot.from_finder(
+            introspection.ImportFinder(self.root))
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    def test_diff(self):
+        baseline = self._snapshot()
+        os.remove(self._path('c.py'))
+        del self.sources['c.py']
+        self.sources['a.py'] = '# moved\nimport os\nimport yaml\n'
+        self.sources['b.py'] = '\n\nimport json\n'
+        self.sources['d.py'] = 'import re\n'
+        self._write()
+
+        current = self._snapshot()
+        self.assertEqual(
+            baseline.fingerprint(self._path('b.py')),
+            current.fingerprint(self._path('b.py')))
+
+        diff = baseline.diff(current)
+        self.assertEqual(diff.added_modules, ['yaml'])
+        self.assertEqual(diff.removed_modules, ['sys'])
+        self.assertEqual(diff.added_files, [self._path('d.py')])
+        self.assertEqual(diff.removed_files, [self._path('c.py')])
+        self.assertEqual(diff.added_sites, [
+            ('yaml', self._path('a.py'), 3, 'import yaml\n'),
+            ('re', self._path('d.py'), 1, 'import re\n'),
+        ])
+        self.assertEqual(diff.removed_sites, [
+            ('sys', self._path('a.py'), 2, 'import sys\n'),
+            ('re', self._path('c.py'), 1, 'import re\n'),
+        ])
+        self.assertEqual(current.diff(current), ([], [], [], [], [], []))
+
+    def test_save_load(self):
+        snapshot = self._snapshot()
+        path = os.path.join(self.root, 'snapshots', 'baseline.json')
+        snapshot.save(path)
+        loaded = introspection.ImportSnapshot.load(path)
+        self.assertEqual(loaded.files, snapshot.files)
+        self.assertEqual(loaded.modules, ['json', 'os', 're', 'sys'])
+        self.assertEqual(
+            loaded.sites(self._path('a.py')),
+            [('os', 1, 'import os\n'), ('sys', 2, 'import sys\n')])
+        self.assertEqual(loaded.diff(snapshot), ([], [], [], [], [], []))
+
+        with open(path, 'w') as fp:
+            fp.write('{"version": 0}')
+        with self.assertRaises(ValueError):
+            introspection.ImportSnapshot.load(path)
+
+
+class TestModuleGraph(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.site = tempfile.mkdtemp()
+        sources = {
+            '__init__.py': 'from . import a\n',
+            'a.py': 'from .b import x\nimport os\n',
+            'b.py': 'import pkg.a\n',
+            'c.py': 'from pkg import b\nimport json\n',
+            'd.py': 'import pkg.d\nimport c\n',
+        }
+        os.makedirs(os.path.join(cls.site, 'pkg'))
+        for name, source in sources.items():
+            with open(os.path.join(cls.site, 'pkg', name), 'w') as fp:
+                fp.write(source)
+
+        cls.graph = introspection.ModuleGraph.from_finder(
+            introspection.ImportFinder(cls.site))
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.path.exists(cls.site):
+            shutil.rmtree(cls.site)
+
+    def test_nodes(self):
+        self.assertEqual(
+            self.graph.modules, ['pkg', 'pkg.a', 'pkg.b', 'pkg.c', 'pkg.d'])
+        self.assertEqual(sorted(self.graph.externals), ['c', 'json', 'os'])
+
+    def test_resolve_levels(self):
+        index = {'pkg': 0, 'pkg.json': 1, 'json': 2}
+        resolve = introspection.ModuleGraph._resolve
+
+        def targets(name, level):
+            return list(resolve(index, 'pkg.a', False, name, None, level))
+
+        self.assertEqual(targets('json', 0), [(2, True)])
+        self.assertEqual(targets('json', -1), [(1, True)])
+        self.assertEqual(targets('json', 1), [(1, True)])
+        self.assertEqual(targets('os', -1), [('os', False)])
+        self.assertEqual(targets('pkg', -1), [(0, True)])
+
+    def test_package_root(self):
+        graph = introspection.ModuleGraph.from_finder(
+            introspection.ImportFinder(os.path.join(self.site, 'pkg')))
+        self.assertEqual(graph.modules, self.graph.modules)
+
+    def test_imports_of(self):
+        self.assertEqual(self.graph.imports_of('pkg'), ['pkg.a'])
+        self.assertEqual(self.graph.imports_of('pkg.a'), ['pkg.b', 'os'])
+        self.assertEqual(self.graph.imports_of('pkg.c'), ['pkg.b', 'json'])
+        # Absolute imports never resolve to a sibling module
+        self.assertEqual(self.graph.imports_of('pkg.d'), ['pkg.d', 'c'])
+        self.assertEqual(self.graph.importers_of('pkg.c'), [])
+
+    def test_importers_of(self):
+        self.assertEqual(self.graph.importers_of('pkg.b'), ['pkg.a', 'pkg.c'])
+        self.assertEqual(self.graph.importers_of('os'), ['pkg.a'])
+        self.assertEqual(
+            self.graph.reverse_dependencies('pkg.a'),
+            ['pkg', 'pkg.b', 'pkg.c'],
+        )
+
+    def test_cycles(self):
+        self.assertEqual(
+            sorted(self.graph.cycles()), [['pkg.a', 'pkg.b'], ['pkg.d']])
+
+    def test_import_order(self):
+        order = self.graph.import_order()
+        self.assertEqual(sorted(order), self.graph.modules)
+        position = dict((name, i) for i, name in enumerate(order))
+        self.assertEqual(abs(position['pkg.a'] - position['pkg.b']), 1)
+        self.assertLess(position['pkg.b'], position['pkg.c'])
+        self.assertLess(position['pkg.a'], position['pkg'])
+
+    def test_reachability(self):
+        index = introspection.ReachabilityIndex(self.graph)
+        self.assertEqual(index.transitive_imports('pkg'), ['pkg.a', 'pkg.b'])
+        self.assertEqual(
+            index.transitive_imports('pkg.c'), ['pkg.a', 'pkg.b'])
+        # Modules of a cycle reach themselves
+        self.assertEqual(
+            index.transitive_imports('pkg.a'), ['pkg.a', 'pkg.b'])
+        self.assertEqual(index.transitive_importers('pkg.c'), [])
+        self.assertEqual(
+            index.transitive_importers('pkg.b'),
+            ['pkg', 'pkg.a', 'pkg.b', 'pkg.c'],
+        )
+
+    def test_affected_by(self):
+        index = introspection.ReachabilityIndex(self.graph)
+        paths = [os.path.join(self.site, 'pkg', 'c.py'), '/not/scanned.py']
+        self.assertEqual(index.affected_by(paths), ['pkg.c'])
+        paths = [os.path.join(self.site, 'pkg', 'b.py')]
+        self.assertEqual(
+            index.affected_by(paths), ['pkg', 'pkg.a', 'pkg.b', 'pkg.c'])
+
+
+class TestDistributionIndex(unittest.TestCase):
+    def setUp(self):
+        self.site = tempfile.mkdtemp()
+        dist_info = os.path.join(self.site, 'PyYAML-5.1.dist-info')
+        os.makedirs(dist_info)
+        with open(os.path.join(dist_info, 'top_level.txt'), 'w') as fp:
+            fp.write('_yaml\nyaml\n')
+        egg_info = os.path.join(self.site, 'python_dateutil-2.8.egg-info')
+        os.makedirs(egg_info)
+        with open(os.path.join(egg_info, 'RECORD'), 'w') as fp:
+            fp.write(
+                'dateutil/__init__.py,,\n'
+                'six.py,,\n'
+                'python_dateutil-2.8.egg-info/RECORD,,\n'
+            )
+
+    def tearDown(self):
+        shutil.rmtree(self.site)
+
+    def test_site_distributions(self):
+        dists = sorted(
+            introspection.DistributionIndex._site_distributions(self.site))
+        self.assertEqual(dists, [
+            ('PyYAML', ['_yaml', 'yaml']),
+            ('python_dateutil', ['dateutil', 'six']),
+        ])
+
+    def test_resolve(self):
+        index = introspection.DistributionIndex.build(site_dirs=[self.site])
+        self.assertEqual(
+            index.resolve('os.path'),
+            (introspection.DistributionIndex.STDLIB, None),
+        )
+        self.assertEqual(
+            index.resolve('yaml.loader'),
+            (introspection.DistributionIndex.DISTRIBUTION, 'PyYAML'),
+        )
+        self.assertEqual(index.resolve('six'), (
+            introspection.DistributionIndex.DISTRIBUTION, 'python_dateutil'))
+        self.assertEqual(index.resolve('not_a_module'), (None, None))
+
+        with open(os.path.join(self.site, 'localmod.py'), 'w') as fp:
+            fp.write('')
+        index.add_local(self.site)
+        self.assertEqual(
+            index.resolve('localmod'),
+            (introspection.DistributionIndex.LOCAL, None),
+        )
+
+    def test_load(self):
+        path = os.path.join(self.site, 'cache', 'index.json')
+        index = introspection.DistributionIndex.load(
+            path, site_dirs=[self.site])
+        self.assertTrue(os.path.isfile(path))
+        loaded = introspection.DistributionIndex.load(
+            path, site_dirs=[self.site])
+        self.assertEqual(len(loaded), len(index))
+        self.assertEqual(loaded.resolve('sys'), index.resolve('sys'))
+        self.assertEqual(loaded.resolve('yaml'), index.resolve('yaml'))
+
+    def test_normalize_distribution_name(self):
+        self.assertEqual(
+            introspection.normalize_distribution_name('Python_Date.Util'),
+            'python-date-util',
+        )
+
+
+class TestImportProfiler(unittest.TestCase):
+    def setUp(self):
+        self.site = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.site, 'profiled.py')
+        with open(self.file_path, 'w') as fp:
+            fp.write('import profiled_dep\n')
+        with open(os.path.join(self.site, 'profiled_dep.py'), 'w') as fp:
+            fp.write('x = [0] * 1000\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.site)
+
+    def test_costs(self):
+        profiler = introspection.ImportProfiler(
+            'profiled', sys_path=[self.site])
+        costs = dict((c.module, c) for c in profiler.costs)
+        self.assertIsNone(costs['profiled'].parent)
+        self.assertEqual(costs['profiled_dep'].parent, 'profiled')
+        self.assertGreaterEqual(
+            costs['profiled'].cumulative_time,
+            costs['profiled_dep'].cumulative_time,
+        )
+        self.assertEqual(
+            sorted(profiler.module_costs()), ['profiled', 'profiled_dep'])
+
+        import_data = introspection.ImportFinder(self.site).import_data
+        joined = profiler.join(import_data)
+        self.assertEqual(
+            [j[1:] for j in joined],
+            [('profiled_dep', self.file_path, 1, 'import profiled_dep\n')],
+        )
+
+    def test_error(self):
+        profiler = introspection.ImportProfiler('not_a_module_at_all')
+        with self.assertRaises(exception.ImportProfileError):
+            profiler.costs
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+
+from compage import introspection, lazyimport
+
+
+class TestLazyImport(unittest.TestCase):
+    def setUp(self):
+        self.site = tempfile.mkdtemp()
+        with open(os.path.join(self.site, 'lazy_heavy.py'), 'w') as fp:
+            fp.write('VALUE = 42\n')
+        with open(os.path.join(self.site, 'lazy_unused.py'), 'w') as fp:
+            fp.write('VALUE = 0\n')
+        self.file_path = os.path.join(self.site, 'lazy_user.py')
+        with open(self.file_path, 'w') as fp:
+            fp.write(
+                'import os\n'
+                'import lazy_heavy\n'
+                'from lazy_heavy import VALUE as value\n'
+                '\n'
+                'def foo():\n'
+                '    import lazy_unused\n'
+            )
+        sys.path.insert(0, self.site)
+
+    def tearDown(self):
+        sys.path.remove(self.site)
+        for name in ('lazy_heavy', 'lazy_unused', 'lazy_user'):
+            sys.modules.pop(name, None)
+        shutil.rmtree(self.site)
+
+    def test_importer(self):
+        importer = lazyimport.LazyImporter(
+            ['lazy_heavy', 'lazy_unused', 'os'])
+        with importer:
+            self.assertEqual(importer.deferred, ['lazy_heavy', 'lazy_unused'])
+            import lazy_heavy
+            self.assertIsInstance(lazy_heavy, lazyimport.LazyModule)
+            self.assertEqual(importer.loaded, {})
+
+            self.assertEqual(lazy_heavy.VALUE, 42)
+            self.assertNotIsInstance(
+                sys.modules['lazy_heavy'], lazyimport.LazyModule)
+
+        self.assertEqual(
+            importer.verify(), {'lazy_heavy': True, 'lazy_unused': False})
+        self.assertNotIn('lazy_unused', sys.modules)
+        self.assertIn("'lazy_unused'", importer.report())
+
+    def test_module_level_imports(self):
+        self.assertEqual(
+            lazyimport.module_level_imports(self.file_path, ['lazy_heavy']),
+            [(2, 'lazy_heavy', 'lazy_heavy', 'lazy_heavy', None),
+             (3, 'value', 'lazy_heavy', 'lazy_heavy', 'VALUE')],
+        )
+
+    def test_generate_shims(self):
+        finder = introspection.ImportFinder(self.site)
+        shims = lazyimport.generate_shims(
+            finder, ['lazy_heavy', 'lazy_unused', 'os'])
+        self.assertEqual(list(shims.keys()), [self.file_path])
+        self.assertIn('line(s) 1, 2', shims[self.file_path])
+
+        # Names used inside the module resolve to the proxies
+        namespace = {'__name__': 'lazy_user'}
+        exec(shims[self.file_path] + 'def foo():\n'
+             '    return lazy_heavy.VALUE\n', namespace)
+        self.assertNotIn('lazy_heavy', sys.modules)
+        self.assertIsInstance(namespace['lazy_heavy'], lazyimport.LazyModule)
+        self.assertEqual(namespace['foo'](), 42)
+        self.assertIn('lazy_heavy', sys.modules)
+        with self.assertRaises(AttributeError):
+            namespace['lazy_heavy'].missing
+
+    def test_submodule_proxy(self):
+        shim = lazyimport.generate_shim(
+            'mod.py', ['xml'], source='import xml.dom.minidom\n')
+        self.assertIn(
+            "xml = LazyModule('xml', import_name='xml.dom.minidom')", shim)
+        namespace = {}
+        exec(shim, namespace)
+        self.assertTrue(callable(namespace['xml'].dom.minidom.parseString))
+
+    def test_proxy_forwards(self):
+        proxy = lazyimport.LazyModule('lazy_heavy')
+        self.assertEqual(proxy.VALUE, 42)
+        module = sys.modules['lazy_heavy']
+
+        # Globals rebound by the module are read through the proxy
+        module.VALUE = 43
+        self.assertEqual(proxy.VALUE, 43)
+        proxy.OTHER = 1
+        self.assertEqual(module.OTHER, 1)
+        del proxy.OTHER
+        self.assertFalse(hasattr(module, 'OTHER'))
+        self.assertIs(proxy.__dict__, module.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
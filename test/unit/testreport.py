@@ -1,11 +1,18 @@
 import os
+import csv
+import json
 import unittest
 import tempfile
 import shutil
 import collections
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
-from compage import report, logger, formatter, packageutil
+
+from compage import report, logger, formatter, packageutil, introspection
 
 
 class TestImportReporter(unittest.TestCase):
@@ -128,6 +135,194 @@ class TestImportReporter(unittest.TestCase):
             reporter_module_report = self.import_reporter.module_report(module)
             self.assertEqual(reporter_module_report, test_module_report)
 
+    def test_lazy_module_report(self):
+        import_reporter = report.ImportReporter(
+            self.package_root,
+            required_packages=self.required_packages,
+            width=self.width,
+        )
+        for module in self.import_reporter.modules:
+            self.assertEqual(
+                import_reporter.module_report(module),
+                self.import_reporter.module_report(module),
+            )
+        self.assertIsNone(import_reporter._import_data)
+        self.assertEqual(import_reporter.modules, self.import_reporter.modules)
+
+    def _expected_records(self):
+        records = []
+        for file_name, imports in self.import_map.items():
+            for index, import_name in enumerate(imports):
+                records.append((
+                    import_name, self.file_paths.get(file_name), index + 1,
+                    'import {0}'.format(import_name)))
+        return sorted(records)
+
+    def test_write_jsonl(self):
+        for reporter in (self.import_reporter, report.ImportReporter(
+                self.package_root, width=self.width)):
+            sink = StringIO()
+            count = reporter.write_jsonl(sink)
+            records = [json.loads(line)
+                       for line in sink.getvalue().splitlines()]
+            self.assertEqual(count, len(records))
+            self.assertEqual(
+                sorted((r['module'], r['file'], r['lineno'], r['line'])
+                       for r in records),
+                self._expected_records())
+
+    def test_write_csv(self):
+        sink = StringIO()
+        count = self.import_reporter.write_csv(sink)
+        rows = list(csv.reader(StringIO(sink.getvalue())))
+        self.assertEqual(rows[0], list(report.ImportReporter.RECORD_FIELDS))
+        self.assertEqual(count, len(rows) - 1)
+        self.assertEqual(
+            sorted((m, f, int(n), l) for m, f, n, l in rows[1:]),
+            self._expected_records())
+
+    def test_diff_report(self):
+        baseline = self.import_reporter.snapshot()
+        self.assertIn('No changes', self.import_reporter.diff_report(baseline))
+
+        package_root = tempfile.mkdtemp()
+        try:
+            file_path = os.path.join(package_root, 'mod.py')
+            with open(file_path, 'w') as fp:
+                fp.write('import os\n')
+            import_reporter = report.ImportReporter(package_root)
+            baseline_path = os.path.join(package_root, 'baseline.json')
+            import_reporter.snapshot().save(baseline_path)
+
+            with open(file_path, 'w') as fp:
+                fp.write('import sys\n')
+            diff_report = report.ImportReporter(package_root).diff_report(
+                baseline_path)
+        finally:
+            shutil.rmtree(package_root)
+        self.assertIn("Added modules:\n{0}\n'sys'".format(
+            '-' * 70), diff_report)
+        self.assertIn("'os' in \"{0}\" line 1:".format(file_path),
+                      diff_report)
+
+    def test_rank_report_groups(self):
+        package_root = tempfile.mkdtemp()
+        try:
+            sub_dir = os.path.join(package_root, 'sub')
+            os.mkdir(sub_dir)
+            sources = {
+                os.path.join(package_root, 'a.py'): 'import os\nimport yaml\n',
+                os.path.join(package_root, 'b.py'): 'import os\nimport os\n',
+                os.path.join(sub_dir, 'c.py'): 'import yaml\nimport _yaml\n',
+            }
+            for file_path, source in sources.items():
+                with open(file_path, 'w') as fp:
+                    fp.write(source)
+
+            finder = introspection.ImportFinder(package_root)
+            dist_index = introspection.DistributionIndex(names={
+                'yaml': (introspection.DistributionIndex.DISTRIBUTION,
+                         'PyYAML'),
+                '_yaml': (introspection.DistributionIndex.DISTRIBUTION,
+                          'PyYAML'),
+            })
+            import_reporter = report.ImportReporter(
+                package_root, import_data=finder.import_data,
+                dist_index=dist_index)
+            rank_report = import_reporter.rank_report
+
+            self.assertEqual(
+                rank_report(top=1), [('os', 3)])
+            self.assertEqual(
+                sorted(rank_report(weight='files')),
+                [('_yaml', 1), ('os', 2), ('yaml', 2)])
+            self.assertEqual(
+                rank_report(group_by='directory'),
+                [(package_root, 4), (sub_dir, 2)])
+            self.assertEqual(
+                rank_report(group_by='file', weight='cost',
+                            costs={'os': 0.5, 'yaml': 2.0}),
+                [(os.path.join(package_root, 'a.py'), 2.5),
+                 (os.path.join(sub_dir, 'c.py'), 2.0),
+                 (os.path.join(package_root, 'b.py'), 0.5)])
+            self.assertEqual(
+                sorted(rank_report(group_by='distribution', weight='files')),
+                [('PyYAML', 2), ('os', 2)])
+            with self.assertRaises(ValueError):
+                rank_report(weight='cost')
+            with self.assertRaises(ValueError):
+                rank_report(group_by='package')
+
+            # Incremental scans are reflected without recounting
+            file_path = os.path.join(package_root, 'b.py')
+            with open(file_path, 'w') as fp:
+                fp.write('import yaml\n')
+            finder.update_files([file_path])
+            self.assertEqual(
+                rank_report(group_by='distribution'),
+                [('PyYAML', 4), ('os', 1)])
+            self.assertEqual(
+                rank_report(group_by='directory'),
+                [(package_root, 3), (sub_dir, 2)])
+        finally:
+            shutil.rmtree(package_root)
+
+    def test_parallel_rendering(self):
+        import_reporter = report.ImportReporter(
+            self.package_root,
+            required_packages=['not_imported'],
+            width=self.width,
+            render_workers=3,
+            cache_size=2,
+        )
+        serial_reporter = report.ImportReporter(
+            self.package_root,
+            required_packages=['not_imported'],
+            width=self.width,
+        )
+        self.assertEqual(
+            list(import_reporter.iter_import_report()),
+            list(serial_reporter.iter_import_report()))
+        self.assertEqual(
+            import_reporter.import_report(), serial_reporter.import_report())
+
+        info = import_reporter.cache_info()
+        self.assertEqual(info.maxsize, 2)
+        self.assertEqual(info.currsize, 2)
+
+        # The reports of the last modules are the ones kept
+        for module_name in import_reporter.modules[-2:]:
+            import_reporter.module_report(module_name)
+        self.assertEqual(import_reporter.cache_info().hits, info.hits + 2)
+
+    def test_lru_cache(self):
+        cache = report.LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.info(), report.CacheInfo(1, 1, 2, 2))
+
+    def test_distribution_index(self):
+        package_root = tempfile.mkdtemp()
+        with open(os.path.join(package_root, 'mod.py'), 'w') as fp:
+            fp.write('import yaml\nimport os\n')
+        dist_index = introspection.DistributionIndex(names={
+            'yaml': (introspection.DistributionIndex.DISTRIBUTION, 'PyYAML'),
+        })
+
+        import_reporter = report.ImportReporter(
+            package_root,
+            required_packages=['pyyaml', 'requests'],
+            dist_index=dist_index,
+        )
+        module_report = import_reporter.module_report('yaml')
+        self.assertIn('In Required: Yes', module_report)
+        self.assertEqual(import_reporter._get_required_extras(), ['requests'])
+        shutil.rmtree(package_root)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,8 @@
+import time
 import uuid
 import random
 import unittest
+import threading
 
 
 from compage import service, exception
@@ -105,6 +107,122 @@ class TestDependencyManager(unittest.TestCase):
         self.mgr.add(self.token_01, self.token_02, force=True)
         self.assertEquals(self.mgr.get(self.token_01), self.token_02)
 
+    def test_get_returns_stored_object(self):
+        code_object = InjectionDonor(self.token_01)
+        self.mgr.add(self.token_01, code_object)
+        self.assertIs(self.mgr.get(self.token_01), code_object)
+        self.assertIs(self.mgr.get(self.token_01), self.mgr.get(self.token_01))
+
+    def test_get_after_remove(self):
+        self.mgr.add(self.token_01, self.token_01)
+        self.mgr.add(self.token_02, self.token_02)
+        self.mgr.remove(self.token_01)
+        with self.assertRaises(exception.ServiceNotFoundError):
+            self.mgr.get(self.token_01)
+        self.mgr.remove(self.token_02)
+        with self.assertRaises(exception.NoServiceError):
+            self.mgr.get(self.token_02)
+
+    def test_lazy_service(self):
+        calls = []
+
+        def factory(foo):
+            calls.append(foo)
+            return InjectionDonor(foo)
+
+        self.mgr.add(self.token_01, factory, pre_args=[self.token_02],
+                     lazy=True)
+        self.assertEqual(calls, [])
+        self.assertEqual(self.mgr.pending, [self.token_01])
+        self.assertNotIn(self.token_01, self.mgr.materialized)
+
+        service = self.mgr.get(self.token_01)
+        self.assertEqual(service.foo, self.token_02)
+        self.assertIs(self.mgr.get(self.token_01), service)
+        self.assertEqual(calls, [self.token_02])
+        self.assertEqual(self.mgr.pending, [])
+        self.assertEqual(list(self.mgr.materialized), [self.token_01])
+
+        self.mgr.remove(self.token_01)
+        self.assertEqual(self.mgr.materialized, {})
+
+    def test_lazy_service_concurrent_get(self):
+        calls = []
+        started = threading.Event()
+
+        def factory():
+            calls.append(None)
+            started.set()
+            time.sleep(0.05)
+            return object()
+
+        self.mgr.add(self.token_01, factory, lazy=True)
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(self.mgr.get(self.token_01)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(started.is_set())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertEqual(len(set(map(id, results))), 1)
+        self.assertGreaterEqual(self.mgr.materialized[self.token_01], 0.04)
+
+    def test_lazy_service_retries_after_error(self):
+        calls = []
+
+        def factory():
+            calls.append(None)
+            if len(calls) == 1:
+                raise RuntimeError('first call fails')
+            return True
+
+        self.mgr.add(self.token_01, factory, lazy=True)
+        with self.assertRaises(RuntimeError):
+            self.mgr.get(self.token_01)
+        self.assertEqual(self.mgr.pending, [self.token_01])
+        self.assertTrue(self.mgr.get(self.token_01))
+        self.assertEqual(len(calls), 2)
+
+    def test_lazy_service_removed_while_building(self):
+        def factory():
+            self.mgr.remove(self.token_01)
+            return object()
+
+        self.mgr.add(self.token_01, factory, lazy=True)
+        self.mgr.add(self.token_02, self.token_02, execute=False)
+        self.assertIsNotNone(self.mgr.get(self.token_01))
+        self.assertFalse(self.mgr.exists(self.token_01))
+        self.assertNotIn(self.token_01, self.mgr.materialized)
+
+    def test_lazy_service_replaced_while_building(self):
+        def factory():
+            self.mgr.add(self.token_01, self.token_02, force=True,
+                         execute=False)
+            return self.token_01
+
+        self.mgr.add(self.token_01, factory, lazy=True)
+        self.assertEqual(self.mgr.get(self.token_01), self.token_01)
+        self.assertEqual(self.mgr.get(self.token_01), self.token_02)
+
+    def test_lazy_service_error(self):
+        with self.assertRaises(exception.LazyServiceError):
+            self.mgr.add(self.token_01, lambda: True, execute=False,
+                         lazy=True)
+        with self.assertRaises(exception.LazyServiceError):
+            self.mgr.add(self.token_01, self.token_01, lazy=True)
+        self.assertFalse(self.mgr.exists(self.token_01))
+
+    def test_eager_service_is_materialized(self):
+        self.mgr.add(self.token_01, lambda: True)
+        self.mgr.add(self.token_02, self.token_02, execute=False)
+        self.assertEqual(list(self.mgr.materialized), [self.token_01])
+
 
 if __name__ == '__main__':
     unittest.main()